@@ -0,0 +1,197 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ArtifactSet = Dict[str, np.ndarray]
+
+# Stored next to the arrays so hits can report the compute time they saved
+_SECONDS_KEY = '__compute_seconds__'
+
+
+class ArtifactCache:
+    """Content-addressed cache of preprocessed arrays, in memory and on disk.
+
+    Entries are sets of named NumPy arrays (resized images, landmarks,
+    masks) keyed by a hash of the source content. A bounded in-memory LRU
+    sits in front of an .npz store on disk; both evict least recently used
+    entries once over their byte budget. The disk store's size is tracked
+    in an index built once at startup, so writes never rescan the directory.
+    """
+
+    def __init__(self, cache_dir: str = None, max_memory_mb: int = None, max_disk_mb: int = None):
+        self.cache_dir = cache_dir or os.getenv('PREPROCESS_CACHE_DIR', '/tmp/preprocess_cache')
+        self.max_memory_bytes = (max_memory_mb or int(os.getenv('PREPROCESS_CACHE_MEMORY_MB', 256))) * 1024 ** 2
+        self.max_disk_bytes = (max_disk_mb or int(os.getenv('PREPROCESS_CACHE_DISK_MB', 2048))) * 1024 ** 2
+
+        self._memory: "OrderedDict[str, ArtifactSet]" = OrderedDict()
+        self._memory_bytes = 0
+        # File path -> size of the disk store, least recently used first
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'bytes_saved': 0,
+            'seconds_saved': 0.0,
+            'memory_evictions': 0,
+            'disk_evictions': 0
+        }
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan_disk()
+
+    @staticmethod
+    def key(namespace: str, *parts: bytes) -> str:
+        """Stable key for a namespace (artifact kind + version) and source content"""
+        digest = hashlib.sha256(namespace.encode())
+        for part in parts:
+            digest.update(part)
+        return digest.hexdigest()
+
+    @staticmethod
+    def _size(artifacts: ArtifactSet) -> int:
+        return sum(array.nbytes for array in artifacts.values())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.npz")
+
+    def _remember(self, key: str, artifacts: ArtifactSet):
+        """Insert into the memory LRU, evicting old entries past the budget"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return
+            self._memory[key] = artifacts
+            self._memory_bytes += self._size(artifacts)
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= self._size(evicted)
+                self.stats['memory_evictions'] += 1
+
+    def _scan_disk(self):
+        """Index the files left by earlier runs, least recently used first"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.npz'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        with self._lock:
+            for _, size, path in sorted(entries):
+                self._disk[path] = size
+                self._disk_bytes += size
+
+    def _index_disk(self, path: str, size: int):
+        """Record a file as the most recently used one on disk"""
+        with self._lock:
+            self._disk_bytes += size - self._disk.pop(path, 0)
+            self._disk[path] = size
+
+    def _read_disk(self, key: str) -> Optional[ArtifactSet]:
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                artifacts = {name: data[name] for name in data.files}
+            os.utime(path)  # keeps the LRU order for the next startup scan
+            self._index_disk(path, os.path.getsize(path))
+            return artifacts
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+
+    def _write_disk(self, key: str, artifacts: ArtifactSet):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **artifacts)
+        os.replace(tmp_path, path)
+        self._index_disk(path, os.path.getsize(path))
+        self._evict_disk()
+
+    def _evict_disk(self):
+        """Delete least recently used files until the disk budget fits"""
+        with self._lock:
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                path, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self.stats['disk_evictions'] += 1
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    # Already removed, e.g. by another worker sharing the directory
+                    pass
+
+    def get(self, key: str) -> Optional[ArtifactSet]:
+        with self._lock:
+            artifacts = self._memory.get(key)
+            if artifacts is not None:
+                self._memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+        if artifacts is None:
+            artifacts = self._read_disk(key)
+            if artifacts is None:
+                return None
+            self._remember(key, artifacts)
+            with self._lock:
+                self.stats['disk_hits'] += 1
+
+        with self._lock:
+            self.stats['bytes_saved'] += self._size(artifacts)
+            if _SECONDS_KEY in artifacts:
+                self.stats['seconds_saved'] += float(artifacts[_SECONDS_KEY])
+
+        return {name: array for name, array in artifacts.items() if name != _SECONDS_KEY}
+
+    def put(self, key: str, artifacts: ArtifactSet, compute_seconds: float = 0.0):
+        # Cached arrays are shared between jobs, so they must not be mutated
+        for array in artifacts.values():
+            array.setflags(write=False)
+        stored = {**artifacts, _SECONDS_KEY: np.array(compute_seconds)}
+        self._remember(key, stored)
+        try:
+            self._write_disk(key, stored)
+        except OSError as e:
+            logger.warning(f"Could not persist preprocessed artifacts {key[:12]}: {e}")
+
+    def get_or_compute(self, key: str, compute_fn: Callable[[], ArtifactSet]) -> ArtifactSet:
+        """Return cached artifacts for key, computing and storing them on a miss"""
+        artifacts = self.get(key)
+        if artifacts is not None:
+            return artifacts
+
+        with self._lock:
+            self.stats['misses'] += 1
+
+        start = time.perf_counter()
+        artifacts = compute_fn()
+        self.put(key, artifacts, time.perf_counter() - start)
+        return artifacts
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.stats['memory_hits'] + self.stats['disk_hits']
+            lookups = hits + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'memory_bytes': self._memory_bytes,
+                'memory_entries': len(self._memory),
+                'disk_bytes': self._disk_bytes,
+                'disk_entries': len(self._disk)
+            }
@@ -0,0 +1,437 @@
+"""Benchmark the processors and the worker loop on CPU with stub models.
+
+Usage (from gpu-service/):
+    python benchmarks/run.py --output results.json
+    python benchmarks/run.py --only image-generation,worker-loop --iterations 10
+    python benchmarks/run.py --output new.json --compare results.json
+
+Results are JSON (latency percentiles, throughput, peak memory per
+benchmark, plus the commit and environment) so runs can be compared
+across commits with --compare.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import urllib.request
+from datetime import datetime, timezone
+from typing import Dict, Any, Callable, List
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from queue_client import QueueClient
+from artifact_cache import ArtifactCache
+from gpu_manager import GPUManager
+from processors.image_generator import ImageGenerator
+from processors.cloth_swap import ClothSwapProcessor
+from processors.video_3d import Video3DGenerator
+from processors.study_animation import StudyAnimationGenerator
+from processors.story_video import StoryVideoGenerator
+from benchmarks.stubs import StubSDXLPipeline, StubPoseEstimator, InMemoryRedis
+
+logger = logging.getLogger(__name__)
+
+STUDY_SCRIPT = "Plants turn light into chemical energy. Chlorophyll absorbs red and blue light."
+STORY_SCRIPT = "The fox waited by the river at dawn.\n\nThe heron landed and the water went still."
+
+
+def seed_everything(seed: int = 0):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    values = np.array(latencies) * 1000
+    return {
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p99': float(np.percentile(values, 99)),
+        'mean': float(values.mean()),
+        'min': float(values.min()),
+        'max': float(values.max())
+    }
+
+
+def measure(run_once: Callable[[int], Dict[str, Any]], iterations: int, warmup: int = 1) -> Dict[str, Any]:
+    """Run a job `iterations` times after `warmup` runs; returns latency and memory stats"""
+    for i in range(warmup):
+        run_once(-1 - i)
+
+    latencies = []
+    results = []
+    tracemalloc.start()
+    metrics.reset_peak_memory()
+    try:
+        for i in range(iterations):
+            start = time.perf_counter()
+            results.append(run_once(i))
+            latencies.append(time.perf_counter() - start)
+        _, peak_traced = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'latency_ms': summarize(latencies),
+        'jobs_per_minute': iterations * 60 / sum(latencies),
+        'peak_rss_mb': metrics.peak_rss_bytes() / 1024 ** 2,
+        'peak_python_alloc_mb': peak_traced / 1024 ** 2,
+        'results': results
+    }
+
+
+def stub_image_generator(gpu_manager: GPUManager, pipe: StubSDXLPipeline) -> ImageGenerator:
+    generator = ImageGenerator(gpu_manager)
+    generator.load_model = lambda: pipe
+    generator.get_pipeline = lambda shared_pipe: shared_pipe
+    return generator
+
+
+def stub_cloth_swap(gpu_manager: GPUManager, workdir: str) -> ClothSwapProcessor:
+    processor = ClothSwapProcessor(gpu_manager)
+    processor.pose_estimator._create_estimator = StubPoseEstimator
+    processor.artifact_cache = ArtifactCache(cache_dir=os.path.join(workdir, 'preprocess'))
+    return processor
+
+
+def write_cloth_swap_inputs(job_id: str, seed: int):
+    """Person and garment photos at the paths ClothSwapProcessor reads"""
+    rng = np.random.default_rng(seed)
+    for kind in ('person', 'cloth'):
+        pixels = rng.integers(0, 255, (1024, 768, 3), dtype=np.uint8)
+        Image.fromarray(pixels).save(f"/tmp/{kind}_{job_id}.jpg")
+
+
+def bench_image_generation(args, workdir: str) -> Dict[str, Any]:
+    pipe = StubSDXLPipeline(step_seconds=args.step_seconds)
+    generator = stub_image_generator(GPUManager(device='cpu'), pipe)
+
+    def run_once(i):
+        result = generator.process({
+            'jobId': f"bench-image-{i}",
+            'prompt': 'a red bicycle leaning on a brick wall',
+            'width': args.image_size,
+            'height': args.image_size,
+            'steps': args.steps,
+            'numImages': 2,
+            'seed': 1000 + i
+        })
+        return {'images_per_minute': result['images_per_minute']}
+
+    stats = measure(run_once, args.iterations)
+    results = stats.pop('results')
+    stats['images_per_minute'] = float(np.mean([r['images_per_minute'] for r in results]))
+    stats['pipeline_calls'] = pipe.calls
+    stats['text_encoder_calls'] = pipe.encode_calls
+    return stats
+
+
+def bench_cloth_swap(args, workdir: str) -> Dict[str, Any]:
+    processor = stub_cloth_swap(GPUManager(device='cpu'), workdir)
+
+    def run_once(i):
+        job_id = f"bench-cloth-{i}"
+        write_cloth_swap_inputs(job_id, i)
+        return processor.process({'jobId': job_id, 'category': 'upper_body'})
+
+    stats = measure(run_once, args.iterations)
+    stats.pop('results')
+    stats['preprocess_cache'] = processor.artifact_cache.get_stats()
+    return stats
+
+
+def bench_video(processor_cls, job: Dict[str, Any]) -> Callable:
+    def bench(args, workdir: str) -> Dict[str, Any]:
+        processor = processor_cls(GPUManager(device='cpu'))
+
+        def run_once(i):
+            result = processor.process({**job, 'jobId': f"bench-{job['jobType']}-{i}"})
+            return result['encoding']
+
+        stats = measure(run_once, args.iterations)
+        encodings = stats.pop('results')
+        stats['frames'] = encodings[0]['frames']
+        stats['frames_per_second'] = float(np.mean([e['frames_per_second'] for e in encodings]))
+        return stats
+    return bench
+
+
+def bench_worker_loop(args, workdir: str) -> Dict[str, Any]:
+    """Push a mixed batch of jobs into an in-memory queue and drain it through the worker"""
+    import worker
+
+    redis_client = InMemoryRedis()
+    worker.configure_worker(device='cpu', client=redis_client)
+    worker.queue = QueueClient(redis_client, worker_id='bench-worker')
+    worker.scheduler.queue = worker.queue
+    gpu_manager = worker.gpu_manager
+    pipe = StubSDXLPipeline(step_seconds=args.step_seconds)
+    worker.processors['image-generation'] = stub_image_generator(gpu_manager, pipe)
+    worker.processors['cloth-swap'] = stub_cloth_swap(gpu_manager, workdir)
+    worker.processors['3d-video'] = Video3DGenerator(gpu_manager)
+
+    jobs = []
+    for i in range(args.worker_jobs):
+        job_id = f"bench-worker-{i}"
+        kind = ('image-generation', 'image-generation', 'cloth-swap', '3d-video')[i % 4]
+        data = {'jobId': job_id, 'jobType': kind}
+        if kind == 'image-generation':
+            data.update(prompt=f"a lighthouse at dusk, variation {i % 3}", width=args.image_size,
+                        height=args.image_size, steps=args.steps, seed=i)
+        elif kind == 'cloth-swap':
+            write_cloth_swap_inputs(job_id, i)
+        else:
+            data.update(prompt='a spinning cube', duration=1)
+        jobs.append({'jobId': job_id, 'timestamp': time.time() * 1000, 'data': data})
+
+    redis_client.rpush(worker.queue.queue_key, *[json.dumps(job) for job in jobs])
+
+    start = time.perf_counter()
+    batches = 0
+    while worker.queue.peek(1):
+        batch = worker.scheduler.next_batch(timeout=0)
+        if batch:
+            worker.process_batch(batch)
+            batches += 1
+    elapsed = time.perf_counter() - start
+
+    finished = {}
+    for _, message, published_at in redis_client.published:
+        update = json.loads(message)
+        if update['status'] in ('completed', 'failed'):
+            finished[update['jobId']] = (update['status'], published_at - start)
+
+    return {
+        'jobs': len(jobs),
+        'completed': sum(status == 'completed' for status, _ in finished.values()),
+        'batches': batches,
+        'latency_ms': summarize([seconds for _, seconds in finished.values()]),
+        'jobs_per_minute': len(jobs) * 60 / elapsed,
+        'peak_rss_mb': metrics.peak_rss_bytes() / 1024 ** 2,
+        'scheduler': worker.scheduler.get_stats(),
+        'queue': worker.queue.get_stats(),
+        'model_cache': {
+            key: value for key, value in gpu_manager.get_cache_stats().items()
+            if key in ('hits', 'misses', 'evictions', 'hit_rate')
+        }
+    }
+
+
+def bench_queue_client(args, workdir: str) -> Dict[str, Any]:
+    """Claim/ack and status write throughput, with status writes sent one by one and pipelined"""
+    if args.redis_url:
+        import redis
+        redis_client = redis.Redis.from_url(args.redis_url, decode_responses=True)
+    else:
+        redis_client = InMemoryRedis()
+
+    def drain(batched: bool) -> Dict[str, Any]:
+        queue = QueueClient(
+            redis_client, f"bench:queue-{os.getpid()}-{int(batched)}:wait", 'bench-updates',
+            worker_id='bench', heartbeat_interval=60, flush_interval=0.005
+        )
+        redis_client.rpush(queue.queue_key, *[
+            json.dumps({'jobId': f"bench-queue-{i}", 'data': {'jobType': 'image-generation'}})
+            for i in range(args.queue_jobs)
+        ])
+        if batched:
+            queue.start()
+
+        latencies = []
+        start = time.perf_counter()
+        while True:
+            job_start = time.perf_counter()
+            job = queue.claim()
+            if job is None:
+                break
+            queue.publish({'status': 'processing', 'jobId': job['jobId']})
+            for step in range(args.progress_events):
+                queue.publish({'status': 'progress', 'jobId': job['jobId'], 'progress': step})
+            queue.publish({'status': 'completed', 'jobId': job['jobId']})
+            latencies.append(time.perf_counter() - job_start)
+        elapsed = time.perf_counter() - start
+        stats = queue.get_stats()
+        queue.stop()
+
+        # Claims, status publishes and acks, each one Redis command
+        operations = stats['claims'] + stats['published'] + stats['acks']
+        return {
+            'latency_ms': summarize(latencies),
+            'jobs_per_minute': len(latencies) * 60 / elapsed,
+            'ops_per_second': operations / elapsed,
+            'round_trips_per_job': (stats['claims'] + stats['pipelines']) / len(latencies)
+        }
+
+    unbatched = drain(False)
+    batched = drain(True)
+    return {
+        **batched,
+        'jobs': args.queue_jobs,
+        'backend': 'redis' if args.redis_url else 'in-memory',
+        'unbatched': unbatched
+    }
+
+
+def bench_cold_start(args, workdir: str) -> Dict[str, Any]:
+    """Worker import time and process start to the first 200 from /health, in fresh processes"""
+    service_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = {**os.environ, 'WARMUP_JOB_TYPES': '', 'PREWARM_IMPORTS': ''}
+
+    import_seconds = []
+    for _ in range(args.iterations):
+        output = subprocess.run(
+            [sys.executable, '-c',
+             'import time; start = time.perf_counter(); import worker; print(time.perf_counter() - start)'],
+            cwd=service_dir, env=env, capture_output=True, text=True, check=True
+        ).stdout
+        import_seconds.append(float(output.split()[-1]))
+
+    cold_starts = []
+    for i in range(args.iterations):
+        port = args.port + i
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning'],
+            cwd=service_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            while True:
+                if server.poll() is not None or time.perf_counter() - start > 300:
+                    raise RuntimeError(f"GPU service did not become healthy on port {port}")
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                        if response.status == 200:
+                            break
+                except OSError:
+                    time.sleep(0.05)
+            cold_starts.append(time.perf_counter() - start)
+        finally:
+            server.terminate()
+            server.wait()
+
+    return {
+        'iterations': args.iterations,
+        'latency_ms': summarize(cold_starts),
+        'worker_import_ms': summarize(import_seconds)
+    }
+
+
+BENCHMARKS = {
+    'image-generation': bench_image_generation,
+    'cloth-swap': bench_cloth_swap,
+    '3d-video': bench_video(Video3DGenerator, {
+        'jobType': '3d-video', 'prompt': 'a spinning cube', 'duration': 2
+    }),
+    'study-animation': bench_video(StudyAnimationGenerator, {
+        'jobType': 'study-animation', 'topic': 'photosynthesis', 'script': STUDY_SCRIPT,
+        'subject': 'biology', 'animationStyle': '3d', 'duration': 6
+    }),
+    'story-video': bench_video(StoryVideoGenerator, {
+        'jobType': 'story-video', 'script': STORY_SCRIPT, 'visualStyle': 'watercolor',
+        'voiceStyle': 'calm'
+    }),
+    'story-video-parallel': bench_video(StoryVideoGenerator, {
+        'jobType': 'story-video', 'script': STORY_SCRIPT, 'visualStyle': 'watercolor',
+        'voiceStyle': 'calm', 'sceneParallel': True
+    }),
+    'worker-loop': bench_worker_loop,
+    'queue-client': bench_queue_client,
+    'cold-start': bench_cold_start
+}
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'torch': torch.__version__,
+        'numpy': np.__version__,
+        'torch_threads': torch.get_num_threads()
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any]):
+    """Print p50 latency and throughput changes against a previous run"""
+    print(f"{'benchmark':<18} {'p50 ms':>10} {'baseline':>10} {'change':>8} {'jobs/min':>10} {'baseline':>10}")
+    for name, stats in current['benchmarks'].items():
+        before = baseline.get('benchmarks', {}).get(name)
+        if not before:
+            continue
+        p50, base_p50 = stats['latency_ms']['p50'], before['latency_ms']['p50']
+        change = (p50 - base_p50) / base_p50 * 100 if base_p50 else 0.0
+        throughput = ' '.join(
+            f"{run['jobs_per_minute']:>10.1f}" if 'jobs_per_minute' in run else f"{'-':>10}"
+            for run in (stats, before)
+        )
+        print(f"{name:<18} {p50:>10.1f} {base_p50:>10.1f} {change:>+7.1f}% {throughput}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', help=f"comma separated subset of: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--worker-jobs', type=int, default=12)
+    parser.add_argument('--steps', type=int, default=10, help="diffusion steps for SDXL jobs")
+    parser.add_argument('--image-size', type=int, default=512)
+    parser.add_argument('--step-seconds', type=float, default=0.0,
+                        help="fixed delay per diffusion step, to emulate a real UNet")
+    parser.add_argument('--queue-jobs', type=int, default=2000)
+    parser.add_argument('--progress-events', type=int, default=5,
+                        help="progress updates published per job in the queue-client benchmark")
+    parser.add_argument('--redis-url', help="run the queue-client benchmark against this Redis instead of in memory")
+    parser.add_argument('--port', type=int, default=18000, help="first port for cold-start servers")
+    parser.add_argument('--output', help="write results JSON here (default: stdout)")
+    parser.add_argument('--compare', help="baseline results JSON to compare against")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    names = [name.strip() for name in args.only.split(',')] if args.only else list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    report = {'schema': 1, 'environment': environment(), 'config': vars(args), 'benchmarks': {}}
+    with tempfile.TemporaryDirectory(prefix='gpu-bench-') as workdir:
+        for name in names:
+            seed_everything()
+            print(f"Running {name}...", file=sys.stderr)
+            report['benchmarks'][name] = BENCHMARKS[name](args, workdir)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
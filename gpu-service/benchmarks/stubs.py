@@ -0,0 +1,196 @@
+"""Stand-ins for the heavy models and Redis used by the benchmark harness.
+
+They keep the call surface the processors rely on but do a small, fixed
+amount of work, so benchmarks measure the service code around the models
+(scheduling, batching, caching, encoding, saving) reproducibly on a CPU.
+"""
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+
+class StubSDXLPipeline:
+    """Tiny replacement for StableDiffusionXLPipeline.
+
+    Prompt embeddings are deterministic per prompt, each denoising step is
+    a couple of tensor ops on latents at 1/8 resolution (plus an optional
+    fixed delay), and decoding upsamples to the requested image size.
+    """
+
+    def __init__(self, step_seconds: float = 0.0, embed_dim: int = 16):
+        self.step_seconds = step_seconds
+        self.config = SimpleNamespace(force_zeros_for_empty_prompt=True)
+        self.tokenizer = SimpleNamespace(model_max_length=77)
+        self.text_encoder = SimpleNamespace(config=SimpleNamespace(hidden_size=embed_dim // 2))
+        self.text_encoder_2 = SimpleNamespace(
+            config=SimpleNamespace(hidden_size=embed_dim // 2, projection_dim=embed_dim // 2),
+            dtype=torch.float32
+        )
+        self.encode_calls = 0
+        self.calls = 0
+
+    def encode_prompt(self, prompt: str, device=None, num_images_per_prompt: int = 1,
+                      do_classifier_free_guidance: bool = False, **kwargs):
+        self.encode_calls += 1
+        generator = torch.Generator().manual_seed(zlib.crc32(prompt.encode()))
+        hidden_size = self.text_encoder.config.hidden_size + self.text_encoder_2.config.hidden_size
+        embeds = torch.randn((1, self.tokenizer.model_max_length, hidden_size), generator=generator)
+        pooled = torch.randn((1, self.text_encoder_2.config.projection_dim), generator=generator)
+        return embeds, None, pooled, None
+
+    def __call__(self, prompt_embeds, pooled_prompt_embeds, negative_prompt_embeds=None,
+                 negative_pooled_prompt_embeds=None, width: int = 1024, height: int = 1024,
+                 num_inference_steps: int = 30, num_images_per_prompt: int = 1, generator=None,
+                 callback_on_step_end=None, **kwargs):
+        self.calls += 1
+        batch = prompt_embeds.shape[0] * num_images_per_prompt
+        generators = generator if isinstance(generator, list) else [generator] * batch
+        latents = torch.stack([
+            torch.randn((4, height // 8, width // 8), generator=g) for g in generators
+        ])
+        conditioning = pooled_prompt_embeds.mean().item()
+
+        for step in range(num_inference_steps):
+            latents = latents * 0.98 + 0.02 * torch.tanh(latents + conditioning)
+            if self.step_seconds:
+                time.sleep(self.step_seconds)
+            if callback_on_step_end:
+                callback_on_step_end(self, step, num_inference_steps - step, {})
+
+        pixels = F.interpolate(latents[:, :3], size=(height, width), mode='nearest')
+        pixels = ((pixels.clamp(-1, 1) + 1) * 127.5).to(torch.uint8).permute(0, 2, 3, 1).numpy()
+        return SimpleNamespace(images=[Image.fromarray(np.ascontiguousarray(p)) for p in pixels])
+
+
+class StubPoseEstimator:
+    """MediaPipe Pose stand-in that finds no person"""
+
+    def process(self, image_np):
+        return None
+
+    def close(self):
+        pass
+
+
+class InMemoryPipeline:
+    """Buffers commands and runs them under the client's lock on execute()"""
+
+    def __init__(self, client: 'InMemoryRedis'):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+            return self
+        return command
+
+    def execute(self) -> list:
+        with self.client._lock:
+            results = [getattr(self.client, name)(*args, **kwargs) for name, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
+class InMemoryRedis:
+    """Enough of redis.Redis for the queue client and worker: lists, keys, sets, publish, pipelines, the claim script"""
+
+    def __init__(self):
+        self.lists: Dict[str, List[str]] = {}
+        self.values: Dict[str, str] = {}
+        self.sets: Dict[str, set] = {}
+        self.published: List[tuple] = []
+        # Re-entrant so pipelined commands can run under the pipeline's lock
+        self._lock = threading.RLock()
+
+    def pipeline(self, transaction: bool = True) -> InMemoryPipeline:
+        return InMemoryPipeline(self)
+
+    def rpush(self, key: str, *values):
+        with self._lock:
+            self.lists.setdefault(key, []).extend(values)
+            return len(self.lists[key])
+
+    def lmove(self, source: str, destination: str, src: str = 'LEFT', dest: str = 'RIGHT') -> Optional[str]:
+        with self._lock:
+            items = self.lists.get(source)
+            if not items:
+                return None
+            value = items.pop(0 if src == 'LEFT' else -1)
+            target = self.lists.setdefault(destination, [])
+            target.insert(0 if dest == 'LEFT' else len(target), value)
+            return value
+
+    def blmove(self, source: str, destination: str, timeout: float, src: str = 'LEFT',
+               dest: str = 'RIGHT') -> Optional[str]:
+        return self.lmove(source, destination, src, dest)
+
+    def lrange(self, key: str, start: int, end: int) -> List[str]:
+        with self._lock:
+            items = self.lists.get(key, [])
+            return list(items[start:None if end == -1 else end + 1])
+
+    def lrem(self, key: str, count: int, value: str) -> int:
+        with self._lock:
+            items = self.lists.get(key, [])
+            if value not in items:
+                return 0
+            if count < 0:
+                del items[len(items) - 1 - items[::-1].index(value)]
+            else:
+                items.remove(value)
+            return 1
+
+    def register_script(self, script: str):
+        """Only the queue client's claim script: LREM from KEYS[1], RPUSH to KEYS[2] if removed"""
+        def claim(keys=(), args=()):
+            with self._lock:
+                removed = self.lrem(keys[0], 1, args[0])
+                if removed:
+                    self.rpush(keys[1], args[0])
+                return removed
+        return claim
+
+    def set(self, key: str, value, ex: int = None):
+        with self._lock:
+            self.values[key] = str(value)
+        return True
+
+    def exists(self, key: str) -> int:
+        with self._lock:
+            return int(key in self.values)
+
+    def delete(self, key: str) -> int:
+        with self._lock:
+            return int(self.values.pop(key, None) is not None)
+
+    def sadd(self, key: str, *members) -> int:
+        with self._lock:
+            members_set = self.sets.setdefault(key, set())
+            added = len(set(members) - members_set)
+            members_set.update(members)
+            return added
+
+    def srem(self, key: str, *members) -> int:
+        with self._lock:
+            members_set = self.sets.get(key, set())
+            removed = len(members_set & set(members))
+            members_set.difference_update(members)
+            return removed
+
+    def smembers(self, key: str) -> set:
+        with self._lock:
+            return set(self.sets.get(key, ()))
+
+    def publish(self, channel: str, message: str) -> int:
+        with self._lock:
+            # Timestamped so the harness can measure per-job completion latency
+            self.published.append((channel, message, time.perf_counter()))
+        return 0
@@ -0,0 +1,349 @@
+import numpy as np
+import cv2
+from typing import Dict, Any, Iterable, List, NamedTuple, Optional
+import logging
+import os
+import queue
+import resource
+import subprocess
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Frames buffered between the producer and the encoder thread.
+# Peak frame memory is bounded by this window, not by video length.
+DEFAULT_FRAME_WINDOW = 8
+
+# Marks the end of the frame stream on the encoder queue
+_END_OF_STREAM = object()
+
+ENCODER_BACKENDS = ('opencv', 'ffmpeg')
+FFMPEG_CODECS = ('libx264', 'libx265')
+FFMPEG_PRESETS = ('ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow')
+
+
+class AudioTrack(NamedTuple):
+    """Audio file muxed into the video, starting at `start` seconds"""
+    path: str
+    start: float = 0.0
+    volume: float = 1.0
+
+
+class EncoderSettings:
+    """Encoder backend and codec options, selectable per job"""
+
+    def __init__(self, backend: str = 'opencv', codec: str = 'libx264',
+                 preset: str = 'veryfast', crf: int = 23):
+        if backend not in ENCODER_BACKENDS:
+            raise ValueError(f"Unknown encoder backend: {backend}")
+        if codec not in FFMPEG_CODECS:
+            raise ValueError(f"Unsupported codec: {codec}")
+        if preset not in FFMPEG_PRESETS:
+            raise ValueError(f"Unsupported encoder preset: {preset}")
+        if not 0 <= int(crf) <= 51:
+            raise ValueError(f"CRF must be between 0 and 51, got {crf}")
+
+        self.backend = backend
+        self.codec = codec
+        self.preset = preset
+        self.crf = int(crf)
+
+    @classmethod
+    def from_job_data(cls, job_data: Dict[str, Any]) -> 'EncoderSettings':
+        """Build settings from job data, falling back to service defaults"""
+        return cls(
+            backend=job_data.get('videoEncoder', os.getenv('VIDEO_ENCODER_BACKEND', 'opencv')),
+            codec=job_data.get('videoCodec', 'libx264'),
+            preset=job_data.get('encoderPreset', 'veryfast'),
+            crf=job_data.get('crf', 23)
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'backend': self.backend,
+            'codec': self.codec,
+            'preset': self.preset,
+            'crf': self.crf
+        }
+
+
+def check_frame(frame: np.ndarray, width: int, height: int):
+    """Reject frames that don't match the stream's size and RGB uint8 layout"""
+    if frame.shape != (height, width, 3) or frame.dtype != np.uint8:
+        raise ValueError(
+            f"Frame of shape {frame.shape} and dtype {frame.dtype} doesn't match the "
+            f"stream ({height}, {width}, 3) uint8"
+        )
+
+
+class OpenCVWriter:
+    """Writes frames through cv2.VideoWriter with the mp4v fourcc"""
+
+    def __init__(self, output_path: str, fps: int, width: int, height: int):
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        self.out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        self.width = width
+        self.height = height
+
+    def write(self, frame: np.ndarray):
+        # cv2.VideoWriter silently drops frames of the wrong size
+        check_frame(frame, self.width, self.height)
+        self.out.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+
+    def close(self):
+        self.out.release()
+
+
+def audio_mix_args(audio_tracks: List[AudioTrack]) -> List[str]:
+    """ffmpeg arguments that mix audio tracks (inputs 1..n) under the video of input 0"""
+    if not audio_tracks:
+        return []
+
+    command = []
+    filters = []
+    labels = ''
+    for i, track in enumerate(audio_tracks):
+        command += ['-i', track.path]
+        delay_ms = int(track.start * 1000)
+        filters.append(f'[{i + 1}:a]adelay={delay_ms}:all=1,volume={track.volume}[a{i}]')
+        labels += f'[a{i}]'
+    filters.append(f'{labels}amix=inputs={len(audio_tracks)}:duration=longest:normalize=0[aout]')
+
+    return command + [
+        '-filter_complex', ';'.join(filters),
+        '-map', '0:v', '-map', '[aout]',
+        '-c:a', 'aac', '-b:a', '192k'
+    ]
+
+
+class FFmpegPipeWriter:
+    """Pipes raw RGB frames into an ffmpeg subprocess.
+
+    Audio tracks are mixed and muxed in the same pass, so no second
+    pass over the encoded video is needed.
+    """
+
+    def __init__(self, output_path: str, fps: int, width: int, height: int,
+                 settings: EncoderSettings, audio_tracks: List[AudioTrack] = None):
+        command = self.build_command(output_path, fps, width, height, settings, audio_tracks or [])
+        self.width = width
+        self.height = height
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE
+        )
+
+    @staticmethod
+    def build_command(output_path: str, fps: int, width: int, height: int,
+                      settings: EncoderSettings, audio_tracks: List[AudioTrack]) -> List[str]:
+        command = [
+            'ffmpeg', '-y', '-loglevel', 'error',
+            '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+            '-s', f'{width}x{height}', '-r', str(fps),
+            '-i', 'pipe:0'
+        ]
+
+        command += audio_mix_args(audio_tracks)
+        command += [
+            '-c:v', settings.codec,
+            '-preset', settings.preset,
+            '-crf', str(settings.crf),
+            '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart',
+            output_path
+        ]
+        return command
+
+    def write(self, frame: np.ndarray):
+        # A wrong-sized frame would shift every later frame in the raw stream
+        check_frame(frame, self.width, self.height)
+        self.process.stdin.write(np.ascontiguousarray(frame).tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        stderr = self.process.stderr.read()
+        if self.process.wait() != 0:
+            raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+
+
+class VideoEncoder:
+    """Encoder stage that consumes a frame stream on a background thread.
+
+    Frames are handed over through a bounded queue so frame generation and
+    colour conversion/encoding overlap. When the encoder falls behind the
+    producer blocks, which is reported as back-pressure in the stats.
+    """
+
+    def __init__(self, output_path: str, fps: int = 30, window: int = DEFAULT_FRAME_WINDOW,
+                 settings: Optional[EncoderSettings] = None, audio_tracks: List[AudioTrack] = None):
+        self.output_path = output_path
+        self.fps = fps
+        self.window = max(1, int(window))
+        self.settings = settings or EncoderSettings()
+        self.audio_tracks = [track for track in (audio_tracks or []) if os.path.exists(track.path)]
+
+        if self.audio_tracks and self.settings.backend != 'ffmpeg':
+            logger.warning("Audio tracks are only muxed by the ffmpeg encoder backend")
+
+    def _open_writer(self, width: int, height: int):
+        if self.settings.backend == 'ffmpeg':
+            return FFmpegPipeWriter(
+                self.output_path, self.fps, width, height, self.settings, self.audio_tracks
+            )
+        return OpenCVWriter(self.output_path, self.fps, width, height)
+
+    def _run_encoder(self, frame_queue: queue.Queue, state: Dict[str, Any]):
+        """Encoder thread: convert and write frames until end of stream"""
+        out = None
+        cpu_start = time.thread_time()
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                frame = frame_queue.get()
+                state['encoder_idle_seconds'] += time.perf_counter() - wait_start
+
+                if frame is _END_OF_STREAM:
+                    break
+
+                if out is None:
+                    state['height'], state['width'] = frame.shape[:2]
+                    out = self._open_writer(state['width'], state['height'])
+
+                work_start = time.perf_counter()
+                out.write(frame)
+                state['encoder_busy_seconds'] += time.perf_counter() - work_start
+                state['frames'] += 1
+        except Exception as e:
+            state['error'] = e
+            # Keep draining so the producer never blocks on a dead encoder
+            while frame_queue.get() is not _END_OF_STREAM:
+                pass
+        finally:
+            if out is not None:
+                try:
+                    out.close()
+                except Exception as e:
+                    state['error'] = state['error'] or e
+            state['encoder_cpu_seconds'] = time.thread_time() - cpu_start
+
+    def encode(self, frames: Iterable[np.ndarray]) -> Dict[str, Any]:
+        """Write RGB frames to the output video, overlapping generation and encoding"""
+        start = time.perf_counter()
+        frame_queue = queue.Queue(maxsize=self.window)
+        state = {
+            'frames': 0,
+            'width': 0,
+            'height': 0,
+            'encoder_idle_seconds': 0.0,
+            'encoder_busy_seconds': 0.0,
+            'encoder_cpu_seconds': 0.0,
+            'error': None
+        }
+        children_cpu_start = children_cpu_seconds()
+
+        encoder_thread = threading.Thread(
+            target=self._run_encoder, args=(frame_queue, state), daemon=True
+        )
+        encoder_thread.start()
+
+        producer_blocked = 0.0
+        max_queue_depth = 0
+        try:
+            for frame in frames:
+                if state['error'] is not None:
+                    break
+                max_queue_depth = max(max_queue_depth, frame_queue.qsize())
+                put_start = time.perf_counter()
+                frame_queue.put(frame)
+                producer_blocked += time.perf_counter() - put_start
+        finally:
+            frame_queue.put(_END_OF_STREAM)
+            encoder_thread.join()
+
+        if state['error'] is not None:
+            raise state['error']
+        if state['frames'] == 0:
+            raise ValueError("No frames to encode")
+
+        elapsed = time.perf_counter() - start
+        # ffmpeg CPU time is accounted to us once the child has been reaped. The
+        # counter is process-wide, so encoders running concurrently share it
+        cpu_seconds = state['encoder_cpu_seconds'] + children_cpu_seconds() - children_cpu_start
+        bytes_written = os.path.getsize(self.output_path) if os.path.exists(self.output_path) else 0
+        logger.info(
+            f"Encoded {state['frames']} frames to {self.output_path} in {elapsed:.1f}s "
+            f"(producer blocked {producer_blocked:.1f}s, encoder idle {state['encoder_idle_seconds']:.1f}s)"
+        )
+
+        return {
+            'frames': state['frames'],
+            'width': state['width'],
+            'height': state['height'],
+            'duration': state['frames'] / self.fps,
+            'encode_seconds': elapsed,
+            'frames_per_second': state['frames'] / elapsed if elapsed > 0 else 0.0,
+            'window': self.window,
+            'max_queue_depth': max_queue_depth,
+            'producer_blocked_seconds': producer_blocked,
+            'encoder_idle_seconds': state['encoder_idle_seconds'],
+            'encoder_busy_seconds': state['encoder_busy_seconds'],
+            'encoder_cpu_seconds': state['encoder_cpu_seconds'],
+            'cpu_seconds': cpu_seconds,
+            'bytes_written': bytes_written,
+            'bytes_per_cpu_second': bytes_written / cpu_seconds if cpu_seconds > 0 else 0.0,
+            'audio_tracks': len(self.audio_tracks),
+            **self.settings.to_dict()
+        }
+
+
+def concat_segments(segment_paths: List[str], output_path: str,
+                    audio_tracks: List[AudioTrack] = None) -> Dict[str, Any]:
+    """Join video segments with identical codec settings without re-encoding them.
+
+    The video streams are stream-copied (ffmpeg concat demuxer); only the
+    audio tracks, if any, are mixed and encoded in the same pass.
+    """
+    start = time.perf_counter()
+    audio_tracks = [track for track in (audio_tracks or []) if os.path.exists(track.path)]
+    list_path = f"{output_path}.segments.txt"
+    with open(list_path, 'w') as f:
+        for path in segment_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    command = [
+        'ffmpeg', '-y', '-loglevel', 'error',
+        '-f', 'concat', '-safe', '0', '-i', list_path
+    ]
+    command += audio_mix_args(audio_tracks)
+    command += ['-c:v', 'copy', '-movflags', '+faststart', output_path]
+
+    try:
+        completed = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    finally:
+        os.remove(list_path)
+    if completed.returncode != 0:
+        raise RuntimeError(f"ffmpeg concat failed: {completed.stderr.decode(errors='replace').strip()}")
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"Concatenated {len(segment_paths)} segments into {output_path} in {elapsed:.1f}s")
+    return {
+        'segments': len(segment_paths),
+        'concat_seconds': elapsed,
+        'bytes_written': os.path.getsize(output_path),
+        'audio_tracks': len(audio_tracks)
+    }
+
+
+def children_cpu_seconds() -> float:
+    """CPU seconds of reaped child processes (ffmpeg), process-wide"""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def get_frame_window(job_data: Dict[str, Any]) -> int:
+    """Read the frame window size from job data"""
+    return max(1, int(job_data.get('frameWindow', DEFAULT_FRAME_WINDOW)))
@@ -1,32 +1,66 @@
 import torch
 import gc
 import logging
-from typing import Optional, Dict, Any
+import os
+import threading
+import time
+from collections import deque
+from typing import Optional, Dict, Any, List, Callable
 from contextlib import contextmanager
+from functools import lru_cache
+import metrics
 
 logger = logging.getLogger(__name__)
 
+def model_key(model_id: str, dtype: Any = "float16", variant: Optional[str] = "fp16") -> str:
+    """Registry key for shared model weights: model id + dtype + variant"""
+    return f"{model_id}:{str(dtype).replace('torch.', '')}:{variant or 'default'}"
+
+@lru_cache(maxsize=None)
+def device_info(index: int = 0) -> Dict[str, Any]:
+    """CUDA availability, name and total memory of a device, queried once per process"""
+    if not torch.cuda.is_available():
+        return {'cuda_available': False, 'gpu_name': None, 'vram_total': 0}
+    properties = torch.cuda.get_device_properties(index)
+    return {
+        'cuda_available': True,
+        'gpu_name': properties.name,
+        'vram_total': properties.total_memory // (1024 ** 2)
+    }
+
 class GPUManager:
     """Manages GPU memory and model loading for NVIDIA 3050 (8GB VRAM)"""
     
-    def __init__(self, max_vram_mb: int = 7500):
+    def __init__(self, max_vram_mb: int = 7500, clock: Callable[[], float] = time.monotonic,
+                 device: Optional[str] = None):
         self.max_vram_mb = max_vram_mb
         self.loaded_models: Dict[str, Any] = {}
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        # e.g. "cuda:1" when a worker process is bound to a specific GPU
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        
+        # Per-model accounting used by the eviction policy
+        self.model_info: Dict[str, Dict[str, Any]] = {}
+        self.clock = clock
+        self.cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.load_counts: Dict[str, int] = {}
+        self.eviction_log = deque(maxlen=100)
+        self._lock = threading.RLock()
+        # One lock per model so a model is loaded once, without blocking other models
+        self._load_locks: Dict[str, threading.Lock] = {}
         
-        if self.device == "cuda":
+        if self.device != "cpu":
             # Enable memory efficient attention
             torch.backends.cuda.matmul.allow_tf32 = True
             torch.backends.cudnn.allow_tf32 = True
-            logger.info(f"GPU Manager initialized on {torch.cuda.get_device_name(0)}")
+            logger.info(f"GPU Manager initialized on {torch.cuda.get_device_name(self.device)}")
         else:
             logger.warning("CUDA not available, using CPU")
     
     def get_vram_usage(self) -> int:
-        """Get current VRAM usage in MB"""
+        """Get current VRAM usage in MB (tracked model footprints on CPU)"""
         if self.device == "cpu":
-            return 0
-        return torch.cuda.memory_allocated(0) // (1024 ** 2)
+            return sum(info['footprint_mb'] for info in self.model_info.values())
+        return torch.cuda.memory_allocated(self.device) // (1024 ** 2)
     
     def get_available_vram(self) -> int:
         """Get available VRAM in MB"""
@@ -34,44 +68,183 @@ class GPUManager:
     
     def clear_cache(self):
         """Clear GPU cache"""
-        if self.device == "cuda":
+        if self.device != "cpu":
             torch.cuda.empty_cache()
             gc.collect()
             logger.info("GPU cache cleared")
     
     def unload_model(self, model_name: str):
         """Unload a specific model from memory"""
-        if model_name in self.loaded_models:
-            del self.loaded_models[model_name]
-            self.clear_cache()
-            logger.info(f"Model {model_name} unloaded")
+        with self._lock:
+            if model_name in self.loaded_models:
+                del self.loaded_models[model_name]
+                self.model_info.pop(model_name, None)
+                self.clear_cache()
+                logger.info(f"Model {model_name} unloaded")
     
     def unload_all_models(self):
         """Unload all models from memory"""
-        self.loaded_models.clear()
-        self.clear_cache()
-        logger.info("All models unloaded")
+        with self._lock:
+            self.loaded_models.clear()
+            self.model_info.clear()
+            self.clear_cache()
+            logger.info("All models unloaded")
+    
+    def eviction_score(self, model_name: str) -> float:
+        """Lower scores are evicted first: cheap to reload and idle for long"""
+        info = self.model_info[model_name]
+        idle_seconds = self.clock() - info['last_used']
+        return info['load_seconds'] / (1.0 + idle_seconds)
+    
+    def make_room(self, required_vram_mb: int, keep: str = None) -> List[str]:
+        """Evict idle models, lowest eviction score first, until required_vram_mb fits"""
+        evicted = []
+        with self._lock:
+            while self.get_available_vram() < required_vram_mb:
+                candidates = [
+                    name for name, info in self.model_info.items()
+                    if name != keep and info['in_use'] == 0
+                ]
+                if not candidates:
+                    logger.warning(
+                        f"Cannot free {required_vram_mb}MB: {self.get_available_vram()}MB available, "
+                        f"no idle models left to evict"
+                    )
+                    break
+                
+                victim = min(candidates, key=self.eviction_score)
+                info = self.model_info[victim]
+                decision = {
+                    'model': victim,
+                    'footprint_mb': info['footprint_mb'],
+                    'load_seconds': info['load_seconds'],
+                    'idle_seconds': self.clock() - info['last_used'],
+                    'score': self.eviction_score(victim),
+                    'required_mb': required_vram_mb,
+                    'available_mb': self.get_available_vram(),
+                    'for_model': keep
+                }
+                
+                self.unload_model(victim)
+                self.eviction_log.append(decision)
+                self.cache_stats['evictions'] += 1
+                metrics.MODEL_EVICTIONS.inc(model=victim)
+                evicted.append(victim)
+                logger.info(f"Evicted model {victim} ({info['footprint_mb']}MB) to make room for {keep}")
+        
+        return evicted
     
     @contextmanager
     def model_context(self, model_name: str, model_loader_fn, required_vram_mb: int = 2000):
-        """Context manager for loading/unloading models"""
-        try:
-            # Check if we need to free memory
-            if self.get_available_vram() < required_vram_mb:
-                logger.info(f"Insufficient VRAM, clearing cache...")
-                self.unload_all_models()
-            
-            # Load model if not already loaded
-            if model_name not in self.loaded_models:
-                logger.info(f"Loading model: {model_name}")
-                self.loaded_models[model_name] = model_loader_fn()
-                logger.info(f"Model loaded. VRAM usage: {self.get_vram_usage()}MB")
-            
-            yield self.loaded_models[model_name]
+        """Context manager for loading models, evicting idle ones only as needed.
+        
+        Loads run outside the manager lock, so lookups of resident models and
+        stats never wait behind a slow load; concurrent requests for the same
+        model wait on its load lock and share the one load.
+        """
+        with self._lock:
+            load_lock = self._load_locks.setdefault(model_name, threading.Lock())
+        
+        with load_lock:
+            with self._lock:
+                loaded = model_name in self.loaded_models
+                if loaded:
+                    self.cache_stats['hits'] += 1
+                    metrics.MODEL_CACHE_REQUESTS.inc(result='hit')
+                    info = self.model_info[model_name]
+                    info['in_use'] += 1
+                    info['last_used'] = self.clock()
+                    model = self.loaded_models[model_name]
+                else:
+                    self.cache_stats['misses'] += 1
+                    metrics.MODEL_CACHE_REQUESTS.inc(result='miss')
+                    
+                    # Free just enough memory for the new model
+                    self.make_room(required_vram_mb, keep=model_name)
+                    
+                    # Reserve the footprint while loading; in use, so it is never evicted
+                    info = {
+                        'footprint_mb': required_vram_mb,
+                        'load_seconds': 0.0,
+                        'last_used': self.clock(),
+                        'in_use': 1
+                    }
+                    self.model_info[model_name] = info
             
+            if not loaded:
+                model = self._load_model(model_name, model_loader_fn, info)
+        
+        try:
+            yield model
         finally:
-            # Optionally unload after use to free memory
-            pass
+            with self._lock:
+                info['in_use'] -= 1
+                info['last_used'] = self.clock()
+    
+    def _load_model(self, model_name: str, model_loader_fn, info: Dict[str, Any]):
+        """Run a model loader without holding the manager lock and record its footprint"""
+        logger.info(f"Loading model: {model_name}")
+        vram_before = torch.cuda.memory_allocated(self.device) if self.device != "cpu" else 0
+        start = time.perf_counter()
+        
+        try:
+            model = model_loader_fn()
+        except Exception:
+            with self._lock:
+                if self.model_info.get(model_name) is info:
+                    del self.model_info[model_name]
+            raise
+        
+        load_seconds = time.perf_counter() - start
+        metrics.MODEL_LOAD_SECONDS.observe(load_seconds, model=model_name)
+        footprint_mb = info['footprint_mb']
+        if self.device != "cpu":
+            measured = (torch.cuda.memory_allocated(self.device) - vram_before) // (1024 ** 2)
+            footprint_mb = measured if measured > 0 else footprint_mb
+        
+        with self._lock:
+            self.loaded_models[model_name] = model
+            self.load_counts[model_name] = self.load_counts.get(model_name, 0) + 1
+            info['footprint_mb'] = footprint_mb
+            info['load_seconds'] = load_seconds
+            info['last_used'] = self.clock()
+            self.model_info[model_name] = info
+            vram_usage = self.get_vram_usage()
+        
+        logger.info(
+            f"Model loaded in {load_seconds:.1f}s ({footprint_mb}MB). "
+            f"VRAM usage: {vram_usage}MB"
+        )
+        return model
+    
+    def shared_model(self, model_id: str, model_loader_fn, dtype: Any = torch.float16,
+                     variant: Optional[str] = "fp16", required_vram_mb: int = 2000):
+        """Context manager handing out one shared instance per model id, dtype and variant.
+        
+        Processors that load the same weights get the same object, so it is
+        loaded once and never evicts itself. Callers must not mutate it.
+        """
+        return self.model_context(model_key(model_id, dtype, variant), model_loader_fn, required_vram_mb)
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """Model cache hit/miss counts, resident models and recent eviction decisions"""
+        with self._lock:
+            lookups = self.cache_stats['hits'] + self.cache_stats['misses']
+            return {
+                **self.cache_stats,
+                'hit_rate': self.cache_stats['hits'] / lookups if lookups else 0.0,
+                'resident': {
+                    name: {
+                        'footprint_mb': info['footprint_mb'],
+                        'load_seconds': info['load_seconds'],
+                        'idle_seconds': self.clock() - info['last_used'],
+                        'in_use': info['in_use']
+                    }
+                    for name, info in self.model_info.items()
+                },
+                'load_counts': dict(self.load_counts),
+                'recent_evictions': list(self.eviction_log)
+            }
     
     def optimize_model(self, model):
         """Apply optimizations for 3050 GPU"""
@@ -96,6 +269,12 @@ class GPUManager:
             model.enable_vae_slicing()
             logger.info("VAE slicing enabled")
         
+        # Optionally compile the UNet; the graph is built on the first
+        # (warm-up) inference and reused for as long as the model stays loaded
+        if os.getenv('TORCH_COMPILE', '0') == '1' and hasattr(model, 'unet'):
+            model.unet = torch.compile(model.unet, mode="reduce-overhead")
+            logger.info("UNet compiled with torch.compile")
+        
         return model
     
     def get_optimal_batch_size(self, base_batch_size: int = 1) -> int:
@@ -108,3 +287,35 @@ class GPUManager:
             return base_batch_size
         else:
             return 1
+
+    def generators(self, seed: int, indices: List[int]) -> List[torch.Generator]:
+        """One generator per output image, seeded seed + index.
+
+        Seeding per image keeps outputs identical however run_batched splits them.
+        """
+        return [torch.Generator(device=self.device).manual_seed(seed + i) for i in indices]
+
+    def run_batched(self, items: List[Any], run_batch: Callable[[List[Any]], List[Any]],
+                    base_batch_size: int = 1) -> List[Any]:
+        """Run items through run_batch in VRAM-sized batches.
+        
+        The batch size starts at get_optimal_batch_size and is halved
+        whenever a batch runs out of memory, down to a single item.
+        """
+        batch_size = self.get_optimal_batch_size(base_batch_size)
+        results = []
+        index = 0
+        
+        while index < len(items):
+            batch = items[index:index + batch_size]
+            try:
+                results.extend(run_batch(batch))
+                index += len(batch)
+            except torch.cuda.OutOfMemoryError:
+                if batch_size == 1:
+                    raise
+                batch_size = max(1, batch_size // 2)
+                logger.warning(f"Out of memory, retrying with batch size {batch_size}")
+                self.clear_cache()
+        
+        return results
@@ -1,23 +1,54 @@
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from contextlib import asynccontextmanager
 import logging
-from worker import start_worker
+import os
+import time
+import worker
+from worker import start_worker, service_state
+from gpu_manager import device_info
+from worker_pool import WorkerPool
+import metrics
 import threading
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Set when WORKER_PROCESSES > 1; otherwise a single in-process worker thread runs
+worker_pool = None
+worker_thread = None
+
+# Seconds to wait on shutdown for running jobs to finish and claimed jobs to be requeued
+STOP_TIMEOUT_S = float(os.getenv('WORKER_STOP_TIMEOUT_S', 30))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Start worker thread
-    worker_thread = threading.Thread(target=start_worker, daemon=True)
-    worker_thread.start()
-    logger.info("GPU worker started")
+    global worker_pool, worker_thread
+    
+    if int(os.getenv('WORKER_PROCESSES', 1)) > 1:
+        worker_pool = WorkerPool()
+        worker_pool.start()
+    else:
+        # Start worker thread (runs the warm-up phase, then reports ready once it can take jobs)
+        def mark_ready():
+            service_state['ready'] = True
+        
+        worker_thread = threading.Thread(target=start_worker, kwargs={'on_ready': mark_ready}, daemon=True)
+        worker_thread.start()
+        logger.info("GPU worker started")
     
     yield
     
+    if worker_pool:
+        worker_pool.stop(STOP_TIMEOUT_S)
+    else:
+        # The worker requeues its claimed jobs and closes its processors on the way out
+        worker.stop_event.set()
+        worker_thread.join(STOP_TIMEOUT_S)
+        if worker_thread.is_alive():
+            logger.warning(f"Worker still busy after {STOP_TIMEOUT_S:.0f}s; its jobs are requeued once its heartbeat expires")
     logger.info("Shutting down GPU service")
 
 app = FastAPI(title="AI Studio GPU Service", lifespan=lifespan)
@@ -32,24 +63,57 @@ app.add_middleware(
 
 @app.get("/health")
 async def health_check():
-    import torch
-    return {
-        "status": "ok",
-        "cuda_available": torch.cuda.is_available(),
-        "gpu_name": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
-        "vram_total": torch.cuda.get_device_properties(0).total_memory // (1024**2) if torch.cuda.is_available() else 0
+    if worker_pool:
+        ready = worker_pool.is_ready()
+    else:
+        ready = service_state['ready'] and worker_thread is not None and worker_thread.is_alive()
+    if ready and 'cold_start_seconds' not in service_state:
+        # Process start to the first ready response, which the autoscaler waits on
+        service_state['cold_start_seconds'] = time.time() - metrics.process_start_time()
+        logger.info(f"Cold start to first healthy response: {service_state['cold_start_seconds']:.1f}s")
+    
+    body = {
+        "status": "ok" if ready else "warming",
+        **device_info(),
+        "warmed_job_types": service_state['warmed_job_types'],
+        "warmup_seconds": service_state['warmup_seconds'],
+        "first_job_latency": service_state['first_job_latency'],
+        "import_seconds": service_state['import_seconds'],
+        "cold_start_seconds": service_state.get('cold_start_seconds')
     }
+    if worker_pool:
+        body["pool"] = worker_pool.get_stats()
+    if worker.staged_worker:
+        body["pipeline"] = worker.staged_worker.get_stats()
+    if worker.queue:
+        body["queue"] = worker.queue.get_stats()
+    if worker.scheduler:
+        body["scheduler"] = worker.scheduler.get_stats()
+    
+    # Not ready until the worker can take jobs, so load balancers hold traffic
+    if not ready:
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus text exposition; pool workers' metrics are merged"""
+    families = metrics.REGISTRY.collect()
+    if worker_pool:
+        families = metrics.merge(families, *worker_pool.collect_metrics())
+    return PlainTextResponse(metrics.render(families), media_type="text/plain; version=0.0.4")
 
 @app.get("/gpu/stats")
 async def gpu_stats():
-    import torch
-    if not torch.cuda.is_available():
+    info = device_info()
+    if not info['cuda_available']:
         return {"error": "CUDA not available"}
     
+    import torch
     return {
         "vram_allocated": torch.cuda.memory_allocated(0) // (1024**2),
         "vram_reserved": torch.cuda.memory_reserved(0) // (1024**2),
-        "vram_total": torch.cuda.get_device_properties(0).total_memory // (1024**2)
+        "vram_total": info['vram_total']
     }
 
 if __name__ == "__main__":
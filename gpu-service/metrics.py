@@ -0,0 +1,299 @@
+import json
+import logging
+import math
+import os
+import resource
+import threading
+import time
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers sub-second cache hits up to 10 minute story videos
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, math.inf)
+
+# (sample name, labels, value) as rendered in the Prometheus text format
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + '}'
+
+
+class Metric:
+    """A metric family with a fixed set of label names"""
+
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> List[Sample]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [(f"{self.name}_total", self._labels(key), value) for key, value in self._values.items()]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != math.inf:
+            self.buckets += (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def samples(self) -> List[Sample]:
+        samples = []
+        with self._lock:
+            for key, (counts, total) in self._values.items():
+                labels = self._labels(key)
+                for bound, count in zip(self.buckets, counts):
+                    samples.append((f"{self.name}_bucket", {**labels, 'le': _format_value(bound)}, count))
+                samples.append((f"{self.name}_sum", labels, total))
+                samples.append((f"{self.name}_count", labels, counts[-1]))
+        return samples
+
+
+class Registry:
+    """Collects metric families and renders them in the Prometheus text format.
+
+    Pool worker processes keep their own registry and export() it to a JSON
+    file after each job; the API process merges those files with merge()
+    (samples with the same name and labels are summed).
+    """
+
+    def __init__(self):
+        self.metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                'name': metric.name,
+                'type': metric.type,
+                'help': metric.documentation,
+                'samples': metric.samples()
+            }
+            for metric in self.metrics
+        ]
+
+    def export(self, path: str):
+        """Atomically write the current samples to path as JSON"""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.collect(), f)
+        os.replace(tmp_path, path)
+
+
+def merge(*family_lists: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Sum samples of the same name and labels across several collections"""
+    merged: Dict[str, Dict[str, Any]] = {}
+    for families in family_lists:
+        for family in families:
+            target = merged.setdefault(family['name'], {**family, 'samples': {}})
+            for name, labels, value in family['samples']:
+                key = (name, tuple(sorted(labels.items())))
+                target['samples'][key] = target['samples'].get(key, 0.0) + value
+
+    return [
+        {**family, 'samples': [(name, dict(labels), value) for (name, labels), value in family['samples'].items()]}
+        for family in merged.values()
+    ]
+
+
+def render(families: List[Dict[str, Any]]) -> str:
+    lines = []
+    for family in families:
+        lines.append(f"# HELP {family['name']} {family['help']}")
+        lines.append(f"# TYPE {family['name']} {family['type']}")
+        for name, labels, value in family['samples']:
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+_imported_at = time.time()
+
+REGISTRY = Registry()
+
+JOBS = REGISTRY.register(Counter(
+    'gpu_jobs', 'Jobs processed by type and outcome', ('job_type', 'outcome')))
+QUEUE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'gpu_job_queue_wait_seconds', 'Time from enqueue to processing start', ('job_type',)))
+JOB_SECONDS = REGISTRY.register(Histogram(
+    'gpu_job_duration_seconds', 'Processing time per job', ('job_type',)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'gpu_job_stage_seconds', 'Processing time per job and stage', ('job_type', 'stage')))
+MODEL_LOAD_SECONDS = REGISTRY.register(Histogram(
+    'gpu_model_load_seconds', 'Model load time', ('model',)))
+MODEL_CACHE_REQUESTS = REGISTRY.register(Counter(
+    'gpu_model_cache_requests', 'GPUManager model lookups by result (hit or miss)', ('result',)))
+MODEL_EVICTIONS = REGISTRY.register(Counter(
+    'gpu_model_evictions', 'Models evicted to make room for another', ('model',)))
+SCHEDULER_RELOADS_AVOIDED = REGISTRY.register(Counter(
+    'gpu_scheduler_reloads_avoided', 'Jobs run ahead of the queue head because their model was resident',
+    ('job_type',)))
+SCHEDULER_JOBS_PASSED_OVER = REGISTRY.register(Counter(
+    'gpu_scheduler_jobs_passed_over', 'Queued jobs that a model-affinity pick was scheduled ahead of'))
+SCHEDULER_AGED_PROMOTIONS = REGISTRY.register(Counter(
+    'gpu_scheduler_aged_promotions', 'Queue heads run despite a model reload after waiting too long (max_wait) '
+    'or being passed over too often (max_skips)', ('reason',)))
+ENCODE_FPS = REGISTRY.register(Histogram(
+    'gpu_encode_frames_per_second', 'Frames encoded per second per video job', ('job_type',),
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)))
+PEAK_RSS_BYTES = REGISTRY.register(Histogram(
+    'gpu_job_peak_rss_bytes', 'Peak resident memory of the worker process during a job', ('job_type',),
+    buckets=tuple(2 ** i * 1024 ** 2 for i in range(7, 16))))
+PEAK_VRAM_BYTES = REGISTRY.register(Histogram(
+    'gpu_job_peak_vram_bytes', 'Peak allocated VRAM during a job (CUDA only)', ('job_type',),
+    buckets=tuple(2 ** i * 1024 ** 2 for i in range(7, 15))))
+
+
+def reset_peak_memory(device: Optional[str] = None):
+    """Start a new peak RSS/VRAM measurement window"""
+    try:
+        # Resets VmHWM (Linux >= 4.0)
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+    if device and device != 'cpu':
+        import torch
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def peak_rss_bytes() -> int:
+    """Peak RSS since the last reset_peak_memory (process lifetime if it couldn't reset)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def process_start_time() -> float:
+    """Unix time this process started (from /proc; import time of this module elsewhere)"""
+    try:
+        with open('/proc/self/stat') as f:
+            # Field 22, counted after the parenthesised command name
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - (uptime - start_ticks / os.sysconf('SC_CLK_TCK'))
+    except (OSError, ValueError, IndexError):
+        return _imported_at
+
+
+def peak_vram_bytes(device: Optional[str] = None) -> Optional[int]:
+    if not device or device == 'cpu':
+        return None
+    import torch
+    return torch.cuda.max_memory_allocated(device)
+
+
+def queue_wait_seconds(job: Dict[str, Any]) -> Optional[float]:
+    """Seconds since Bull enqueued the job (its 'timestamp' is in ms)"""
+    if 'timestamp' not in job:
+        return None
+    return max(0.0, time.time() - job['timestamp'] / 1000)
+
+
+def job_started(job: Dict[str, Any], device: Optional[str] = None):
+    """Record queue wait and open a peak memory window for a job"""
+    job_type = job.get('data', {}).get('jobType')
+    wait = queue_wait_seconds(job)
+    if wait is not None:
+        QUEUE_WAIT_SECONDS.observe(wait, job_type=job_type)
+    reset_peak_memory(device)
+
+
+def job_finished(job_type: str, outcome: str, seconds: float, result: Dict[str, Any] = None,
+                 device: Optional[str] = None):
+    """Record outcome, latency, stage timings, encode rate and peak memory of a job"""
+    JOBS.inc(job_type=job_type, outcome=outcome)
+    JOB_SECONDS.observe(seconds, job_type=job_type)
+    PEAK_RSS_BYTES.observe(peak_rss_bytes(), job_type=job_type)
+    vram = peak_vram_bytes(device)
+    if vram is not None:
+        PEAK_VRAM_BYTES.observe(vram, job_type=job_type)
+
+    if not result:
+        return
+    for stage, stage_seconds in ((result.get('timings') or {}).get('stages') or {}).items():
+        STAGE_SECONDS.observe(stage_seconds, job_type=job_type, stage=stage)
+    encoding = result.get('encoding')
+    if encoding and encoding.get('frames_per_second'):
+        ENCODE_FPS.observe(encoding['frames_per_second'], job_type=job_type)
+
+
+# Set in pool worker processes; the registry is written there after each job
+_export_path = None
+
+
+def set_export_path(path: str):
+    global _export_path
+    _export_path = path
+
+
+def export():
+    """Write this process's metrics for the API process to merge (no-op outside the pool)"""
+    if _export_path:
+        try:
+            REGISTRY.export(_export_path)
+        except OSError as e:
+            logger.warning(f"Could not export metrics to {_export_path}: {e}")
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import wave
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# (text, voice style, output path) -> None; writes a WAV file to the path
+Synthesizer = Callable[[str, str, str], None]
+
+SAMPLE_RATE = 16000
+
+
+def synthesize_silence(text: str, voice_style: str, path: str):
+    """Placeholder TTS engine: silent speech-length audio (~0.4s per word)"""
+    # Replace with the actual TTS model (Coqui TTS, Bark) and bump the engine version
+    frames = int(len(text.split()) * 0.4 * SAMPLE_RATE)
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(b'\x00\x00' * frames)
+
+
+class NarrationService:
+    """Synthesizes narration through a content-addressed on-disk cache.
+
+    Audio is keyed by a SHA-256 of the text, voice style and engine
+    version, so identical narration is reused across jobs, workers and
+    restarts. Files are evicted least recently used once the cache exceeds
+    `max_disk_mb`; their sizes are tracked in an index that is rebuilt from
+    the directory every `rescan_interval_s`, since other workers share it.
+    Files used within `evict_grace_s` are never evicted, so audio handed to
+    a running job stays on disk until it is muxed. synthesize_all() renders
+    the texts of a job concurrently, once per distinct text.
+    """
+
+    def __init__(self, synthesize: Synthesizer = synthesize_silence, engine_version: str = 'silence-v1',
+                 cache_dir: str = None, max_disk_mb: int = None, max_workers: int = None,
+                 evict_grace_s: float = None, rescan_interval_s: float = None):
+        self.synthesize = synthesize
+        self.engine_version = engine_version
+        self.cache_dir = cache_dir or os.getenv('NARRATION_CACHE_DIR', '/tmp/narration_cache')
+        self.max_disk_bytes = (max_disk_mb or int(os.getenv('NARRATION_CACHE_DISK_MB', 1024))) * 1024 ** 2
+        self.evict_grace_s = float(os.getenv('NARRATION_EVICT_GRACE_S', 900)) if evict_grace_s is None else evict_grace_s
+        self.rescan_interval_s = (float(os.getenv('NARRATION_RESCAN_S', 60))
+                                  if rescan_interval_s is None else rescan_interval_s)
+        max_workers = max_workers or int(os.getenv('NARRATION_WORKERS', 4))
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='narration')
+
+        self._lock = threading.Lock()
+        # Audio file path -> size, least recently used first
+        self._disk: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._next_scan = 0.0
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'synthesis_seconds': 0.0,
+            'seconds_saved': 0.0,
+            'evictions': 0
+        }
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._scan_disk()
+
+    def key(self, text: str, voice_style: Optional[str]) -> str:
+        """Stable across processes, unlike hash()"""
+        payload = json.dumps([self.engine_version, voice_style or 'default', text.strip()])
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.wav")
+
+    def get(self, text: str, voice_style: Optional[str] = None) -> str:
+        """Path of the narration for text, synthesizing it on a cache miss"""
+        key = self.key(text, voice_style)
+        path = self._path(key)
+        meta_path = f"{path[:-4]}.json"
+
+        try:
+            os.utime(path)  # keeps the LRU order for the next startup scan
+            self._index(path, os.path.getsize(path))
+            try:
+                with open(meta_path) as f:
+                    saved = json.load(f)['synthesis_seconds']
+            except (OSError, ValueError, KeyError):
+                saved = 0.0
+            with self._lock:
+                self.stats['hits'] += 1
+                self.stats['seconds_saved'] += saved
+            return path
+        except FileNotFoundError:
+            pass
+
+        logger.info(f"Synthesizing narration: {text[:50]}...")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        start = time.perf_counter()
+        try:
+            self.synthesize(text, voice_style, tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        elapsed = time.perf_counter() - start
+
+        # Readers never see a partially written file
+        with open(f"{tmp_path}.json", 'w') as f:
+            json.dump({'synthesis_seconds': elapsed, 'engine': self.engine_version}, f)
+        os.replace(f"{tmp_path}.json", meta_path)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.stats['misses'] += 1
+            self.stats['synthesis_seconds'] += elapsed
+        self._index(path, os.path.getsize(path))
+        self._evict()
+        return path
+
+    def synthesize_all(self, texts: List[str], voice_style: Optional[str] = None) -> List[str]:
+        """Narration paths for several texts, synthesized concurrently (each distinct text once)"""
+        futures = {}
+        for text in texts:
+            key = self.key(text, voice_style)
+            if key not in futures:
+                futures[key] = self.executor.submit(self.get, text, voice_style)
+        return [futures[self.key(text, voice_style)].result() for text in texts]
+
+    def _scan_disk(self):
+        """Rebuild the index from the cache directory, least recently used first"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.wav'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        disk = OrderedDict((path, size) for _, size, path in sorted(entries))
+        with self._lock:
+            self._disk = disk
+            self._disk_bytes = sum(disk.values())
+        self._next_scan = time.monotonic() + self.rescan_interval_s
+
+    def _index(self, path: str, size: int):
+        """Record a file as the most recently used one"""
+        with self._lock:
+            self._disk_bytes += size - self._disk.pop(path, 0)
+            self._disk[path] = size
+
+    def _evict(self):
+        """Delete least recently used narration until the disk budget fits"""
+        if time.monotonic() >= self._next_scan:
+            # Picks up files other workers added, removed or used
+            self._scan_disk()
+
+        now = time.time()
+        with self._lock:
+            for _ in range(len(self._disk)):
+                if self._disk_bytes <= self.max_disk_bytes or len(self._disk) <= 1:
+                    break
+                path, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                # Re-check on disk: another worker may have evicted or used it since
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime < self.evict_grace_s:
+                    self._disk[path] = stat.st_size
+                    self._disk_bytes += stat.st_size
+                    continue
+
+                self.stats['evictions'] += 1
+                for stale in (path, f"{path[:-4]}.json"):
+                    try:
+                        os.remove(stale)
+                    except FileNotFoundError:
+                        pass
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {**self.stats, 'hit_rate': self.stats['hits'] / lookups if lookups else 0.0}
+
+    def close(self):
+        self.executor.shutdown(wait=True)
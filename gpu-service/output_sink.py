@@ -0,0 +1,188 @@
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, List, Union
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Format name -> (PIL format, file extension)
+IMAGE_FORMATS = {
+    'png': ('PNG', 'png'),
+    'jpeg': ('JPEG', 'jpg'),
+    'webp': ('WEBP', 'webp')
+}
+
+
+class ImageSettings:
+    """Output image format and compression options, selectable per job"""
+
+    def __init__(self, format: str = 'png', compress_level: int = 1, quality: int = 90):
+        if format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format: {format}")
+        if not 0 <= int(compress_level) <= 9:
+            raise ValueError(f"PNG compression level must be between 0 and 9, got {compress_level}")
+        if not 1 <= int(quality) <= 100:
+            raise ValueError(f"Image quality must be between 1 and 100, got {quality}")
+
+        self.format = format
+        self.compress_level = int(compress_level)
+        self.quality = int(quality)
+
+    @classmethod
+    def from_job_data(cls, job_data: Dict[str, Any]) -> 'ImageSettings':
+        """Build settings from job data, falling back to service defaults"""
+        return cls(
+            format=job_data.get('imageFormat', os.getenv('OUTPUT_IMAGE_FORMAT', 'png')),
+            compress_level=job_data.get('pngCompression', int(os.getenv('PNG_COMPRESS_LEVEL', 1))),
+            quality=job_data.get('imageQuality', int(os.getenv('IMAGE_QUALITY', 90)))
+        )
+
+    @property
+    def extension(self) -> str:
+        return IMAGE_FORMATS[self.format][1]
+
+    def save_options(self) -> Dict[str, Any]:
+        """Keyword arguments for PIL Image.save"""
+        if self.format == 'png':
+            # PIL's default (6) spends several times longer for a few percent smaller files
+            return {'compress_level': self.compress_level}
+        if self.format == 'jpeg':
+            return {'quality': self.quality}
+        return {'quality': self.quality, 'method': 4}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'format': self.format,
+            'compress_level': self.compress_level,
+            'quality': self.quality
+        }
+
+
+class LocalDestination:
+    """Writes outputs into a local directory; locations are file paths"""
+
+    def __init__(self, root: str = None):
+        self.root = root or os.getenv('OUTPUT_DIR', '/tmp')
+        os.makedirs(self.root, exist_ok=True)
+
+    def write(self, name: str, data: bytes) -> str:
+        path = os.path.join(self.root, name)
+        # Readers never see a partially written file
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
+
+    def exists(self, location: str) -> bool:
+        return os.path.exists(location)
+
+
+class MemoryObjectStore:
+    """Object store stand-in keeping outputs in memory; locations are memory://bucket/name"""
+
+    def __init__(self, bucket: str = 'outputs'):
+        self.bucket = bucket
+        self.objects: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def write(self, name: str, data: bytes) -> str:
+        location = f"memory://{self.bucket}/{name}"
+        with self._lock:
+            self.objects[location] = data
+        return location
+
+    def exists(self, location: str) -> bool:
+        with self._lock:
+            return location in self.objects
+
+
+# Destinations selectable with OUTPUT_DESTINATION
+DESTINATIONS = {
+    'local': LocalDestination,
+    'memory': MemoryObjectStore
+}
+
+
+class OutputSink:
+    """Encodes and writes job outputs on a background thread pool.
+
+    save_image() returns a Future of the output location right away, so the
+    caller can go back to inference while images are compressed and
+    written. Jobs must wait() for their futures before their result is
+    published.
+    """
+
+    def __init__(self, destination=None, max_workers: int = None):
+        if destination is None:
+            name = os.getenv('OUTPUT_DESTINATION', 'local')
+            if name not in DESTINATIONS:
+                raise ValueError(f"Unknown output destination: {name}")
+            destination = DESTINATIONS[name]()
+        self.destination = destination
+        self.max_workers = int(os.getenv('OUTPUT_WRITERS', 2)) if max_workers is None else max_workers
+        self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='output-writer')
+
+        self.stats = {
+            'images_written': 0,
+            'bytes_written': 0,
+            'encode_seconds': 0.0,
+            'write_seconds': 0.0,
+            'pending': 0
+        }
+        self._lock = threading.Lock()
+
+    def _write_image(self, image: Image.Image, name: str, settings: ImageSettings) -> str:
+        start = time.perf_counter()
+        buffer = io.BytesIO()
+        if settings.format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(buffer, IMAGE_FORMATS[settings.format][0], **settings.save_options())
+        encoded = time.perf_counter()
+
+        location = self.destination.write(f"{name}.{settings.extension}", buffer.getvalue())
+
+        with self._lock:
+            self.stats['images_written'] += 1
+            self.stats['bytes_written'] += buffer.tell()
+            self.stats['encode_seconds'] += encoded - start
+            self.stats['write_seconds'] += time.perf_counter() - encoded
+        return location
+
+    def _done(self, future: Future):
+        with self._lock:
+            self.stats['pending'] -= 1
+
+    def save_image(self, image: Union[Image.Image, np.ndarray], name: str,
+                   settings: ImageSettings = None) -> Future:
+        """Queue an image (PIL or uint8 HxWxC array) to be written as `name` plus the format's extension"""
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        with self._lock:
+            self.stats['pending'] += 1
+
+        future = self.executor.submit(self._write_image, image, name, settings or ImageSettings())
+        future.add_done_callback(self._done)
+        return future
+
+    def wait(self, futures: List[Future]) -> List[str]:
+        """Locations of the given writes, once all of them are done (the first error is raised)"""
+        return [future.result() for future in futures]
+
+    def outputs_exist(self, result: Dict[str, Any]) -> bool:
+        """True while every output referenced by a result is still at its destination"""
+        return all(self.destination.exists(location) for location in result.get('images', []))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+    def close(self):
+        """Finish queued writes and stop the writer threads"""
+        self.executor.shutdown(wait=True)
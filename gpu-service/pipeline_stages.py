@@ -0,0 +1,256 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, Any, Callable, List
+import progress
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class StageStats:
+    """Busy time and item count for one pipeline stage"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.started_at = time.monotonic()
+
+    def record(self, seconds: float):
+        self.items += 1
+        self.busy_seconds += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            'items': self.items,
+            'busy_seconds': self.busy_seconds,
+            'utilization': self.busy_seconds / elapsed if elapsed > 0 else 0.0
+        }
+
+
+class MonitoredQueue(queue.Queue):
+    """Bounded queue that remembers its peak depth"""
+
+    def __init__(self, maxsize: int):
+        super().__init__(maxsize)
+        self.max_depth = 0
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self.max_depth = max(self.max_depth, self.qsize())
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'depth': self.qsize(), 'max_depth': self.max_depth, 'capacity': self.maxsize}
+
+
+class StagedWorker:
+    """Runs jobs through prefetch/preprocess -> inference -> postprocess stages.
+
+    Each stage is a thread connected to the next by a bounded queue, so
+    job N+1's preprocessing and job N-1's encoding/saving overlap with job
+    N's inference. Processors opt in by implementing prepare/infer/finalize;
+    others run their whole process() in the inference stage, and
+    micro-batches go through process_batch there as well.
+
+    On stop, jobs still waiting between stages are handed to requeue_jobs;
+    they are in the worker's processing list until then, so the queue
+    client puts them back on the wait list when it stops.
+    """
+
+    def __init__(self, next_batch: Callable[..., List[Dict[str, Any]]],
+                 get_processor: Callable[[str], Any],
+                 update_job_status: Callable[..., None],
+                 process_batch: Callable[[List[Dict[str, Any]]], None],
+                 on_job_done: Callable[[str, float], None] = None,
+                 queue_depth: int = None,
+                 publish_progress: progress.ProgressPublisher = None,
+                 device: str = None,
+                 requeue_jobs: Callable[[List[Dict[str, Any]]], None] = None):
+        self.next_batch = next_batch
+        self.get_processor = get_processor
+        self.update_job_status = update_job_status
+        self.process_batch = process_batch
+        self.on_job_done = on_job_done
+        self.publish_progress = publish_progress
+        self.device = device
+        self.requeue_jobs = requeue_jobs
+
+        depth = queue_depth or int(os.getenv('PIPELINE_QUEUE_DEPTH', 2))
+        self.inference_queue = MonitoredQueue(depth)
+        self.output_queue = MonitoredQueue(depth)
+        self.stats = {name: StageStats(name) for name in ('prefetch', 'inference', 'output')}
+        self.running = False
+        # Items that could not be handed on because the worker stopped
+        self.unfinished: List[tuple] = []
+
+    def _put(self, stage_queue: MonitoredQueue, item: tuple):
+        """Hand an item to the next stage without blocking past stop()"""
+        while self.running:
+            try:
+                stage_queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        self.unfinished.append(item)
+
+    def _requeue_unfinished(self):
+        """Drain the stage queues and hand their jobs back for requeuing"""
+        for stage_queue in (self.inference_queue, self.output_queue):
+            while True:
+                try:
+                    self.unfinished.append(stage_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+        jobs = []
+        for kind, payload, _, _ in self.unfinished:
+            jobs.extend(payload if kind == 'batch' else [payload])
+        self.unfinished.clear()
+        if not jobs:
+            return
+
+        logger.warning(f"Requeuing {len(jobs)} jobs left in the pipeline")
+        for job in jobs:
+            progress.finish(job.get('jobId'))
+        if self.requeue_jobs:
+            self.requeue_jobs(jobs)
+
+    def _fail(self, job: Dict[str, Any], stage: str, error: Exception, job_start: float = None):
+        job_id = job.get('jobId')
+        logger.error(f"Job {job_id} failed in {stage} stage: {str(error)}")
+        progress.finish(job_id)
+        self.update_job_status(job_id, 'failed', error=str(error))
+        if job_start is not None:
+            metrics.job_finished(job['data'].get('jobType'), 'failed', time.perf_counter() - job_start,
+                                 device=self.device)
+            metrics.export()
+
+    def _prefetch_stage(self):
+        while self.running:
+            try:
+                jobs = self.next_batch(timeout=1)
+            except Exception as e:
+                logger.error(f"Worker error: {str(e)}")
+                time.sleep(1)
+                continue
+            if not jobs:
+                continue
+
+            start = time.perf_counter()
+            if len(jobs) > 1:
+                self._put(self.inference_queue, ('batch', jobs, None, time.perf_counter()))
+                self.stats['prefetch'].record(time.perf_counter() - start)
+                continue
+
+            job = jobs[0]
+            try:
+                self.update_job_status(job.get('jobId'), 'processing')
+                progress.start(job.get('jobId'), self.publish_progress)
+                processor = self.get_processor(job['data'].get('jobType'))
+                prepared = processor.prepare(job['data']) if hasattr(processor, 'prepare') else job['data']
+            except Exception as e:
+                self._fail(job, 'prefetch', e, start)
+                continue
+            finally:
+                self.stats['prefetch'].record(time.perf_counter() - start)
+
+            self._put(self.inference_queue, ('single', job, prepared, start))
+
+    def _inference_stage(self):
+        while self.running:
+            try:
+                kind, payload, prepared, job_start = self.inference_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            start = time.perf_counter()
+            try:
+                if kind == 'batch':
+                    self.process_batch(payload)
+                    continue
+
+                # Opened here rather than in prefetch, which would reset the peak
+                # while the previous job is still in inference
+                metrics.job_started(payload, self.device)
+                processor = self.get_processor(payload['data'].get('jobType'))
+                if hasattr(processor, 'infer') and hasattr(processor, 'finalize'):
+                    output = processor.infer(prepared)
+                    self._put(self.output_queue, ('finalize', payload, output, job_start))
+                else:
+                    result = processor.process(payload['data'])
+                    self._put(self.output_queue, ('done', payload, result, job_start))
+            except Exception as e:
+                self._fail(payload, 'inference', e, job_start)
+                import torch
+                if torch.cuda.is_available():
+                    torch.cuda.empty_cache()
+            finally:
+                self.stats['inference'].record(time.perf_counter() - start)
+
+    def _output_stage(self):
+        while self.running:
+            try:
+                kind, job, output, job_start = self.output_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            start = time.perf_counter()
+            try:
+                if kind == 'finalize':
+                    processor = self.get_processor(job['data'].get('jobType'))
+                    result = processor.finalize(job['data'], output)
+                else:
+                    result = output
+
+                result = {**result, 'timings': progress.finish(job.get('jobId'))}
+                self.update_job_status(job.get('jobId'), 'completed', result)
+                if self.on_job_done:
+                    self.on_job_done(job['data'].get('jobType'), time.perf_counter() - job_start)
+                metrics.job_finished(job['data'].get('jobType'), 'completed', time.perf_counter() - job_start,
+                                     result, self.device)
+                metrics.export()
+                logger.info(f"Job {job.get('jobId')} completed successfully")
+            except Exception as e:
+                self._fail(job, 'output', e, job_start)
+            finally:
+                self.stats['output'].record(time.perf_counter() - start)
+
+    def run(self):
+        """Start all stages and block until stopped and drained"""
+        self.running = True
+        threads = [
+            threading.Thread(target=self._prefetch_stage, name='stage-prefetch', daemon=True),
+            threading.Thread(target=self._inference_stage, name='stage-inference', daemon=True),
+            threading.Thread(target=self._output_stage, name='stage-output', daemon=True)
+        ]
+        for thread in threads:
+            thread.start()
+
+        logger.info("Staged worker started (prefetch -> inference -> output)")
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            logger.info("Staged worker shutting down...")
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+        self._requeue_unfinished()
+
+    def stop(self):
+        """Let each stage finish its current item; run() then requeues the rest and returns"""
+        self.running = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'stages': {name: stats.to_dict() for name, stats in self.stats.items()},
+            'queues': {
+                'inference': self.inference_queue.to_dict(),
+                'output': self.output_queue.to_dict()
+            }
+        }
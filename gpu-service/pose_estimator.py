@@ -0,0 +1,141 @@
+import hashlib
+import logging
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+
+def image_hash(image_np: np.ndarray) -> str:
+    """Content hash of an image array (pixels and shape)"""
+    digest = hashlib.sha1(image_np.tobytes())
+    digest.update(str(image_np.shape).encode())
+    return digest.hexdigest()
+
+
+class PoseEstimatorPool:
+    """Thread-safe pool of MediaPipe Pose estimators with an LRU result cache.
+
+    Estimators are built lazily (up to `pool_size`) and reused across calls
+    instead of constructing a new graph per image. Results are cached by image
+    content hash, since the same person photo is often tried against many
+    garments. Landmarks are returned as a (33, 4) float32 array of
+    x, y, z, visibility, or None when no person is found.
+    """
+
+    def __init__(self, pool_size: int = 2, cache_size: int = 256):
+        self.pool_size = max(1, pool_size)
+        self.cache_size = cache_size
+        self._idle = queue.Queue()
+        self._created = 0
+        self._estimators = []
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[str, Optional[np.ndarray]]" = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def _create_estimator(self):
+        import mediapipe as mp
+        return mp.solutions.pose.Pose(static_image_mode=True)
+
+    @contextmanager
+    def _acquire(self):
+        estimator = None
+        with self._lock:
+            if self._idle.empty() and self._created < self.pool_size:
+                self._created += 1
+                create = True
+            else:
+                create = False
+
+        if create:
+            try:
+                estimator = self._create_estimator()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+            with self._lock:
+                self._estimators.append(estimator)
+        else:
+            estimator = self._idle.get()
+
+        try:
+            yield estimator
+        finally:
+            self._idle.put(estimator)
+
+    def _cache_get(self, key: str):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.stats['hits'] += 1
+                return True, self._cache[key]
+            self.stats['misses'] += 1
+            return False, None
+
+    def _cache_put(self, key: str, landmarks: Optional[np.ndarray]):
+        with self._lock:
+            self._cache[key] = landmarks
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def detect_pose(self, image: Image.Image) -> Optional[np.ndarray]:
+        """Detect pose landmarks for one RGB image"""
+        image_np = np.ascontiguousarray(np.array(image.convert('RGB')))
+        key = image_hash(image_np)
+
+        found, landmarks = self._cache_get(key)
+        if found:
+            return landmarks
+
+        # MediaPipe expects RGB input
+        with self._acquire() as estimator:
+            results = estimator.process(image_np)
+
+        landmarks = None
+        if results is not None and results.pose_landmarks:
+            landmarks = np.array(
+                [[lm.x, lm.y, lm.z, lm.visibility] for lm in results.pose_landmarks.landmark],
+                dtype=np.float32
+            )
+            landmarks.setflags(write=False)
+
+        self._cache_put(key, landmarks)
+        return landmarks
+
+    def detect_poses(self, images: List[Image.Image]) -> List[Optional[np.ndarray]]:
+        """Detect poses for several images, spread over the pooled estimators"""
+        if len(images) <= 1:
+            return [self.detect_pose(image) for image in images]
+
+        with ThreadPoolExecutor(max_workers=min(self.pool_size, len(images))) as executor:
+            return list(executor.map(self.detect_pose, images))
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+                'cached': len(self._cache),
+                'estimators': self._created
+            }
+
+    def close(self):
+        """Release the native MediaPipe graphs"""
+        with self._lock:
+            estimators, self._estimators = self._estimators, []
+            self._created = 0
+            self._idle = queue.Queue()
+
+        for estimator in estimators:
+            estimator.close()
+        logger.info(f"Closed {len(estimators)} pose estimators")
@@ -1,9 +1,13 @@
 import torch
-import cv2
 import numpy as np
 from PIL import Image
-from typing import Dict, Any
+from typing import Dict, Any, List
 import logging
+import os
+from pose_estimator import PoseEstimatorPool
+from artifact_cache import ArtifactCache
+from output_sink import OutputSink, ImageSettings
+import progress
 
 logger = logging.getLogger(__name__)
 
@@ -13,6 +17,14 @@ class ClothSwapProcessor:
     def __init__(self, gpu_manager):
         self.gpu_manager = gpu_manager
         self.model_name = "cloth-swap-model"
+        self.pose_estimator = PoseEstimatorPool(
+            pool_size=int(os.getenv('POSE_POOL_SIZE', 2)),
+            cache_size=int(os.getenv('POSE_CACHE_SIZE', 256))
+        )
+        # Preprocessed person/garment artifacts keyed by source file content
+        self.artifact_cache = ArtifactCache()
+        self.output_sink = OutputSink()
+        self.target_size = (768, 1024)
     
     def load_model(self):
         """Load cloth swap model (placeholder for actual model)"""
@@ -25,29 +37,52 @@ class ClothSwapProcessor:
         # Placeholder - implement actual model loading
         return {"model": "cloth_swap_v1"}
     
-    def preprocess_images(self, person_path: str, cloth_path: str):
-        """Preprocess person and cloth images"""
-        person_img = Image.open(person_path).convert('RGB')
-        cloth_img = Image.open(cloth_path).convert('RGB')
+    def preprocess_person(self, person_path: str) -> Dict[str, np.ndarray]:
+        """Resized person image, pose landmarks and person mask, cached by file content"""
+        with open(person_path, 'rb') as f:
+            content = f.read()
         
-        # Resize to standard size
-        person_img = person_img.resize((768, 1024))
-        cloth_img = cloth_img.resize((768, 1024))
+        def compute():
+            person_img = Image.open(person_path).convert('RGB').resize(self.target_size)
+            pose_landmarks = self.detect_pose(person_img)
+            return {
+                'image': np.array(person_img),
+                # Empty landmarks mean no person was detected
+                'pose': pose_landmarks if pose_landmarks is not None else np.zeros((0, 4), np.float32),
+                'mask': self.segment_person(person_img)
+            }
         
-        return person_img, cloth_img
+        key = ArtifactCache.key(f"person-v1-{self.target_size}", content)
+        return self.artifact_cache.get_or_compute(key, compute)
     
-    def detect_pose(self, image: Image.Image):
-        """Detect human pose keypoints"""
-        # Use OpenPose or MediaPipe for pose detection
-        import mediapipe as mp
-        
-        mp_pose = mp.solutions.pose
-        pose = mp_pose.Pose(static_image_mode=True)
+    def preprocess_cloth(self, cloth_path: str) -> Dict[str, np.ndarray]:
+        """Resized and segmented garment image, cached by file content"""
+        with open(cloth_path, 'rb') as f:
+            content = f.read()
         
-        image_np = np.array(image)
-        results = pose.process(cv2.cvtColor(image_np, cv2.COLOR_RGB2BGR))
+        def compute():
+            cloth_img = Image.open(cloth_path).convert('RGB').resize(self.target_size)
+            return {
+                'image': np.array(cloth_img),
+                'segmented': np.array(self.segment_cloth(cloth_img))
+            }
         
-        return results.pose_landmarks if results else None
+        key = ArtifactCache.key(f"cloth-v1-{self.target_size}", content)
+        return self.artifact_cache.get_or_compute(key, compute)
+    
+    def detect_pose(self, image: Image.Image):
+        """Detect human pose keypoints"""
+        # Pooled MediaPipe estimators, cached by image content
+        return self.pose_estimator.detect_pose(image)
+    
+    def detect_poses(self, images: List[Image.Image]):
+        """Detect pose keypoints for several images"""
+        return self.pose_estimator.detect_poses(images)
+    
+    def close(self):
+        """Release native pose estimator resources and finish pending writes"""
+        self.pose_estimator.close()
+        self.output_sink.close()
     
     def segment_cloth(self, image: Image.Image):
         """Segment cloth region from image"""
@@ -55,12 +90,22 @@ class ClothSwapProcessor:
         # Placeholder implementation
         return image
     
-    def process(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Perform cloth swap"""
-        person_url = job_data.get('personUrl')
-        cloth_url = job_data.get('clothUrl')
+    def segment_person(self, image: Image.Image) -> np.ndarray:
+        """Segment the person (body/garment area) as a uint8 mask"""
+        # Use human parsing model (e.g. SCHP) to build the mask
+        # Placeholder implementation
+        return np.ones((image.height, image.width), dtype=np.uint8)
+    
+    def warmup(self, run_inference: bool = True):
+        """Preload the cloth swap model"""
+        with self.gpu_manager.model_context('cloth-swap', self.load_model, required_vram_mb=3000):
+            pass
+    
+    def prepare(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
+        """CPU stage: load, resize and pose-detect the input images"""
         category = job_data.get('category', 'upper_body')
-        preserve_face = job_data.get('preserveFace', True)
+        # Validated up front so a bad format fails before inference
+        image_settings = ImageSettings.from_job_data(job_data)
         
         logger.info(f"Processing cloth swap: {category}")
         
@@ -68,23 +113,52 @@ class ClothSwapProcessor:
         person_path = f"/tmp/person_{job_data['jobId']}.jpg"
         cloth_path = f"/tmp/cloth_{job_data['jobId']}.jpg"
         
-        # Preprocess
-        person_img, cloth_img = self.preprocess_images(person_path, cloth_path)
+        # Preprocess (repeat try-ons of the same photo hit the artifact cache)
+        with progress.get(job_data).stage('preprocess'):
+            person = self.preprocess_person(person_path)
+            cloth = self.preprocess_cloth(cloth_path)
         
-        # Detect pose
-        pose_landmarks = self.detect_pose(person_img)
+        return {
+            'job_data': job_data,
+            'person_img': Image.fromarray(person['image']),
+            'cloth_img': Image.fromarray(cloth['image']),
+            'pose_landmarks': person['pose'] if len(person['pose']) else None,
+            'person_mask': person['mask'],
+            'cloth_segmented': cloth['segmented'],
+            'image_settings': image_settings
+        }
+    
+    def infer(self, prepared: Dict[str, Any]) -> Any:
+        """Model stage: run the try-on model and queue the result image for writing"""
+        job_data = prepared['job_data']
+        reporter = progress.get(job_data)
+        with self.gpu_manager.model_context('cloth-swap', reporter.timed('load', self.load_model),
+                                            required_vram_mb=3000):
+            with reporter.stage('inference'):
+                # Perform cloth swap (implement actual inference)
+                # This is a placeholder - integrate actual model
+                
+                result_img = prepared['person_img']  # Placeholder
         
-        with self.gpu_manager.model_context('cloth-swap', self.load_model, required_vram_mb=3000):
-            # Perform cloth swap (implement actual inference)
-            # This is a placeholder - integrate actual model
-            
-            result_img = person_img  # Placeholder
-            
-            # Save result
-            output_path = f"/tmp/cloth_swap_{job_data['jobId']}.png"
-            result_img.save(output_path)
+        return self.output_sink.save_image(
+            result_img, f"cloth_swap_{job_data['jobId']}", prepared['image_settings']
+        )
+    
+    def finalize(self, job_data: Dict[str, Any], write) -> Dict[str, Any]:
+        """Output stage: wait until the result image is written"""
+        with progress.get(job_data).stage('save'):
+            output_path, = self.output_sink.wait([write])
         
         return {
             'output_image': output_path,
-            'category': category
+            'category': job_data.get('category', 'upper_body'),
+            'pose_cache': self.pose_estimator.get_stats(),
+            'preprocess_cache': self.artifact_cache.get_stats(),
+            'output_sink': self.output_sink.get_stats()
         }
+    
+    def process(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Perform cloth swap"""
+        prepared = self.prepare(job_data)
+        write = self.infer(prepared)
+        return self.finalize(job_data, write)
@@ -2,7 +2,13 @@ import torch
 from diffusers import StableDiffusionXLPipeline, DPMSolverMultistepScheduler
 from typing import Dict, Any, List
 import logging
+import random
+import time
 from pathlib import Path
+from result_cache import ResultCache
+from prompt_cache import PromptEmbeddingCache
+from output_sink import OutputSink, ImageSettings
+import progress
 
 logger = logging.getLogger(__name__)
 
@@ -12,9 +18,16 @@ class ImageGenerator:
     def __init__(self, gpu_manager):
         self.gpu_manager = gpu_manager
         self.model_id = "stabilityai/stable-diffusion-xl-base-1.0"
+        self.base_batch_size = 2
+        # Images are compressed and written in the background while inference continues
+        self.output_sink = OutputSink()
+        # Seeded requests that were already generated return their existing images
+        self.result_cache = ResultCache(validate=self.output_sink.outputs_exist)
+        # Text-encoder outputs per unique prompt, reused across images and jobs
+        self.prompt_cache = PromptEmbeddingCache()
     
     def load_model(self):
-        """Load SDXL model with optimizations for 3050"""
+        """Load the shared SDXL base pipeline with optimizations for 3050"""
         pipe = StableDiffusionXLPipeline.from_pretrained(
             self.model_id,
             torch_dtype=torch.float16,
@@ -27,46 +40,276 @@ class ImageGenerator:
         # Apply optimizations
         pipe = self.gpu_manager.optimize_model(pipe)
         
+        return pipe
+    
+    def get_pipeline(self, shared_pipe):
+        """View of the shared pipeline with our own scheduler.
+        
+        The view reuses the shared modules (no extra weights), so swapping the
+        scheduler here doesn't affect other processors using the same pipeline.
+        It is rebuilt per job so it never keeps evicted weights alive.
+        """
         # Use efficient scheduler
-        pipe.scheduler = DPMSolverMultistepScheduler.from_config(
-            pipe.scheduler.config
-        )
+        scheduler = DPMSolverMultistepScheduler.from_config(shared_pipe.scheduler.config)
+        return StableDiffusionXLPipeline(**{**shared_pipe.components, 'scheduler': scheduler})
+    
+    def warmup(self, run_inference: bool = True):
+        """Preload the shared pipeline and run a 1-step dummy inference"""
+        with self.gpu_manager.shared_model(self.model_id, self.load_model, torch.float16, "fp16",
+                                           required_vram_mb=4000) as shared_pipe:
+            if run_inference:
+                # Triggers kernel selection / graph compilation before the first real job
+                self.get_pipeline(shared_pipe)(
+                    prompt="warmup",
+                    width=1024,
+                    height=1024,
+                    num_inference_steps=1,
+                    guidance_scale=7.5
+                )
+    
+    def close(self):
+        """Finish pending image writes"""
+        self.output_sink.close()
+    
+    def fingerprint(self, job_data: Dict[str, Any]):
+        """Result cache key for a job (None unless it has an explicit seed)"""
+        return ResultCache.fingerprint('image-generation-v1', {
+            'model': self.model_id,
+            'prompt': job_data.get('prompt'),
+            'negativePrompt': job_data.get('negativePrompt', ''),
+            'width': job_data.get('width', 1024),
+            'height': job_data.get('height', 1024),
+            'steps': job_data.get('steps', 30),
+            'numImages': job_data.get('numImages', 1),
+            'seed': job_data.get('seed'),
+            'output': ImageSettings.from_job_data(job_data).to_dict()
+        })
+    
+    def infer(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Model stage: generate images from prompt"""
+        cache_key = self.fingerprint(job_data)
+        if cache_key:
+            cached = self.result_cache.acquire(cache_key)
+            if cached is not None:
+                logger.info(f"Reusing cached images for job {job_data.get('jobId')}")
+                return {'cached': cached}
         
-        return pipe
+        try:
+            output = self.generate(job_data)
+        except Exception as e:
+            if cache_key:
+                self.result_cache.fail(cache_key, e)
+            raise
+        
+        output['cache_key'] = cache_key
+        return output
     
-    def process(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Generate images from prompt"""
+    def generate(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Run SDXL for one job"""
         prompt = job_data.get('prompt')
         negative_prompt = job_data.get('negativePrompt', '')
         width = job_data.get('width', 1024)
         height = job_data.get('height', 1024)
         steps = job_data.get('steps', 30)
         num_images = job_data.get('numImages', 1)
+        seed = job_data.get('seed')
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        settings = ImageSettings.from_job_data(job_data)
         
         logger.info(f"Generating {num_images} images: {prompt[:50]}...")
+        reporter = progress.get(job_data)
         
-        with self.gpu_manager.model_context('sdxl', self.load_model, required_vram_mb=4000):
-            pipe = self.gpu_manager.loaded_models['sdxl']
+        with self.gpu_manager.shared_model(self.model_id, reporter.timed('load', self.load_model),
+                                           torch.float16, "fp16", required_vram_mb=4000) as shared_pipe:
+            pipe = self.get_pipeline(shared_pipe)
+            # Encoded once; the pipeline repeats them for num_images_per_prompt
+            with reporter.stage('preprocess'):
+                embeds = self.prompt_cache.embed(pipe, [prompt], [negative_prompt], self.gpu_manager.device)
             
-            images = []
-            for i in range(num_images):
-                image = pipe(
-                    prompt=prompt,
-                    negative_prompt=negative_prompt,
-                    width=width,
-                    height=height,
-                    num_inference_steps=steps,
-                    guidance_scale=7.5
-                ).images[0]
+            def run_batch(indices):
+                with reporter.stage('inference'):
+                    batch_images = pipe(
+                        **embeds,
+                        width=width,
+                        height=height,
+                        num_inference_steps=steps,
+                        guidance_scale=7.5,
+                        num_images_per_prompt=len(indices),
+                        generator=self.gpu_manager.generators(seed, indices),
+                        callback_on_step_end=reporter.step_callback(num_images * steps, indices[0] * steps, len(indices))
+                    ).images
                 
-                # Save image
-                output_path = f"/tmp/output_{job_data['jobId']}_{i}.png"
-                image.save(output_path)
-                images.append(output_path)
-                
-                logger.info(f"Generated image {i+1}/{num_images}")
+                logger.info(f"Generated images {indices[0] + 1}-{indices[-1] + 1}/{num_images}")
+                # Written while the next batch runs
+                return [
+                    self.output_sink.save_image(image, f"output_{job_data['jobId']}_{i}", settings)
+                    for i, image in zip(indices, batch_images)
+                ]
+            
+            start = time.perf_counter()
+            writes = self.gpu_manager.run_batched(list(range(num_images)), run_batch, self.base_batch_size)
+            elapsed = time.perf_counter() - start
         
-        return {
+        return {'writes': writes, 'seconds': elapsed, 'seed': seed}
+    
+    def finalize(self, job_data: Dict[str, Any], output: Dict[str, Any]) -> Dict[str, Any]:
+        """Output stage: wait until the generated images are written"""
+        if 'cached' in output:
+            return {
+                **output['cached'],
+                'result_cache': self.result_cache.get_stats(),
+                'prompt_cache': self.prompt_cache.get_stats()
+            }
+        
+        cache_key = output.get('cache_key')
+        try:
+            with progress.get(job_data).stage('save'):
+                images = self.output_sink.wait(output['writes'])
+        except Exception as e:
+            if cache_key:
+                self.result_cache.fail(cache_key, e)
+            raise
+        
+        elapsed = output['seconds']
+        result = {
             'images': images,
-            'count': len(images)
+            'count': len(images),
+            'seed': output['seed'],
+            'images_per_minute': len(images) * 60 / elapsed if elapsed > 0 else 0.0
+        }
+        if cache_key:
+            self.result_cache.complete(cache_key, result)
+        return {
+            **result,
+            'result_cache': self.result_cache.get_stats(),
+            'prompt_cache': self.prompt_cache.get_stats(),
+            'output_sink': self.output_sink.get_stats()
         }
+    
+    def process(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate images from prompt"""
+        return self.finalize(job_data, self.infer(job_data))
+    
+    def process_batch(self, jobs_data: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Generate images for several compatible jobs in shared pipeline calls.
+        
+        Jobs must agree on width, height and steps (see scheduler.batch_key).
+        Each job's images are fanned back out into its own result. Cached
+        jobs are answered without inference, and identical seeded jobs in
+        the batch are generated once.
+        """
+        first = jobs_data[0]
+        settings = [ImageSettings.from_job_data(job_data) for job_data in jobs_data]
+        width = first.get('width', 1024)
+        height = first.get('height', 1024)
+        steps = first.get('steps', 30)
+        
+        results = [None] * len(jobs_data)
+        seeds = [job_data.get('seed') for job_data in jobs_data]
+        owners = {}  # cache key -> index of the job that generates it
+        duplicates = {}  # job index -> index of the identical job it reuses
+        to_generate = []
+        for job_index, job_data in enumerate(jobs_data):
+            cache_key = self.fingerprint(job_data)
+            if cache_key in owners:
+                duplicates[job_index] = owners[cache_key]
+                continue
+            if cache_key:
+                cached = self.result_cache.acquire(cache_key)
+                if cached is not None:
+                    results[job_index] = cached
+                    continue
+                owners[cache_key] = job_index
+            if seeds[job_index] is None:
+                seeds[job_index] = random.randrange(2 ** 32)
+            to_generate.append(job_index)
+        
+        # One item per output image: (job index, image index within the job)
+        items = [
+            (job_index, i)
+            for job_index in to_generate
+            for i in range(jobs_data[job_index].get('numImages', 1))
+        ]
+        
+        logger.info(
+            f"Generating {len(items)} images for {len(to_generate)} batched jobs "
+            f"({len(jobs_data) - len(to_generate)} reused)"
+        )
+        
+        try:
+            paths, elapsed = self._generate_items(jobs_data, items, seeds, settings, width, height, steps)
+        except Exception as e:
+            for cache_key in owners:
+                self.result_cache.fail(cache_key, e)
+            raise
+        
+        images_per_minute = len(paths) * 60 / elapsed if elapsed > 0 else 0.0
+        for job_index in to_generate:
+            results[job_index] = {'images': [], 'count': 0, 'seed': seeds[job_index]}
+        for (j, _), path in zip(items, paths):
+            results[j]['images'].append(path)
+        
+        for job_index in to_generate:
+            result = results[job_index]
+            result['count'] = len(result['images'])
+            result['images_per_minute'] = images_per_minute
+        for cache_key, job_index in owners.items():
+            self.result_cache.complete(cache_key, dict(results[job_index]))
+        for job_index, owner_index in duplicates.items():
+            results[job_index] = {**results[owner_index], 'cache_hit': True}
+            self.result_cache.record_join()
+        
+        stats = {
+            'result_cache': self.result_cache.get_stats(),
+            'prompt_cache': self.prompt_cache.get_stats(),
+            'output_sink': self.output_sink.get_stats()
+        }
+        return [{**result, 'batched_jobs': len(jobs_data), **stats} for result in results]
+    
+    def _generate_items(self, jobs_data, items, seeds, settings, width, height, steps):
+        """Run the (job index, image index) items through the pipeline and write them out"""
+        if not items:
+            return [], 0.0
+        
+        # Every job in the batch sees the progress of the shared pipeline calls
+        reporter = progress.ReporterGroup([progress.get(jobs_data[j]) for j in sorted({j for j, _ in items})])
+        
+        with self.gpu_manager.shared_model(self.model_id, reporter.timed('load', self.load_model),
+                                           torch.float16, "fp16", required_vram_mb=4000) as shared_pipe:
+            pipe = self.get_pipeline(shared_pipe)
+            
+            def run_batch(batch_items):
+                with reporter.stage('preprocess'):
+                    embeds = self.prompt_cache.embed(
+                        pipe,
+                        [jobs_data[j].get('prompt') for j, _ in batch_items],
+                        [jobs_data[j].get('negativePrompt', '') for j, _ in batch_items],
+                        self.gpu_manager.device
+                    )
+                
+                with reporter.stage('inference'):
+                    batch_images = pipe(
+                        **embeds,
+                        width=width,
+                        height=height,
+                        num_inference_steps=steps,
+                        guidance_scale=7.5,
+                        generator=[self.gpu_manager.generators(seeds[j], [i])[0] for j, i in batch_items],
+                        callback_on_step_end=reporter.step_callback(
+                            len(items) * steps, items.index(batch_items[0]) * steps, len(batch_items)
+                        )
+                    ).images
+                
+                return [
+                    self.output_sink.save_image(image, f"output_{jobs_data[j]['jobId']}_{i}", settings[j])
+                    for (j, i), image in zip(batch_items, batch_images)
+                ]
+            
+            start = time.perf_counter()
+            writes = self.gpu_manager.run_batched(items, run_batch, len(items))
+            elapsed = time.perf_counter() - start
+        
+        with reporter.stage('save'):
+            paths = self.output_sink.wait(writes)
+        return paths, elapsed
@@ -2,6 +2,12 @@ import torch
 from diffusers import StableDiffusionXLPipeline
 from typing import Dict, Any, List
 import logging
+import random
+import time
+from result_cache import ResultCache
+from prompt_cache import PromptEmbeddingCache
+from output_sink import OutputSink, ImageSettings
+import progress
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +17,13 @@ class InfluencerCreator:
     def __init__(self, gpu_manager):
         self.gpu_manager = gpu_manager
         self.model_id = "stabilityai/stable-diffusion-xl-base-1.0"
+        self.base_batch_size = 2
+        # Pose images are compressed and written in the background while inference continues
+        self.output_sink = OutputSink()
+        # Seeded persona requests that were already generated return their existing images
+        self.result_cache = ResultCache(validate=self.output_sink.outputs_exist)
+        # Text-encoder outputs per unique prompt, reused across poses and jobs
+        self.prompt_cache = PromptEmbeddingCache()
     
     def load_model(self):
         """Load SDXL with face consistency models"""
@@ -50,44 +63,100 @@ class InfluencerCreator:
         
         return poses[:num_poses]
     
+    def warmup(self, run_inference: bool = True):
+        """Preload the shared pipeline and run a 1-step dummy inference"""
+        with self.gpu_manager.shared_model(self.model_id, self.load_model, torch.float16, "fp16",
+                                           required_vram_mb=4000) as pipe:
+            if run_inference:
+                pipe(prompt="warmup", num_inference_steps=1, guidance_scale=7.5)
+    
+    def close(self):
+        """Finish pending image writes"""
+        self.output_sink.close()
+    
+    def fingerprint(self, job_data: Dict[str, Any]):
+        """Result cache key for a persona request (None unless it has an explicit seed)"""
+        return ResultCache.fingerprint('influencer-creation-v1', {
+            'model': self.model_id,
+            'gender': job_data.get('gender'),
+            'ethnicity': job_data.get('ethnicity'),
+            'ageRange': job_data.get('ageRange'),
+            'style': job_data.get('style'),
+            'poses': job_data.get('poses', 5),
+            'seed': job_data.get('seed'),
+            'output': ImageSettings.from_job_data(job_data).to_dict()
+        })
+    
     def process(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
         """Create AI influencer with multiple poses"""
+        result = self.result_cache.get_or_compute(self.fingerprint(job_data), lambda: self.create(job_data))
+        return {
+            **result,
+            'result_cache': self.result_cache.get_stats(),
+            'prompt_cache': self.prompt_cache.get_stats(),
+            'output_sink': self.output_sink.get_stats()
+        }
+    
+    def create(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Generate the persona images"""
         gender = job_data.get('gender')
         ethnicity = job_data.get('ethnicity')
         age_range = job_data.get('ageRange')
         style = job_data.get('style')
         num_poses = job_data.get('poses', 5)
+        seed = job_data.get('seed')
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        settings = ImageSettings.from_job_data(job_data)
         
         logger.info(f"Creating AI influencer: {gender}, {ethnicity}, {age_range}")
+        reporter = progress.get(job_data)
         
-        with self.gpu_manager.model_context('influencer', self.load_model, required_vram_mb=4000):
-            pipe = self.gpu_manager.loaded_models['influencer']
-            
+        # Shares the SDXL base weights with ImageGenerator; the pipeline is used as-is
+        with self.gpu_manager.shared_model(self.model_id, reporter.timed('load', self.load_model),
+                                           torch.float16, "fp16", required_vram_mb=4000) as pipe:
             # Generate base prompt
             base_prompt = self.generate_base_face(gender, ethnicity, age_range)
             
             # Generate poses
             pose_descriptions = self.generate_poses(base_prompt, num_poses, style)
             
-            output_images = []
-            for i, pose in enumerate(pose_descriptions):
-                full_prompt = f"{base_prompt}, {pose}, {style} style"
-                
-                image = pipe(
-                    prompt=full_prompt,
-                    num_inference_steps=30,
-                    guidance_scale=7.5
-                ).images[0]
+            prompts = [f"{base_prompt}, {pose}, {style} style" for pose in pose_descriptions]
+            
+            def run_batch(indices):
+                with reporter.stage('preprocess'):
+                    embeds = self.prompt_cache.embed(
+                        pipe, [prompts[i] for i in indices], [''] * len(indices), self.gpu_manager.device
+                    )
                 
-                output_path = f"/tmp/influencer_{job_data['jobId']}_{i}.png"
-                image.save(output_path)
-                output_images.append(output_path)
+                with reporter.stage('inference'):
+                    batch_images = pipe(
+                        **embeds,
+                        num_inference_steps=30,
+                        guidance_scale=7.5,
+                        generator=self.gpu_manager.generators(seed, indices),
+                        callback_on_step_end=reporter.step_callback(len(prompts) * 30, indices[0] * 30, len(indices))
+                    ).images
                 
-                logger.info(f"Generated pose {i+1}/{num_poses}")
+                logger.info(f"Generated poses {indices[0] + 1}-{indices[-1] + 1}/{num_poses}")
+                # Written while the next batch runs
+                return [
+                    self.output_sink.save_image(image, f"influencer_{job_data['jobId']}_{i}", settings)
+                    for i, image in zip(indices, batch_images)
+                ]
+            
+            start = time.perf_counter()
+            writes = self.gpu_manager.run_batched(list(range(len(prompts))), run_batch, self.base_batch_size)
+            elapsed = time.perf_counter() - start
+        
+        with reporter.stage('save'):
+            output_images = self.output_sink.wait(writes)
         
         return {
             'images': output_images,
             'count': len(output_images),
+            'images_per_minute': len(output_images) * 60 / elapsed if elapsed > 0 else 0.0,
+            'seed': seed,
             'persona': {
                 'gender': gender,
                 'ethnicity': ethnicity,
@@ -1,17 +1,39 @@
 import torch
 import numpy as np
-from typing import Dict, Any, List
+from typing import Dict, Any, Iterable, Iterator
 import logging
-import cv2
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from frame_pipeline import (VideoEncoder, EncoderSettings, AudioTrack, get_frame_window, concat_segments,
+                            children_cpu_seconds)
+from transitions import TransitionEngine
+from narration import NarrationService
+import progress
 
 logger = logging.getLogger(__name__)
 
+def _flag(value) -> bool:
+    """Job data booleans may arrive as JSON booleans, numbers or strings"""
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+def scene_workers(scene_count: int) -> int:
+    """Threads for scene-parallel rendering: STORY_SCENE_WORKERS (default: CPU count), at most one per scene"""
+    configured = int(os.getenv('STORY_SCENE_WORKERS', os.cpu_count() or 1))
+    return max(1, min(scene_count, configured))
+
 class StoryVideoGenerator:
     """Generate cinematic 3-minute story videos"""
     
     def __init__(self, gpu_manager):
         self.gpu_manager = gpu_manager
         self.model_name = "story-video-model"
+        # Narration audio cached on disk by text, voice and TTS engine version
+        self.narration = NarrationService()
     
     def load_model(self):
         """Load video generation and TTS models"""
@@ -50,47 +72,46 @@ class StoryVideoGenerator:
         return prompt
     
     def generate_narration(self, text: str, voice_style: str):
-        """Generate narration audio"""
-        logger.info(f"Generating narration: {text[:50]}...")
-        
-        # Use TTS with specified voice style
-        # Placeholder - implement actual TTS
-        audio_path = f"/tmp/narration_{hash(text)}.wav"
-        return audio_path
+        """Generate narration audio (reused from the narration cache when possible)"""
+        return self.narration.get(text, voice_style)
     
     def generate_scene_video(self, prompt: str, duration: float):
-        """Generate video for scene"""
+        """Generate video frames for scene lazily"""
         fps = 30
         num_frames = int(duration * fps)
         
-        frames = []
         for i in range(num_frames):
             # Generate frame using video diffusion model
             # Placeholder implementation
             frame = np.random.randint(0, 255, (1080, 1920, 3), dtype=np.uint8)
-            frames.append(frame)
-        
-        return frames
+            yield frame
     
-    def add_transitions(self, scenes_frames: List[List[np.ndarray]]):
-        """Add transitions between scenes"""
-        all_frames = []
-        transition_frames = 15  # 0.5s at 30fps
+    def add_transitions(self, scenes_frames: Iterable[Iterable[np.ndarray]],
+                        engine: TransitionEngine = None) -> Iterator[np.ndarray]:
+        """Add transitions between scenes while streaming frames through.
         
-        for i, scene_frames in enumerate(scenes_frames):
-            all_frames.extend(scene_frames)
-            
-            # Add transition if not last scene
-            if i < len(scenes_frames) - 1:
-                # Fade transition
-                for j in range(transition_frames):
-                    alpha = j / transition_frames
-                    frame1 = scene_frames[-1]
-                    frame2 = scenes_frames[i + 1][0]
-                    blended = cv2.addWeighted(frame1, 1 - alpha, frame2, alpha, 0)
-                    all_frames.append(blended)
+        Only the last frame of the previous scene is kept so the transition
+        can be rendered once the next scene yields its first frame.
+        """
+        engine = engine or TransitionEngine()  # 0.5s crossfade at 30fps
+        last_frame = None
+        
+        for scene_frames in scenes_frames:
+            for index, frame in enumerate(scene_frames):
+                if index == 0 and last_frame is not None:
+                    yield from engine.render(last_frame, frame)
+                
+                yield frame
+                last_frame = frame
+    
+    def get_music_track(self, music_type: str):
+        """Locate the background music file for a music type"""
+        if music_type == 'none':
+            return None
         
-        return all_frames
+        music_dir = os.getenv('MUSIC_LIBRARY_DIR', '/app/music')
+        music_path = os.path.join(music_dir, f"{music_type}.mp3")
+        return music_path if os.path.exists(music_path) else None
     
     def add_background_music(self, video_path: str, music_type: str):
         """Add background music to video"""
@@ -102,61 +123,198 @@ class StoryVideoGenerator:
         logger.info(f"Adding {music_type} background music")
         return video_path
     
+    def render_scenes_parallel(self, scenes, visual_style: str, output_path: str, settings: EncoderSettings,
+                               frame_window: int, transitions: TransitionEngine,
+                               audio_tracks, reporter, total_frames: int) -> Dict[str, Any]:
+        """Render scenes to separate segments in a thread pool and stream-copy them together.
+        
+        Each scene keeps only its first and last frame; a transition segment
+        is rendered as soon as both of its neighbours are done. Narration
+        and music are mixed in by the concatenation pass, so the video
+        itself is encoded exactly once.
+        """
+        start = time.perf_counter()
+        children_cpu_start = children_cpu_seconds()
+        workers = scene_workers(len(scenes))
+        segment_dir = tempfile.mkdtemp(prefix='story_segments_', dir=os.path.dirname(output_path))
+        
+        def render_scene(scene):
+            prompt = self.generate_scene_prompt(scene['text'], visual_style)
+            edges = {}
+            
+            def frames():
+                for frame in self.generate_scene_video(prompt, scene['duration']):
+                    edges.setdefault('first', frame)
+                    edges['last'] = frame
+                    yield frame
+            
+            path = os.path.join(segment_dir, f"scene_{scene['id']:04d}.mp4")
+            stats = VideoEncoder(path, 30, frame_window, settings).encode(reporter.frames(frames(), total_frames))
+            reporter.count('scenes')
+            logger.info(f"Scene {scene['id'] + 1}/{len(scenes)} completed")
+            return path, stats, edges['first'], edges['last']
+        
+        def render_transition(index, frame_a, frame_b):
+            path = os.path.join(segment_dir, f"transition_{index:04d}.mp4")
+            frames = transitions.render(frame_a, frame_b)
+            return path, VideoEncoder(path, 30, frame_window, settings).encode(reporter.frames(frames, total_frames))
+        
+        try:
+            with ThreadPoolExecutor(workers, thread_name_prefix='story-scene') as pool:
+                scene_futures = [pool.submit(render_scene, scene) for scene in scenes]
+                rendered = []
+                transition_futures = []
+                try:
+                    for index, future in enumerate(scene_futures):
+                        rendered.append(future.result())
+                        if index > 0 and transitions.num_frames:
+                            transition_futures.append(
+                                pool.submit(render_transition, index - 1, rendered[index - 1][3], rendered[index][2])
+                            )
+                            # Boundary frames are only needed by that transition
+                            rendered[index - 1] = rendered[index - 1][:2]
+                    transition_segments = [future.result() for future in transition_futures]
+                except Exception:
+                    # Don't start scenes for a job that has already failed
+                    for future in scene_futures:
+                        future.cancel()
+                    raise
+            
+            segments = []
+            for index, (path, _, *_) in enumerate(rendered):
+                segments.append(path)
+                if index < len(transition_segments):
+                    segments.append(transition_segments[index][0])
+            
+            with reporter.stage('save'):
+                concat = concat_segments(segments, output_path, audio_tracks)
+        finally:
+            shutil.rmtree(segment_dir, ignore_errors=True)
+        
+        segment_stats = [stats for _, stats, *_ in rendered] + [stats for _, stats in transition_segments]
+        frames = sum(stats['frames'] for stats in segment_stats)
+        # Child (ffmpeg) CPU time is process-wide, so segments running at the
+        # same time can't be told apart; only the job total is reported
+        cpu_seconds = (sum(stats['encoder_cpu_seconds'] for stats in segment_stats)
+                       + children_cpu_seconds() - children_cpu_start)
+        elapsed = time.perf_counter() - start
+        return {
+            'frames': frames,
+            'width': segment_stats[0]['width'],
+            'height': segment_stats[0]['height'],
+            'duration': frames / 30,
+            'encode_seconds': elapsed,
+            'frames_per_second': frames / elapsed if elapsed > 0 else 0.0,
+            'window': frame_window,
+            'producer_blocked_seconds': sum(stats['producer_blocked_seconds'] for stats in segment_stats),
+            'encoder_idle_seconds': sum(stats['encoder_idle_seconds'] for stats in segment_stats),
+            'encoder_busy_seconds': sum(stats['encoder_busy_seconds'] for stats in segment_stats),
+            'cpu_seconds': cpu_seconds,
+            'bytes_written': concat['bytes_written'],
+            'bytes_per_cpu_second': concat['bytes_written'] / cpu_seconds if cpu_seconds > 0 else 0.0,
+            'audio_tracks': concat['audio_tracks'],
+            'scene_workers': workers,
+            'segments': concat['segments'],
+            'concat_seconds': concat['concat_seconds'],
+            **settings.to_dict()
+        }
+    
+    def warmup(self, run_inference: bool = True):
+        """Preload the story video models and render a single frame"""
+        with self.gpu_manager.model_context('story-video', self.load_model, required_vram_mb=5000):
+            if run_inference:
+                next(iter(self.generate_scene_video("warmup", 1 / 30)))
+    
     def process(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
         """Generate cinematic story video"""
         script = job_data.get('script')
         visual_style = job_data.get('visualStyle')
         voice_style = job_data.get('voiceStyle')
         background_music = job_data.get('backgroundMusic', 'none')
+        scene_parallel = _flag(job_data.get('sceneParallel', os.getenv('STORY_SCENE_PARALLEL', '0')))
         
         logger.info(f"Generating story video: {visual_style} style")
+        reporter = progress.get(job_data)
         
-        with self.gpu_manager.model_context('story-video', self.load_model, required_vram_mb=5000):
-            # Parse script into scenes
-            scenes = self.parse_story_script(script)
-            logger.info(f"Story parsed into {len(scenes)} scenes")
-            
-            scenes_frames = []
-            audio_files = []
-            
-            for scene in scenes:
-                # Generate narration
-                audio_path = self.generate_narration(scene['text'], voice_style)
-                audio_files.append(audio_path)
+        with self.gpu_manager.model_context('story-video', reporter.timed('load', self.load_model),
+                                            required_vram_mb=5000):
+            with reporter.stage('preprocess'):
+                # Parse script into scenes
+                scenes = self.parse_story_script(script)
+                logger.info(f"Story parsed into {len(scenes)} scenes")
                 
-                # Generate visual prompt
-                prompt = self.generate_scene_prompt(scene['text'], visual_style)
+                settings = EncoderSettings.from_job_data(job_data)
+                frame_window = get_frame_window(job_data)
+                transitions = TransitionEngine.from_job_data(job_data)
                 
-                # Generate scene video
-                frames = self.generate_scene_video(prompt, scene['duration'])
-                scenes_frames.append(frames)
+                # Generate narration up front so the encoder can mux it in one pass
+                audio_files = self.narration.synthesize_all([scene['text'] for scene in scenes], voice_style)
+                audio_tracks = []
+                start_frame = 0
+                for scene, audio_path in zip(scenes, audio_files):
+                    audio_tracks.append(AudioTrack(audio_path, start_frame / 30))
+                    start_frame += int(scene['duration'] * 30) + transitions.num_frames
                 
-                logger.info(f"Scene {scene['id'] + 1}/{len(scenes)} completed")
+                music_path = self.get_music_track(background_music)
+                if music_path:
+                    audio_tracks.append(AudioTrack(music_path, 0.0, volume=0.3))
             
-            # Add transitions
-            all_frames = self.add_transitions(scenes_frames)
-            
-            # Save video
+            # No transition after the last scene
+            total_frames = start_frame - transitions.num_frames if scenes else 0
             output_path = f"/tmp/story_video_{job_data['jobId']}.mp4"
+            # With a single scene worker the segments and concat pass are pure overhead
+            scene_parallel = scene_parallel and len(scenes) > 1 and scene_workers(len(scenes)) > 1
+            
+            if scene_parallel:
+                stats = self.render_scenes_parallel(
+                    scenes, visual_style, output_path, settings, frame_window, transitions,
+                    audio_tracks, reporter, total_frames
+                )
+                reporter.record('encode', stats['encoder_busy_seconds'])
+                logger.info(f"Story video completed: {output_path}")
+                return self.build_result(output_path, stats, scenes, audio_files, transitions, scene_parallel)
             
-            height, width = all_frames[0].shape[:2]
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(output_path, fourcc, 30, (width, height))
+            def scenes_frames():
+                for scene in scenes:
+                    # Generate visual prompt
+                    prompt = self.generate_scene_prompt(scene['text'], visual_style)
+                    
+                    # Generate scene video
+                    yield self.generate_scene_video(prompt, scene['duration'])
+                    
+                    reporter.count('scenes')
+                    logger.info(f"Scene {scene['id'] + 1}/{len(scenes)} completed")
             
-            for frame in all_frames:
-                out.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+            # Add transitions
+            all_frames = self.add_transitions(scenes_frames(), transitions)
             
-            out.release()
+            # Save video
+            encoder = VideoEncoder(output_path, 30, frame_window, settings, audio_tracks)
+            stats = encoder.encode(reporter.frames(all_frames, total_frames))
+            reporter.record('encode', stats['encoder_busy_seconds'])
             
-            # Add background music
-            output_path = self.add_background_music(output_path, background_music)
+            # The ffmpeg backend already muxed the music; OpenCV output needs a second pass
+            if settings.backend != 'ffmpeg':
+                with reporter.stage('save'):
+                    output_path = self.add_background_music(output_path, background_music)
             
             logger.info(f"Story video completed: {output_path}")
         
+        return self.build_result(output_path, stats, scenes, audio_files, transitions, scene_parallel)
+    
+    def build_result(self, output_path: str, stats: Dict[str, Any], scenes, audio_files,
+                     transitions: TransitionEngine, scene_parallel: bool) -> Dict[str, Any]:
         return {
             'video_path': output_path,
-            'duration': len(all_frames) / 30,
+            'duration': stats['duration'],
             'scenes': len(scenes),
             'audio_files': audio_files,
-            'resolution': f"{width}x{height}"
+            'resolution': f"{stats['width']}x{stats['height']}",
+            'encoding': stats,
+            'transitions': transitions.get_stats(),
+            'scene_parallel': scene_parallel,
+            'narration_cache': self.narration.get_stats()
         }
+    
+    def close(self):
+        self.narration.close()
@@ -3,15 +3,23 @@ import numpy as np
 from typing import Dict, Any
 import logging
 import cv2
+from frame_pipeline import VideoEncoder, EncoderSettings, AudioTrack, get_frame_window
+from transitions import TransitionEngine
+from narration import NarrationService
+import progress
 
 logger = logging.getLogger(__name__)
 
+MOTION_TYPES = ('kenburns', 'interpolate', 'hold')
+
 class StudyAnimationGenerator:
     """Generate educational 3D animations"""
     
     def __init__(self, gpu_manager):
         self.gpu_manager = gpu_manager
         self.model_name = "study-animation-model"
+        # Voiceover audio cached on disk by text, voice and TTS engine version
+        self.narration = NarrationService()
     
     def load_model(self):
         """Load text-to-video and TTS models"""
@@ -39,28 +47,61 @@ class StudyAnimationGenerator:
         return scenes
     
     def generate_voiceover(self, text: str):
-        """Generate voiceover audio"""
-        # Use TTS model to generate audio
-        logger.info(f"Generating voiceover: {text[:50]}...")
-        
-        # Placeholder - implement actual TTS
-        audio_path = f"/tmp/voiceover_{hash(text)}.wav"
-        return audio_path
+        """Generate voiceover audio (reused from the narration cache when possible)"""
+        return self.narration.get(text, 'study')
     
-    def generate_visual(self, scene_text: str, subject: str, style: str):
-        """Generate visual for scene"""
+    def build_visual_prompt(self, scene_text: str, subject: str, style: str):
+        """Build the visual prompt for a scene"""
         prompt = f"{subject} educational visualization: {scene_text}, {style} style, "
         prompt += "clear, informative, 3D rendered, educational content"
-        
+        return prompt
+    
+    def render_visual(self, prompt: str):
+        """Render a single frame for a prompt (one model call)"""
         # Generate frame using text-to-image/video model
         # Placeholder implementation
         frame = np.random.randint(0, 255, (720, 1280, 3), dtype=np.uint8)
         return frame
     
-    def animate_scene(self, frames: list, duration: float):
-        """Animate scene frames"""
-        # Apply transitions and animations
-        return frames
+    def generate_visual(self, scene_text: str, subject: str, style: str):
+        """Generate visual for scene"""
+        prompt = self.build_visual_prompt(scene_text, subject, style)
+        return self.render_visual(prompt)
+    
+    def ken_burns(self, frame: np.ndarray, t: float, zoom: float = 0.1):
+        """Slow zoom and pan across a still frame, t in [0, 1]"""
+        height, width = frame.shape[:2]
+        scale = 1 + zoom * t
+        tx = (width - width * scale) * t
+        ty = (height - height * scale) / 2
+        matrix = np.float32([[scale, 0, tx], [0, scale, ty]])
+        return cv2.warpAffine(frame, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                              borderMode=cv2.BORDER_REFLECT)
+    
+    def animate_scene(self, keyframes: list, num_frames: int, motion: str = 'kenburns'):
+        """Expand scene keyframes into num_frames output frames lazily"""
+        segments = np.array_split(np.arange(num_frames), len(keyframes))
+        
+        for k, segment in enumerate(segments):
+            keyframe = keyframes[k]
+            
+            if motion == 'interpolate' and k + 1 < len(keyframes):
+                # Crossfade towards the next keyframe over this segment
+                engine = TransitionEngine('crossfade', len(segment))
+                yield from engine.render(keyframe, keyframes[k + 1])
+            elif motion == 'kenburns':
+                for index in segment:
+                    yield self.ken_burns(keyframe, index / max(num_frames - 1, 1))
+            else:
+                # Re-emit the same buffer by reference; the encoder only reads it
+                for _ in segment:
+                    yield keyframe
+    
+    def warmup(self, run_inference: bool = True):
+        """Preload the study animation model and render a single keyframe"""
+        with self.gpu_manager.model_context('study-anim', self.load_model, required_vram_mb=3500):
+            if run_inference:
+                self.render_visual(self.build_visual_prompt("warmup", "general", "3d"))
     
     def process(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
         """Generate study animation video"""
@@ -69,46 +110,75 @@ class StudyAnimationGenerator:
         subject = job_data.get('subject')
         animation_style = job_data.get('animationStyle')
         duration = job_data.get('duration', 60)
+        keyframes_per_scene = max(1, int(job_data.get('keyframesPerScene', 2)))
+        motion = job_data.get('motion', 'kenburns')
+        
+        if motion not in MOTION_TYPES:
+            raise ValueError(f"Unknown motion type: {motion}")
         
         logger.info(f"Generating study animation: {topic}")
+        reporter = progress.get(job_data)
         
-        with self.gpu_manager.model_context('study-anim', self.load_model, required_vram_mb=3500):
-            # Parse script into scenes
-            scenes = self.parse_script(script)
+        with self.gpu_manager.model_context('study-anim', reporter.timed('load', self.load_model),
+                                            required_vram_mb=3500):
+            with reporter.stage('preprocess'):
+                # Parse script into scenes
+                scenes = self.parse_script(script)
+                
+                # Generate voiceovers up front so the encoder can mux them in one pass
+                audio_files = self.narration.synthesize_all([scene['text'] for scene in scenes], 'study')
+                audio_tracks = []
+                start_frame = 0
+                for scene, audio_path in zip(scenes, audio_files):
+                    audio_tracks.append(AudioTrack(audio_path, start_frame / 30))
+                    start_frame += int(scene['duration'] * 30)
             
-            all_frames = []
-            audio_files = []
+            model_calls = 0
             
-            for scene in scenes:
-                # Generate voiceover
-                audio_path = self.generate_voiceover(scene['text'])
-                audio_files.append(audio_path)
-                
-                # Generate visuals
-                num_frames = int(scene['duration'] * 30)  # 30 fps
-                for _ in range(num_frames):
-                    frame = self.generate_visual(scene['text'], subject, animation_style)
-                    all_frames.append(frame)
-                
-                logger.info(f"Scene {scene['id']} completed")
+            def scene_frames():
+                nonlocal model_calls
+                for scene in scenes:
+                    num_frames = int(scene['duration'] * 30)  # 30 fps
+                    if num_frames == 0:
+                        continue
+                    
+                    # Only keyframes hit the model; in-between frames are cheap motion
+                    prompt = self.build_visual_prompt(scene['text'], subject, animation_style)
+                    keyframes = [
+                        self.render_visual(prompt)
+                        for _ in range(min(keyframes_per_scene, num_frames))
+                    ]
+                    model_calls += len(keyframes)
+                    
+                    yield from self.animate_scene(keyframes, num_frames, motion)
+                    
+                    reporter.count('scenes')
+                    logger.info(f"Scene {scene['id']} completed ({len(keyframes)} keyframes, {num_frames} frames)")
             
             # Combine frames into video
             output_path = f"/tmp/study_animation_{job_data['jobId']}.mp4"
             
-            height, width = all_frames[0].shape[:2]
-            fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-            out = cv2.VideoWriter(output_path, fourcc, 30, (width, height))
-            
-            for frame in all_frames:
-                out.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
-            
-            out.release()
+            encoder = VideoEncoder(
+                output_path, 30, get_frame_window(job_data),
+                EncoderSettings.from_job_data(job_data), audio_tracks
+            )
+            # start_frame is now the total frame count
+            stats = encoder.encode(reporter.frames(scene_frames(), start_frame))
+            reporter.record('encode', stats['encoder_busy_seconds'])
             
             logger.info(f"Study animation completed: {output_path}")
         
         return {
             'video_path': output_path,
-            'duration': len(all_frames) / 30,
+            'duration': stats['duration'],
             'scenes': len(scenes),
-            'audio_files': audio_files
+            'audio_files': audio_files,
+            'model_calls': model_calls,
+            'output_frames': stats['frames'],
+            'model_calls_per_frame': model_calls / stats['frames'],
+            'encoding': stats,
+            'narration_cache': self.narration.get_stats()
         }
+    
+    def close(self):
+        self.narration.close()
@@ -4,6 +4,8 @@ from typing import Dict, Any
 import logging
 import subprocess
 from pathlib import Path
+from frame_pipeline import VideoEncoder, EncoderSettings, DEFAULT_FRAME_WINDOW, get_frame_window
+import progress
 
 logger = logging.getLogger(__name__)
 
@@ -64,27 +66,26 @@ class Video3DGenerator:
         return scene
     
     def render_frames(self, scene, num_frames: int):
-        """Render video frames"""
-        frames = []
+        """Render video frames lazily, one at a time"""
         for i in range(num_frames):
             # Render frame (placeholder)
             frame = np.random.randint(0, 255, (720, 1280, 3), dtype=np.uint8)
-            frames.append(frame)
-        return frames
+            yield frame
     
-    def frames_to_video(self, frames, output_path: str, fps: int = 30):
-        """Convert frames to video using ffmpeg"""
-        import cv2
-        
-        height, width = frames[0].shape[:2]
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
-        
-        for frame in frames:
-            out.write(cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
-        
-        out.release()
+    def frames_to_video(self, frames, output_path: str, fps: int = 30,
+                        window: int = DEFAULT_FRAME_WINDOW,
+                        settings: EncoderSettings = None) -> Dict[str, Any]:
+        """Stream frames into the video encoder (OpenCV or ffmpeg pipe)"""
+        stats = VideoEncoder(output_path, fps, window, settings).encode(frames)
         logger.info(f"Video saved to {output_path}")
+        return stats
+    
+    def warmup(self, run_inference: bool = True):
+        """Preload the 3D video model and render a single frame"""
+        with self.gpu_manager.model_context('3d-video', self.load_model, required_vram_mb=4000):
+            if run_inference:
+                scene = self.generate_scene("warmup", 1)
+                next(iter(self.render_frames(scene, 1)))
     
     def process(self, job_data: Dict[str, Any]) -> Dict[str, Any]:
         """Generate 3D video"""
@@ -94,26 +95,35 @@ class Video3DGenerator:
         style = job_data.get('style', 'realistic')
         
         logger.info(f"Generating 3D video: {prompt[:50]}... ({duration}s)")
+        reporter = progress.get(job_data)
         
-        with self.gpu_manager.model_context('3d-video', self.load_model, required_vram_mb=4000):
-            # Generate 3D scene
-            scene = self.generate_scene(prompt, duration)
-            
-            # Apply camera movement
-            scene = self.apply_camera_movement(scene, camera_movement)
+        with self.gpu_manager.model_context('3d-video', reporter.timed('load', self.load_model),
+                                            required_vram_mb=4000):
+            with reporter.stage('preprocess'):
+                # Generate 3D scene
+                scene = self.generate_scene(prompt, duration)
+                
+                # Apply camera movement
+                scene = self.apply_camera_movement(scene, camera_movement)
             
-            # Render frames
+            # Render frames (timed and counted as the encoder pulls them)
             fps = 30
             num_frames = duration * fps
-            frames = self.render_frames(scene, num_frames)
+            frames = reporter.frames(self.render_frames(scene, num_frames), num_frames)
             
             # Convert to video
             output_path = f"/tmp/3d_video_{job_data['jobId']}.mp4"
-            self.frames_to_video(frames, output_path, fps)
+            stats = self.frames_to_video(
+                frames, output_path, fps, get_frame_window(job_data),
+                EncoderSettings.from_job_data(job_data)
+            )
+            # The encoder runs alongside rendering; its busy time is the encode stage
+            reporter.record('encode', stats['encoder_busy_seconds'])
         
         return {
             'video_path': output_path,
             'duration': duration,
             'fps': fps,
-            'frames': num_frames
+            'frames': stats['frames'],
+            'encoding': stats
         }
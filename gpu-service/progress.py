@@ -0,0 +1,197 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Progress events for one job, as published on the job-updates channel
+ProgressPublisher = Callable[[str, Dict[str, Any]], None]
+
+
+class ProgressReporter:
+    """Progress events and timing breakdown for one job.
+
+    Processors time their stages (load, preprocess, inference, encode,
+    save), bump counters (scenes, frames) and report progress through the
+    reporter; diffusion pipelines report per step via step_callback().
+    Events are published at most every `min_interval` seconds, except the
+    final one. to_dict() is stored in the job result as 'timings'.
+    """
+
+    def __init__(self, job_id: Optional[str] = None, publish: ProgressPublisher = None,
+                 min_interval: float = None, clock: Callable[[], float] = time.monotonic):
+        self.job_id = job_id
+        self.publish = publish
+        self.min_interval = float(os.getenv('PROGRESS_INTERVAL_S', 0.5)) if min_interval is None else min_interval
+        self.clock = clock
+
+        self.started_at = clock()
+        self.stage_seconds: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.step_seconds = []
+        self.current_stage = None
+        self.events_published = 0
+        self._last_publish = None
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        """Add time to a stage"""
+        with self._lock:
+            self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block as part of a stage"""
+        previous, self.current_stage = self.current_stage, name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+            self.current_stage = previous
+
+    def timed(self, stage: str, fn: Callable) -> Callable:
+        """Wrap fn (e.g. a model loader) so each call is timed as a stage"""
+        def wrapper(*args, **kwargs):
+            with self.stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def count(self, name: str, n: int = 1) -> int:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            return self.counters[name]
+
+    def update(self, current: float, total: float, message: str = None, force: bool = False,
+               stage: str = None):
+        """Publish progress as current/total, rate limited"""
+        if self.publish is None or not total:
+            return
+
+        now = self.clock()
+        done = current >= total
+        with self._lock:
+            if not (force or done or self._last_publish is None
+                    or now - self._last_publish >= self.min_interval):
+                return
+            self._last_publish = now
+            self.events_published += 1
+
+        stage = stage or self.current_stage
+        event = {
+            'progress': round(min(100.0, 100.0 * current / total), 1),
+            'message': message or (f"{stage}: {int(current)}/{int(total)}" if stage else None),
+            'stage': stage,
+            'current': current,
+            'total': total,
+            'elapsed': now - self.started_at
+        }
+        try:
+            self.publish(self.job_id, event)
+        except Exception as e:
+            logger.warning(f"Failed to publish progress for job {self.job_id}: {str(e)}")
+
+    def step_callback(self, total: int, done: int = 0, per_step: int = 1):
+        """diffusers callback_on_step_end reporting done + (step + 1) * per_step of total"""
+        last = [time.perf_counter()]
+
+        def callback(pipe, step, timestep, callback_kwargs):
+            now = time.perf_counter()
+            with self._lock:
+                self.step_seconds.append(now - last[0])
+            last[0] = now
+            self.update(done + (step + 1) * per_step, total)
+            return callback_kwargs
+
+        return callback
+
+    def frames(self, frames: Iterable, total: int = None, stage: str = 'inference') -> Iterator:
+        """Pass frames through, timing their production and counting them"""
+        iterator = iter(frames)
+        while True:
+            start = time.perf_counter()
+            try:
+                frame = next(iterator)
+            except StopIteration:
+                self.record(stage, time.perf_counter() - start)
+                return
+            self.record(stage, time.perf_counter() - start)
+            self.update(self.count('frames'), total, stage=stage)
+            yield frame
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            steps = list(self.step_seconds)
+            result = {
+                'total_seconds': self.clock() - self.started_at,
+                'stages': dict(self.stage_seconds),
+                'counters': dict(self.counters),
+                'progress_events': self.events_published
+            }
+        if steps:
+            result['steps'] = {
+                'count': len(steps),
+                'mean_seconds': sum(steps) / len(steps),
+                'max_seconds': max(steps)
+            }
+        return result
+
+
+class ReporterGroup:
+    """Fans the progress and timings of one batched pipeline call out to every job in it"""
+
+    def __init__(self, reporters: List[ProgressReporter]):
+        self.reporters = reporters
+
+    @contextmanager
+    def stage(self, name: str):
+        with ExitStack() as stack:
+            for reporter in self.reporters:
+                stack.enter_context(reporter.stage(name))
+            yield
+
+    def timed(self, stage: str, fn: Callable) -> Callable:
+        def wrapper(*args, **kwargs):
+            with self.stage(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def step_callback(self, total: int, done: int = 0, per_step: int = 1):
+        callbacks = [reporter.step_callback(total, done, per_step) for reporter in self.reporters]
+
+        def callback(pipe, step, timestep, callback_kwargs):
+            for reporter_callback in callbacks:
+                callback_kwargs = reporter_callback(pipe, step, timestep, callback_kwargs)
+            return callback_kwargs
+
+        return callback
+
+
+# Reporters of running jobs by job id, so every pipeline stage thread finds the same one
+_reporters: Dict[str, ProgressReporter] = {}
+_reporters_lock = threading.Lock()
+
+
+def start(job_id: str, publish: ProgressPublisher = None) -> ProgressReporter:
+    """Create the reporter for a job that is starting"""
+    reporter = ProgressReporter(job_id, publish)
+    with _reporters_lock:
+        _reporters[job_id] = reporter
+    return reporter
+
+
+def get(job_data: Dict[str, Any]) -> ProgressReporter:
+    """Reporter for a running job (a detached one if the job wasn't started through the worker)"""
+    with _reporters_lock:
+        reporter = _reporters.get(job_data.get('jobId'))
+    return reporter or ProgressReporter(job_data.get('jobId'))
+
+
+def finish(job_id: str) -> Optional[Dict[str, Any]]:
+    """Drop a job's reporter and return its timings"""
+    with _reporters_lock:
+        reporter = _reporters.pop(job_id, None)
+    return reporter.to_dict() if reporter else None
@@ -0,0 +1,92 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(text: Optional[str]) -> str:
+    """Text as the CLIP tokenizers see it: whitespace collapsed and lower-cased"""
+    return ' '.join((text or '').split()).lower()
+
+
+class PromptEmbeddingCache:
+    """Bounded LRU of SDXL text-encoder outputs per unique prompt string.
+
+    Each entry holds the prompt_embeds and pooled_prompt_embeds of one
+    string (kept on the CPU so the cache doesn't cost VRAM). embed() builds
+    the pipeline keyword arguments for a batch of prompts from cached
+    entries, so every distinct string goes through the text encoders once.
+    """
+
+    def __init__(self, max_entries: int = None):
+        self.max_entries = int(os.getenv('PROMPT_CACHE_SIZE', 256)) if max_entries is None else max_entries
+        self._entries: "OrderedDict[str, Tuple[torch.Tensor, torch.Tensor]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _encode(self, pipe, text: str, device) -> Tuple[torch.Tensor, torch.Tensor]:
+        with torch.no_grad():
+            embeds, _, pooled, _ = pipe.encode_prompt(
+                prompt=text,
+                device=device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False
+            )
+        return embeds, pooled
+
+    def _zeros(self, pipe, device) -> Tuple[torch.Tensor, torch.Tensor]:
+        # SDXL base uses zero embeddings for an empty negative prompt
+        dtype = pipe.text_encoder_2.dtype
+        hidden_size = pipe.text_encoder.config.hidden_size + pipe.text_encoder_2.config.hidden_size
+        embeds = torch.zeros((1, pipe.tokenizer.model_max_length, hidden_size), dtype=dtype, device=device)
+        pooled = torch.zeros((1, pipe.text_encoder_2.config.projection_dim), dtype=dtype, device=device)
+        return embeds, pooled
+
+    def get(self, pipe, text: str, device, negative: bool = False) -> Tuple[torch.Tensor, torch.Tensor]:
+        """(prompt_embeds, pooled_prompt_embeds) for one string, each with batch size 1"""
+        key = normalize_prompt(text)
+        if negative and not key and getattr(pipe.config, 'force_zeros_for_empty_prompt', False):
+            return self._zeros(pipe, device)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+
+        if entry is None:
+            embeds, pooled = self._encode(pipe, key, device)
+            entry = (embeds.cpu(), pooled.cpu())
+            with self._lock:
+                self.stats['misses'] += 1
+                self._entries[key] = entry
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self.stats['evictions'] += 1
+
+        return entry[0].to(device), entry[1].to(device)
+
+    def embed(self, pipe, prompts: List[str], negative_prompts: List[str], device) -> Dict[str, Any]:
+        """Pipeline kwargs (prompt_embeds etc.) for parallel lists of prompts"""
+        positive = [self.get(pipe, text, device) for text in prompts]
+        negative = [self.get(pipe, text, device, negative=True) for text in negative_prompts]
+        return {
+            'prompt_embeds': torch.cat([embeds for embeds, _ in positive]),
+            'pooled_prompt_embeds': torch.cat([pooled for _, pooled in positive]),
+            'negative_prompt_embeds': torch.cat([embeds for embeds, _ in negative]),
+            'negative_pooled_prompt_embeds': torch.cat([pooled for _, pooled in negative])
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats['hits'] + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': self.stats['hits'] / lookups if lookups else 0.0,
+                'entries': len(self._entries)
+            }
@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Statuses after which a job leaves this worker's processing list
+TERMINAL_STATUSES = {'completed', 'failed'}
+
+# Moves one specific queued payload (KEYS[1] -> KEYS[2]) only if it is still queued
+CLAIM_SCRIPT = """
+local removed = redis.call('LREM', KEYS[1], 1, ARGV[1])
+if removed > 0 then
+    redis.call('RPUSH', KEYS[2], ARGV[1])
+end
+return removed
+"""
+
+
+def connect(host: str = None, port: int = None, max_connections: int = None):
+    """Redis client over a shared, bounded connection pool"""
+    import redis
+
+    pool = redis.ConnectionPool(
+        host=host or os.getenv('REDIS_HOST', 'localhost'),
+        port=port or int(os.getenv('REDIS_PORT', 6379)),
+        max_connections=max_connections or int(os.getenv('REDIS_MAX_CONNECTIONS', 16)),
+        decode_responses=True
+    )
+    return redis.Redis(connection_pool=pool)
+
+
+class QueueClient:
+    """Claims jobs from the Bull wait list without losing them on a crash.
+
+    Jobs are moved atomically (BLMOVE) from the wait list into this
+    worker's processing list and stay there until their final status is
+    published. While the worker is alive a background thread refreshes its
+    heartbeat key, which expires after `visibility_timeout` seconds; any
+    worker whose heartbeat has expired is considered dead and its
+    processing list is pushed back to the head of the wait list.
+
+    Status and progress updates are buffered and published in pipelines,
+    flushed every `flush_interval` seconds. A job's final status is flushed
+    together with the earlier updates and the removal from the processing
+    list in one round-trip.
+    """
+
+    def __init__(self, redis_client, queue_key: str = 'bull:job-queue:wait',
+                 channel: str = 'job-updates', worker_id: str = None,
+                 visibility_timeout: float = None, heartbeat_interval: float = None,
+                 flush_interval: float = None):
+        self.redis_client = redis_client
+        self.queue_key = queue_key
+        self.channel = channel
+        self.worker_id = worker_id or os.getenv('WORKER_ID') or f"{socket.gethostname()}:{os.getpid()}"
+        self.visibility_timeout = float(os.getenv('QUEUE_VISIBILITY_TIMEOUT_S', 30)) if visibility_timeout is None else visibility_timeout
+        self.heartbeat_interval = float(os.getenv('QUEUE_HEARTBEAT_S', 10)) if heartbeat_interval is None else heartbeat_interval
+        self.flush_interval = float(os.getenv('STATUS_FLUSH_MS', 20)) / 1000 if flush_interval is None else flush_interval
+
+        prefix = queue_key.rsplit(':', 1)[0]
+        self.workers_key = f"{prefix}:workers"
+        self.processing_key = self.processing_key_for(self.worker_id)
+        self._claim_script = redis_client.register_script(CLAIM_SCRIPT)
+
+        # Raw payloads of claimed jobs by job id, needed to remove them on completion
+        self.claimed: Dict[Any, str] = {}
+        self.buffer: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+        # Serializes flushes so updates reach Redis in publish order; held
+        # across the round-trip, unlike _lock, so publish() never waits on Redis
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.stats = {
+            'claims': 0,
+            'lookahead_claims': 0,
+            'lost_claims': 0,
+            'acks': 0,
+            'reclaimed': 0,
+            'heartbeats': 0,
+            'published': 0,
+            'pipelines': 0
+        }
+
+    def processing_key_for(self, worker_id: str) -> str:
+        return f"{self.queue_key.rsplit(':', 1)[0]}:processing:{worker_id}"
+
+    def heartbeat_key_for(self, worker_id: str) -> str:
+        return f"{self.queue_key.rsplit(':', 1)[0]}:heartbeat:{worker_id}"
+
+    def _track(self, raw: str) -> Dict[str, Any]:
+        job = json.loads(raw)
+        with self._lock:
+            self.claimed[job.get('jobId')] = raw
+        return job
+
+    def claim(self, timeout: float = 0) -> Optional[Dict[str, Any]]:
+        """Move the head of the wait list into our processing list, blocking up to timeout seconds"""
+        if timeout:
+            raw = self.redis_client.blmove(self.queue_key, self.processing_key, timeout, 'LEFT', 'RIGHT')
+        else:
+            raw = self.redis_client.lmove(self.queue_key, self.processing_key, 'LEFT', 'RIGHT')
+        if raw is None:
+            return None
+
+        self.stats['claims'] += 1
+        return self._track(raw)
+
+    def claim_raw(self, raw: str) -> Optional[Dict[str, Any]]:
+        """Claim a specific queued job (seen through peek); None if another worker took it first"""
+        # One script, so a crash can never leave a copy in our processing list
+        # that was not removed from the wait list
+        if not self._claim_script(keys=[self.queue_key, self.processing_key], args=[raw]):
+            self.stats['lost_claims'] += 1
+            return None
+
+        self.stats['claims'] += 1
+        self.stats['lookahead_claims'] += 1
+        return self._track(raw)
+
+    def peek(self, count: int) -> List[str]:
+        """Raw payloads of the first `count` queued jobs, left in place"""
+        if count <= 0:
+            return []
+        return self.redis_client.lrange(self.queue_key, 0, count - 1)
+
+    def publish(self, update: Dict[str, Any]):
+        """Queue a status/progress update; final statuses are flushed immediately with the ack"""
+        message = json.dumps(update)
+        with self._lock:
+            self.buffer.append(('publish', message))
+            if update.get('status') in TERMINAL_STATUSES:
+                raw = self.claimed.pop(update.get('jobId'), None)
+                if raw is not None:
+                    self.buffer.append(('ack', raw))
+                terminal = True
+            else:
+                terminal = False
+
+        if terminal or self._thread is None:
+            self.flush()
+        else:
+            self._wake.set()
+
+    def flush(self):
+        """Publish buffered updates and remove finished jobs in one pipeline"""
+        with self._flush_lock:
+            with self._lock:
+                if not self.buffer:
+                    return
+                buffered, self.buffer = self.buffer, []
+
+            pipe = self.redis_client.pipeline(transaction=False)
+            for kind, value in buffered:
+                if kind == 'publish':
+                    pipe.publish(self.channel, value)
+                else:
+                    pipe.lrem(self.processing_key, 1, value)
+            pipe.execute()
+
+        with self._lock:
+            self.stats['pipelines'] += 1
+            self.stats['published'] += sum(kind == 'publish' for kind, _ in buffered)
+            self.stats['acks'] += sum(kind == 'ack' for kind, _ in buffered)
+
+    def heartbeat(self):
+        pipe = self.redis_client.pipeline(transaction=False)
+        pipe.set(self.heartbeat_key_for(self.worker_id), time.time(), ex=max(1, int(self.visibility_timeout)))
+        pipe.sadd(self.workers_key, self.worker_id)
+        pipe.execute()
+        self.stats['heartbeats'] += 1
+
+    def requeue(self, worker_id: str) -> int:
+        """Push a worker's unfinished jobs back to the head of the wait list, keeping their order"""
+        source = self.processing_key_for(worker_id)
+        moved = 0
+        while self.redis_client.lmove(source, self.queue_key, 'RIGHT', 'LEFT') is not None:
+            moved += 1
+        return moved
+
+    def reclaim_stalled(self) -> int:
+        """Requeue the jobs of workers whose heartbeat expired"""
+        reclaimed = 0
+        for worker_id in self.redis_client.smembers(self.workers_key):
+            if worker_id == self.worker_id or self.redis_client.exists(self.heartbeat_key_for(worker_id)):
+                continue
+            moved = self.requeue(worker_id)
+            self.redis_client.srem(self.workers_key, worker_id)
+            if moved:
+                logger.warning(f"Requeued {moved} jobs from stalled worker {worker_id}")
+            reclaimed += moved
+
+        self.stats['reclaimed'] += reclaimed
+        return reclaimed
+
+    def _run(self):
+        next_heartbeat = 0.0
+        next_reclaim = time.monotonic() + self.visibility_timeout
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+                now = time.monotonic()
+                if now >= next_heartbeat:
+                    self.heartbeat()
+                    next_heartbeat = now + self.heartbeat_interval
+                if now >= next_reclaim:
+                    self.reclaim_stalled()
+                    next_reclaim = now + self.visibility_timeout
+            except Exception as e:
+                logger.error(f"Queue maintenance failed: {str(e)}")
+
+    def start(self):
+        """Register this worker, recover its own unfinished jobs and start heartbeats/flushing"""
+        if self._thread is not None:
+            return
+
+        # Jobs left in our list by a previous run with the same WORKER_ID
+        recovered = 0 if self.claimed else self.requeue(self.worker_id)
+        if recovered:
+            logger.warning(f"Requeued {recovered} unfinished jobs from a previous run of {self.worker_id}")
+        self.heartbeat()
+        self.reclaim_stalled()
+
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='queue-client', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Flush pending updates and deregister; claimed jobs go back to the wait list"""
+        if self._thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._thread.join()
+            self._thread = None
+
+        self.flush()
+        self.requeue(self.worker_id)
+        with self._lock:
+            self.claimed.clear()
+        self.redis_client.delete(self.heartbeat_key_for(self.worker_id))
+        self.redis_client.srem(self.workers_key, self.worker_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, 'worker_id': self.worker_id, 'in_flight': len(self.claimed),
+                    'buffered': len(self.buffer)}
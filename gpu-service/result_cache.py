@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def outputs_exist(result: Dict[str, Any]) -> bool:
+    """True while every output file referenced by a result is still on disk"""
+    return all(os.path.exists(path) for path in result.get('images', []))
+
+
+class ResultCache:
+    """Finished job results keyed by a fingerprint of the request.
+
+    Only requests with an explicit seed are fingerprinted, since without
+    one the output isn't reproducible. Entries expire after `ttl_seconds`
+    and the least recently used are evicted past `max_entries`. While a
+    result is being computed, identical requests wait on it instead of
+    starting their own computation.
+
+    Callers use acquire() to get a finished result or claim the key, then
+    complete() or fail() the claim once the computation is done.
+    """
+
+    def __init__(self, ttl_seconds: float = None, max_entries: int = None,
+                 validate: Callable[[Dict[str, Any]], bool] = outputs_exist,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl_seconds = float(os.getenv('RESULT_CACHE_TTL_S', 3600)) if ttl_seconds is None else ttl_seconds
+        self.max_entries = int(os.getenv('RESULT_CACHE_SIZE', 512)) if max_entries is None else max_entries
+        self.validate = validate
+        self.clock = clock
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'inflight_joins': 0,
+            'misses': 0,
+            'expirations': 0,
+            'evictions': 0
+        }
+
+    @staticmethod
+    def fingerprint(namespace: str, params: Dict[str, Any]) -> Optional[str]:
+        """Deterministic key for a request, or None if it has no explicit seed"""
+        if params.get('seed') is None:
+            return None
+        canonical = json.dumps(params, sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(f"{namespace}:{canonical}".encode()).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Live entry for key (caller holds the lock)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        result, expires_at = entry
+        if self.clock() >= expires_at or not self.validate(result):
+            del self._entries[key]
+            self.stats['expirations'] += 1
+            return None
+
+        self._entries.move_to_end(key)
+        return result
+
+    def acquire(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the finished result for key, or None once the caller owns computing it.
+
+        Blocks while an identical request is in flight. If that computation
+        fails, the key is retried (and possibly claimed by this caller).
+        """
+        while True:
+            with self._lock:
+                result = self._lookup(key)
+                if result is not None:
+                    self.stats['hits'] += 1
+                    return {**result, 'cache_hit': True}
+
+                future = self._inflight.get(key)
+                if future is None:
+                    self._inflight[key] = Future()
+                    self.stats['misses'] += 1
+                    return None
+                self.stats['inflight_joins'] += 1
+
+            try:
+                result = future.result()
+            except Exception:
+                continue
+            return {**result, 'cache_hit': True}
+
+    def record_join(self):
+        """Count a request answered by an identical one computed alongside it"""
+        with self._lock:
+            self.stats['inflight_joins'] += 1
+
+    def complete(self, key: str, result: Dict[str, Any]):
+        """Store the result for a claimed key and wake up waiting requests"""
+        with self._lock:
+            self._entries[key] = (result, self.clock() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+            future = self._inflight.pop(key, None)
+
+        if future is not None:
+            future.set_result(result)
+
+    def fail(self, key: str, error: Exception):
+        """Release a claimed key after its computation failed"""
+        with self._lock:
+            future = self._inflight.pop(key, None)
+
+        if future is not None:
+            future.set_exception(error)
+
+    def get_or_compute(self, key: Optional[str], compute_fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Return the cached result for key, computing it on a miss (None key = never cached)"""
+        if key is None:
+            return compute_fn()
+
+        result = self.acquire(key)
+        if result is not None:
+            return result
+
+        try:
+            result = compute_fn()
+        except Exception as e:
+            self.fail(key, e)
+            raise
+
+        self.complete(key, result)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.stats['hits'] + self.stats['inflight_joins']
+            lookups = hits + self.stats['misses']
+            return {
+                **self.stats,
+                'hit_rate': hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'inflight': len(self._inflight)
+            }
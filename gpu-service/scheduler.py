@@ -0,0 +1,199 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, Any, Callable, Iterable, List, Optional, Tuple
+from gpu_manager import model_key
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Job types whose processor implements process_batch
+BATCHABLE_JOB_TYPES = {'image-generation'}
+
+# Key each processor registers its model under in GPUManager.loaded_models
+SDXL_BASE_KEY = model_key("stabilityai/stable-diffusion-xl-base-1.0", "float16", "fp16")
+
+JOB_TYPE_MODELS = {
+    'image-generation': SDXL_BASE_KEY,
+    'influencer-creation': SDXL_BASE_KEY,
+    'cloth-swap': 'cloth-swap',
+    '3d-video': '3d-video',
+    'study-animation': 'study-anim',
+    'story-video': 'story-video'
+}
+
+
+def batch_key(job: Dict[str, Any]) -> Optional[Tuple]:
+    """Jobs with the same key can share one pipeline call; None means not batchable"""
+    data = job.get('data', {})
+    job_type = data.get('jobType')
+    if job_type not in BATCHABLE_JOB_TYPES:
+        return None
+
+    return (
+        job_type,
+        data.get('width', 1024),
+        data.get('height', 1024),
+        data.get('steps', 30),
+        data.get('scheduler', 'dpm-solver')
+    )
+
+
+class JobScheduler:
+    """Claims jobs from the Bull wait list and groups compatible ones into micro-batches.
+
+    The next job is chosen with model affinity: among the first `lookahead`
+    queued jobs, one whose model is already resident is preferred over the
+    head of the queue, so alternating job types don't reload models every
+    time. The head is always taken once it has waited `max_wait_seconds` or
+    been passed over `max_skips` times, which bounds starvation.
+
+    After the first job of a batchable type arrives, the scheduler keeps
+    watching the first `lookahead` queued jobs for up to `batch_window_ms`
+    and claims only the compatible ones. Other jobs stay in Redis, where
+    any worker can pick them up.
+
+    Jobs are claimed through a QueueClient, so claimed jobs sit in this
+    worker's processing list and are requeued if the worker dies.
+    """
+
+    def __init__(self, queue, batch_window_ms: int = None, max_batch_size: int = None,
+                 resident_models: Callable[[], Iterable[str]] = None,
+                 lookahead: int = None, max_wait_seconds: float = None, max_skips: int = None):
+        self.queue = queue
+        self.batch_window_ms = int(os.getenv('BATCH_WINDOW_MS', 50)) if batch_window_ms is None else batch_window_ms
+        self.max_batch_size = int(os.getenv('MAX_BATCH_SIZE', 4)) if max_batch_size is None else max_batch_size
+        self.resident_models = resident_models or (lambda: ())
+        self.lookahead = int(os.getenv('SCHEDULER_LOOKAHEAD', 10)) if lookahead is None else lookahead
+        self.max_wait_seconds = float(os.getenv('SCHEDULER_MAX_WAIT_S', 60)) if max_wait_seconds is None else max_wait_seconds
+        self.max_skips = int(os.getenv('SCHEDULER_MAX_SKIPS', 5)) if max_skips is None else max_skips
+
+        # Aging state per job id: when it was first seen and how often it was passed over
+        self.first_seen: Dict[Any, float] = {}
+        self.skips: Dict[Any, int] = {}
+
+        self.stats = {
+            'scheduled': 0,
+            'reloads_avoided': 0,
+            'jobs_passed_over': 0,
+            'aged_promotions': 0
+        }
+
+    def _pop_job(self, timeout: int = 0) -> Optional[Dict[str, Any]]:
+        """Claim the head of the queue, blocking up to timeout seconds (0 = don't block)"""
+        return self.queue.claim(timeout)
+
+    def _waited(self, job: Dict[str, Any], now: float) -> float:
+        """Seconds a job has been waiting, from Bull's timestamp or first sighting"""
+        job_id = job.get('jobId')
+        if 'timestamp' in job:
+            return max(0.0, now - job['timestamp'] / 1000)
+        return now - self.first_seen.setdefault(job_id, now)
+
+    def _forget(self, job: Dict[str, Any]):
+        self.first_seen.pop(job.get('jobId'), None)
+        self.skips.pop(job.get('jobId'), None)
+
+    def _prune(self, visible: set):
+        """Drop aging state of jobs that left the lookahead window (e.g. claimed by another worker)"""
+        for state in (self.first_seen, self.skips):
+            for job_id in [job_id for job_id in state if job_id not in visible]:
+                del state[job_id]
+
+    def _claim_next(self, timeout: int) -> Optional[Dict[str, Any]]:
+        """Claim the next job, preferring ones whose model is already loaded"""
+        while True:
+            # Candidates in queue order, still unclaimed
+            candidates = [(json.loads(raw), raw) for raw in self.queue.peek(self.lookahead)]
+            self._prune({job.get('jobId') for job, _ in candidates})
+
+            if not candidates:
+                job = self._pop_job(timeout)
+                if job is not None:
+                    self.stats['scheduled'] += 1
+                return job
+
+            now = time.time()
+            head = candidates[0][0]
+            resident = set(self.resident_models())
+            choice = 0
+
+            head_id = head.get('jobId')
+            head_resident = JOB_TYPE_MODELS.get(head.get('data', {}).get('jobType')) in resident
+            if self._waited(head, now) >= self.max_wait_seconds:
+                aged = 'max_wait'
+            elif self.skips.get(head_id, 0) >= self.max_skips:
+                aged = 'max_skips'
+            else:
+                aged = None
+
+            if not aged and not head_resident:
+                for index, (job, _) in enumerate(candidates):
+                    if JOB_TYPE_MODELS.get(job.get('data', {}).get('jobType')) in resident:
+                        choice = index
+                        break
+
+            job, raw = candidates[choice]
+            if self.queue.claim_raw(raw) is None:
+                # Another worker claimed it first; look again
+                continue
+
+            # Everything ahead of the chosen job was passed over once more
+            for skipped, _ in candidates[:choice]:
+                skipped_id = skipped.get('jobId')
+                self._waited(skipped, now)
+                self.skips[skipped_id] = self.skips.get(skipped_id, 0) + 1
+
+            if aged and not head_resident:
+                # Aged out: the head runs even though it means a model reload
+                self.stats['aged_promotions'] += 1
+                metrics.SCHEDULER_AGED_PROMOTIONS.inc(reason=aged)
+            if choice > 0:
+                job_type = job['data'].get('jobType')
+                self.stats['reloads_avoided'] += 1
+                self.stats['jobs_passed_over'] += choice
+                metrics.SCHEDULER_RELOADS_AVOIDED.inc(job_type=job_type)
+                metrics.SCHEDULER_JOBS_PASSED_OVER.inc(choice)
+                logger.info(
+                    f"Scheduled job {job.get('jobId')} ahead of {choice} queued jobs "
+                    f"(model {JOB_TYPE_MODELS.get(job_type)} already loaded)"
+                )
+
+            self.stats['scheduled'] += 1
+            self._forget(job)
+            return job
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+    def next_batch(self, timeout: int = 5) -> List[Dict[str, Any]]:
+        """Return the next batch of jobs to run (empty if none arrived within timeout)"""
+        first = self._claim_next(timeout)
+        if first is None:
+            return []
+
+        key = batch_key(first)
+        if key is None or self.max_batch_size <= 1:
+            return [first]
+
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window_ms / 1000
+        while True:
+            # Claim only compatible jobs; the rest stay queued for any worker
+            for raw in self.queue.peek(self.lookahead):
+                if len(batch) >= self.max_batch_size:
+                    break
+                if batch_key(json.loads(raw)) == key:
+                    job = self.queue.claim_raw(raw)
+                    if job is not None:
+                        self._forget(job)
+                        batch.append(job)
+            if len(batch) >= self.max_batch_size or time.monotonic() >= deadline:
+                break
+            time.sleep(0.005)
+
+        if len(batch) > 1:
+            logger.info(f"Micro-batched {len(batch)} {key[0]} jobs")
+
+        return batch
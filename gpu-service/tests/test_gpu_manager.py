@@ -0,0 +1,169 @@
+import threading
+
+import pytest
+
+import gpu_manager
+from gpu_manager import GPUManager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    # Load times are measured with perf_counter; loaders advance the clock instead of sleeping
+    monkeypatch.setattr(gpu_manager.time, 'perf_counter', clock)
+    return clock
+
+
+@pytest.fixture
+def manager(clock):
+    return GPUManager(max_vram_mb=1000, clock=clock, device='cpu')
+
+
+def loader(clock, load_seconds, model='model'):
+    def load():
+        clock.advance(load_seconds)
+        return model
+    return load
+
+
+def load(manager, clock, name, load_seconds, vram_mb=400):
+    with manager.model_context(name, loader(clock, load_seconds, name), required_vram_mb=vram_mb) as model:
+        return model
+
+
+def test_evicts_cheapest_to_reload_first(manager, clock):
+    load(manager, clock, 'cheap', 1)
+    load(manager, clock, 'expensive', 20)
+
+    load(manager, clock, 'new', 1)
+
+    assert set(manager.loaded_models) == {'expensive', 'new'}
+    assert [entry['model'] for entry in manager.get_cache_stats()['recent_evictions']] == ['cheap']
+
+
+def test_long_idle_model_evicted_before_recently_used(manager, clock):
+    load(manager, clock, 'expensive', 20)
+    clock.advance(1000)
+    load(manager, clock, 'cheap', 1)
+
+    load(manager, clock, 'new', 1)
+
+    assert set(manager.loaded_models) == {'cheap', 'new'}
+
+
+def test_evicts_only_as_much_as_needed(manager, clock):
+    load(manager, clock, 'a', 1, vram_mb=300)
+    load(manager, clock, 'b', 2, vram_mb=300)
+    load(manager, clock, 'c', 3, vram_mb=300)
+
+    assert manager.make_room(400) == ['a']
+    assert set(manager.loaded_models) == {'b', 'c'}
+
+
+def test_in_use_models_are_not_evicted(manager, clock):
+    load(manager, clock, 'busy', 1)
+    load(manager, clock, 'idle', 20)
+
+    with manager.model_context('busy', loader(clock, 1)):
+        load(manager, clock, 'new', 1)
+        assert set(manager.loaded_models) == {'busy', 'new'}
+
+
+def test_nothing_evicted_when_all_models_in_use(manager, clock):
+    with manager.model_context('a', loader(clock, 1), required_vram_mb=500):
+        with manager.model_context('b', loader(clock, 1), required_vram_mb=500):
+            assert manager.make_room(400) == []
+            assert set(manager.loaded_models) == {'a', 'b'}
+
+
+def test_resident_model_is_reused(manager, clock):
+    load(manager, clock, 'a', 5)
+    load(manager, clock, 'a', 5)
+
+    stats = manager.get_cache_stats()
+    assert stats['load_counts'] == {'a': 1}
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_failed_load_releases_its_reservation(manager, clock):
+    def broken():
+        raise RuntimeError("weights missing")
+
+    with pytest.raises(RuntimeError):
+        with manager.model_context('broken', broken, required_vram_mb=600):
+            pass
+
+    assert 'broken' not in manager.model_info
+    assert manager.get_available_vram() == 1000
+
+
+def test_slow_load_does_not_block_resident_models(manager, clock):
+    load(manager, clock, 'resident', 1)
+    loading = threading.Event()
+    release = threading.Event()
+
+    def slow_loader():
+        loading.set()
+        release.wait(5)
+        return 'slow'
+
+    def load_slow():
+        with manager.model_context('slow', slow_loader, required_vram_mb=400):
+            pass
+
+    thread = threading.Thread(target=load_slow)
+    thread.start()
+    try:
+        assert loading.wait(5)
+        done = threading.Event()
+
+        def use_resident():
+            with manager.model_context('resident', loader(clock, 1)) as model:
+                assert model == 'resident'
+            manager.get_cache_stats()
+            done.set()
+
+        threading.Thread(target=use_resident, daemon=True).start()
+        assert done.wait(2), "resident model lookup blocked behind another model's load"
+        # The loading model's footprint is reserved and it can't be evicted
+        assert manager.make_room(1000) == ['resident']
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_concurrent_requests_share_one_load(manager, clock):
+    release = threading.Event()
+    calls = []
+
+    def slow_loader():
+        calls.append(1)
+        release.wait(5)
+        return 'shared'
+
+    results = []
+
+    def request():
+        with manager.model_context('shared', slow_loader) as model:
+            results.append(model)
+
+    threads = [threading.Thread(target=request) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == ['shared'] * 4
+    assert len(calls) == 1
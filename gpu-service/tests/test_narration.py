@@ -0,0 +1,66 @@
+import os
+import time
+
+from narration import NarrationService
+
+
+def write_audio(text, voice_style, path):
+    with open(path, 'wb') as f:
+        f.write(b'\x00' * 100)
+
+
+def service(cache_dir, **kwargs):
+    """A worker's narration cache with room for a single 100 byte file"""
+    kwargs.setdefault('rescan_interval_s', 0)
+    narration = NarrationService(write_audio, cache_dir=str(cache_dir), max_workers=1, evict_grace_s=60, **kwargs)
+    narration.max_disk_bytes = 150
+    return narration
+
+
+def age(path, seconds):
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_meta_is_written_next_to_audio(tmp_path):
+    path = service(tmp_path).get('hello world')
+
+    assert os.path.exists(f"{path[:-4]}.json")
+    names = [name for _, _, files in os.walk(tmp_path) for name in files]
+    assert not [name for name in names if '.tmp' in name]
+
+
+def test_recently_used_audio_is_not_evicted_by_another_worker(tmp_path):
+    a, b = service(tmp_path), service(tmp_path)
+    in_use = a.get('first scene')
+
+    b.get('second scene')
+
+    assert os.path.exists(in_use)
+    assert b.get_stats()['evictions'] == 0
+
+
+def test_another_workers_files_count_towards_the_budget(tmp_path):
+    a, b = service(tmp_path), service(tmp_path)
+    old = a.get('first scene')
+    age(old, 120)
+
+    b.get('second scene')
+
+    assert not os.path.exists(old)
+    assert b.get_stats()['evictions'] == 1
+
+
+def test_stale_index_entries_are_rechecked_before_evicting(tmp_path):
+    a = service(tmp_path, rescan_interval_s=3600)
+    b = service(tmp_path)
+    first = a.get('first scene')
+    age(first, 120)
+    b.get('second scene')
+    assert not os.path.exists(first)
+
+    # a still indexes the file b removed: it is dropped, not counted as evicted
+    a.get('third scene')
+
+    assert a.get_stats()['evictions'] == 0
+    assert list(a._disk) == [a.get('third scene')]
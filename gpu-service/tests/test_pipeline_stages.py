@@ -0,0 +1,61 @@
+import threading
+import time
+
+from pipeline_stages import StagedWorker
+
+
+class BlockingProcessor:
+    """Staged processor whose finalize waits until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def prepare(self, job_data):
+        return job_data
+
+    def infer(self, prepared):
+        return {}
+
+    def finalize(self, job_data, output):
+        self.release.wait()
+        return {'ok': True}
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_run_returns_after_stop_with_full_queues():
+    processor = BlockingProcessor()
+    claimed, statuses, requeued = [], {}, []
+
+    def next_batch(timeout=1):
+        job = {'jobId': f"j{len(claimed) + 1}", 'data': {'jobType': 'story-video'}}
+        claimed.append(job['jobId'])
+        return [job]
+
+    def update_job_status(job_id, status, result=None, error=None):
+        statuses[job_id] = status
+
+    staged = StagedWorker(next_batch, lambda job_type: processor, update_job_status, lambda jobs: None,
+                          queue_depth=1, requeue_jobs=lambda jobs: requeued.extend(job['jobId'] for job in jobs))
+    runner = threading.Thread(target=staged.run, daemon=True)
+    runner.start()
+
+    # j1 is stuck in finalize; j2..j5 fill the output queue, the inference
+    # stage's pending put, the inference queue and the prefetch stage's pending put
+    wait_for(lambda: len(claimed) >= 5)
+    time.sleep(0.2)
+    assert staged.inference_queue.full() and staged.output_queue.full()
+
+    staged.stop()
+    processor.release.set()
+    runner.join(timeout=5)
+
+    assert not runner.is_alive()
+    assert statuses['j1'] == 'completed'
+    assert sorted(requeued) == sorted(set(claimed) - {'j1'})
+    assert staged.inference_queue.empty() and staged.output_queue.empty()
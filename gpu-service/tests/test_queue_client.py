@@ -0,0 +1,206 @@
+import json
+import threading
+
+import fakeredis
+import pytest
+
+from queue_client import QueueClient
+
+WAIT_KEY = 'bull:job-queue:wait'
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def client(redis_client, worker_id='worker-a', **kwargs):
+    return QueueClient(redis_client, WAIT_KEY, 'job-updates', worker_id=worker_id, **kwargs)
+
+
+def enqueue(redis_client, *job_ids):
+    redis_client.rpush(WAIT_KEY, *[json.dumps({'jobId': job_id, 'data': {}}) for job_id in job_ids])
+
+
+def queued_ids(redis_client, key=WAIT_KEY):
+    return [json.loads(raw)['jobId'] for raw in redis_client.lrange(key, 0, -1)]
+
+
+def test_claim_moves_job_into_processing_list(redis_client):
+    enqueue(redis_client, 'j1', 'j2')
+    queue = client(redis_client)
+
+    job = queue.claim()
+
+    assert job['jobId'] == 'j1'
+    assert queued_ids(redis_client) == ['j2']
+    assert queued_ids(redis_client, queue.processing_key) == ['j1']
+    assert queue.get_stats()['in_flight'] == 1
+
+
+def test_claim_returns_none_when_queue_is_empty(redis_client):
+    assert client(redis_client).claim() is None
+
+
+def test_claim_raw_loses_to_another_worker(redis_client):
+    enqueue(redis_client, 'j1')
+    a = client(redis_client, 'worker-a')
+    b = client(redis_client, 'worker-b')
+    raw, = a.peek(1)
+
+    assert b.claim_raw(raw)['jobId'] == 'j1'
+    assert a.claim_raw(raw) is None
+    assert queued_ids(redis_client, a.processing_key) == []
+    assert queued_ids(redis_client, b.processing_key) == ['j1']
+    assert a.get_stats()['lost_claims'] == 1
+
+
+def test_claim_raw_is_one_atomic_command(redis_client):
+    enqueue(redis_client, 'j1', 'j2')
+    queue = client(redis_client)
+    raw = queue.peek(2)[1]
+    commands = []
+    execute_command = redis_client.execute_command
+
+    def record(*args, **options):
+        commands.append(args[0])
+        return execute_command(*args, **options)
+
+    redis_client.execute_command = record
+
+    assert queue.claim_raw(raw)['jobId'] == 'j2'
+    assert queue.claim_raw(raw) is None
+    # The script is loaded on first use; the lists are never touched outside it
+    assert set(commands) == {'EVALSHA', 'SCRIPT LOAD'}
+    assert queued_ids(redis_client) == ['j1']
+    assert queued_ids(redis_client, queue.processing_key) == ['j2']
+
+
+def test_final_status_acks_job(redis_client):
+    enqueue(redis_client, 'j1')
+    queue = client(redis_client)
+    pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+    pubsub.subscribe('job-updates')
+
+    queue.claim()
+    queue.publish({'status': 'processing', 'jobId': 'j1'})
+    assert queued_ids(redis_client, queue.processing_key) == ['j1']
+
+    queue.publish({'status': 'completed', 'jobId': 'j1', 'result': {}})
+
+    assert queued_ids(redis_client, queue.processing_key) == []
+    messages = [pubsub.get_message(timeout=0.1) for _ in range(3)]
+    statuses = [json.loads(message['data'])['status'] for message in messages if message]
+    assert statuses == ['processing', 'completed']
+    stats = queue.get_stats()
+    assert (stats['acks'], stats['published'], stats['in_flight']) == (1, 2, 0)
+
+
+def test_heartbeat_registers_worker_with_expiry(redis_client):
+    queue = client(redis_client, visibility_timeout=30)
+
+    queue.heartbeat()
+
+    assert redis_client.sismember(queue.workers_key, 'worker-a')
+    assert 0 < redis_client.ttl(queue.heartbeat_key_for('worker-a')) <= 30
+
+
+def test_reclaims_jobs_of_stalled_worker_in_order(redis_client):
+    enqueue(redis_client, 'j1', 'j2', 'j3')
+    dead = client(redis_client, 'worker-dead')
+    alive = client(redis_client, 'worker-alive')
+    dead.heartbeat()
+    alive.heartbeat()
+    dead.claim()
+    dead.claim()
+
+    # The dead worker's heartbeat expires
+    redis_client.delete(dead.heartbeat_key_for('worker-dead'))
+
+    assert alive.reclaim_stalled() == 2
+    assert queued_ids(redis_client) == ['j1', 'j2', 'j3']
+    assert not redis_client.sismember(alive.workers_key, 'worker-dead')
+
+
+def test_live_workers_keep_their_jobs(redis_client):
+    enqueue(redis_client, 'j1')
+    busy = client(redis_client, 'worker-busy')
+    other = client(redis_client, 'worker-other')
+    busy.heartbeat()
+    busy.claim()
+
+    assert other.reclaim_stalled() == 0
+    assert queued_ids(redis_client, busy.processing_key) == ['j1']
+
+
+def test_stop_requeues_claimed_jobs(redis_client):
+    enqueue(redis_client, 'j1', 'j2')
+    queue = client(redis_client, heartbeat_interval=60)
+    queue.start()
+    queue.claim()
+
+    queue.stop()
+
+    assert queued_ids(redis_client) == ['j1', 'j2']
+    assert not redis_client.exists(queue.heartbeat_key_for('worker-a'))
+    assert not redis_client.sismember(queue.workers_key, 'worker-a')
+
+
+def test_start_recovers_jobs_left_by_previous_run(redis_client):
+    enqueue(redis_client, 'j1', 'j2')
+    client(redis_client).claim()
+
+    restarted = client(redis_client, heartbeat_interval=60)
+    restarted.start()
+    try:
+        assert queued_ids(redis_client) == ['j1', 'j2']
+    finally:
+        restarted.stop()
+
+
+class SlowPipelineRedis:
+    """Redis client whose pipelines block in execute() until released"""
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.executing = threading.Event()
+        self.release = threading.Event()
+
+    def pipeline(self, transaction=True):
+        pipe = self.redis_client.pipeline(transaction=transaction)
+        execute = pipe.execute
+
+        def slow_execute():
+            self.executing.set()
+            self.release.wait(5)
+            return execute()
+
+        pipe.execute = slow_execute
+        return pipe
+
+    def __getattr__(self, name):
+        return getattr(self.redis_client, name)
+
+
+def test_flush_round_trip_does_not_block_publishers(redis_client):
+    slow = SlowPipelineRedis(redis_client)
+    queue = client(slow)
+    queue.buffer.append(('publish', json.dumps({'status': 'progress', 'jobId': 'j1'})))
+
+    flusher = threading.Thread(target=queue.flush)
+    flusher.start()
+    try:
+        assert slow.executing.wait(5)
+        buffered = threading.Event()
+
+        def publish_and_read_stats():
+            with queue._lock:
+                queue.buffer.append(('publish', json.dumps({'status': 'progress', 'jobId': 'j2'})))
+            queue.get_stats()
+            buffered.set()
+
+        threading.Thread(target=publish_and_read_stats, daemon=True).start()
+        assert buffered.wait(2), "publishing waited on another thread's Redis round-trip"
+    finally:
+        slow.release.set()
+        flusher.join()
@@ -0,0 +1,93 @@
+import json
+import time
+
+import fakeredis
+import pytest
+
+from queue_client import QueueClient
+from scheduler import JobScheduler, JOB_TYPE_MODELS
+
+WAIT_KEY = 'bull:job-queue:wait'
+
+
+@pytest.fixture
+def redis_client():
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def enqueue(redis_client, *jobs):
+    """Push (jobId, jobType) pairs, optionally with a Bull timestamp as a third item"""
+    for job in jobs:
+        payload = {'jobId': job[0], 'data': {'jobType': job[1]}}
+        if len(job) > 2:
+            payload['timestamp'] = job[2]
+        redis_client.rpush(WAIT_KEY, json.dumps(payload))
+
+
+def scheduler(redis_client, resident=(), **kwargs):
+    queue = QueueClient(redis_client, WAIT_KEY, 'job-updates', worker_id='worker-a')
+    kwargs.setdefault('batch_window_ms', 0)
+    kwargs.setdefault('max_wait_seconds', 60)
+    kwargs.setdefault('max_skips', 5)
+    return JobScheduler(queue, resident_models=lambda: resident, **kwargs)
+
+
+def test_affinity_picks_job_with_resident_model(redis_client):
+    enqueue(redis_client, ('j1', 'cloth-swap'), ('j2', '3d-video'), ('j3', 'story-video'))
+    sched = scheduler(redis_client, resident=(JOB_TYPE_MODELS['story-video'],))
+
+    job = sched._claim_next(timeout=0)
+
+    assert job['jobId'] == 'j3'
+    assert sched.skips == {'j1': 1, 'j2': 1}
+    stats = sched.get_stats()
+    assert stats['reloads_avoided'] == 1
+    assert stats['jobs_passed_over'] == 2
+
+
+def test_head_runs_when_nothing_is_resident(redis_client):
+    enqueue(redis_client, ('j1', 'cloth-swap'), ('j2', '3d-video'))
+    sched = scheduler(redis_client)
+
+    assert sched._claim_next(timeout=0)['jobId'] == 'j1'
+    assert sched.get_stats()['reloads_avoided'] == 0
+
+
+def test_head_is_promoted_after_max_skips(redis_client):
+    enqueue(redis_client, ('head', 'cloth-swap'),
+            ('a', 'story-video'), ('b', 'story-video'), ('c', 'story-video'))
+    sched = scheduler(redis_client, resident=(JOB_TYPE_MODELS['story-video'],), max_skips=2)
+
+    claimed = [sched._claim_next(timeout=0)['jobId'] for _ in range(3)]
+
+    assert claimed == ['a', 'b', 'head']
+    assert sched.get_stats()['aged_promotions'] == 1
+    assert 'head' not in sched.skips
+
+
+def test_head_is_promoted_after_max_wait(redis_client):
+    stale = (time.time() - 120) * 1000
+    enqueue(redis_client, ('head', 'cloth-swap', stale), ('a', 'story-video'))
+    sched = scheduler(redis_client, resident=(JOB_TYPE_MODELS['story-video'],), max_wait_seconds=60)
+
+    assert sched._claim_next(timeout=0)['jobId'] == 'head'
+    stats = sched.get_stats()
+    assert stats['aged_promotions'] == 1
+    assert stats['reloads_avoided'] == 0
+
+
+def test_aging_state_is_pruned_when_jobs_leave_the_window(redis_client):
+    enqueue(redis_client, ('j1', 'cloth-swap'), ('j2', '3d-video'), ('j3', 'story-video'))
+    sched = scheduler(redis_client, resident=(JOB_TYPE_MODELS['story-video'],))
+    sched._claim_next(timeout=0)
+    assert set(sched.skips) == {'j1', 'j2'}
+
+    # Another worker takes the passed-over jobs
+    other = QueueClient(redis_client, WAIT_KEY, 'job-updates', worker_id='worker-b')
+    other.claim()
+    other.claim()
+    enqueue(redis_client, ('j4', 'cloth-swap'))
+    sched._claim_next(timeout=0)
+
+    assert sched.skips == {}
+    assert sched.first_seen == {}
@@ -0,0 +1,125 @@
+import numpy as np
+import cv2
+from typing import Dict, Any, Iterator
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+TRANSITION_TYPES = ('crossfade', 'wipe', 'dissolve', 'dip-to-black', 'cut')
+
+# Transition progress is 8-bit fixed point: 256 == 1.0
+_ONE = 256
+
+
+class TransitionEngine:
+    """Render scene transitions lazily, one frame at a time.
+
+    Each blend frame between two boundary frames is written into its own
+    buffer by a single OpenCV call (addWeighted, copyTo or convertScaleAbs)
+    and yielded as soon as it is ready. Per-frame buffers stay small enough
+    for the allocator to recycle them once the encoder drops them; buffers
+    spanning several 1080p frames are mapped fresh each time and measured
+    slower.
+    """
+
+    def __init__(self, transition_type: str = 'crossfade', num_frames: int = 15, seed: int = 0):
+        if transition_type not in TRANSITION_TYPES:
+            raise ValueError(f"Unknown transition type: {transition_type}")
+
+        self.transition_type = transition_type
+        self.num_frames = 0 if transition_type == 'cut' else max(0, int(num_frames))
+        self.seed = seed
+        self._dissolve_thresholds = None
+
+        self.stats = {'transitions': 0, 'frames': 0, 'seconds': 0.0}
+        # Scene-parallel story rendering runs several transitions at once
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_job_data(cls, job_data: Dict[str, Any]) -> 'TransitionEngine':
+        return cls(
+            transition_type=job_data.get('transition', 'crossfade'),
+            num_frames=job_data.get('transitionFrames', 15)
+        )
+
+    def weights(self) -> np.ndarray:
+        """Fixed-point weight of the incoming frame for each transition frame"""
+        return (np.arange(self.num_frames, dtype=np.uint32) * _ONE // max(self.num_frames, 1)).astype(np.uint16)
+
+    def render(self, frame_a: np.ndarray, frame_b: np.ndarray) -> Iterator[np.ndarray]:
+        """Yield the transition frames between the end of one scene and the start of the next"""
+        if self.num_frames == 0:
+            return
+
+        start = time.perf_counter()
+        weights = self.weights()
+        blend = getattr(self, f"_render_{self.transition_type.replace('-', '_')}")
+
+        elapsed = 0.0
+        for index in range(self.num_frames):
+            # Frames are handed downstream by reference, so each gets its own buffer
+            out = np.empty((1,) + frame_a.shape, dtype=np.uint8)
+            blend(frame_a, frame_b, weights[index:index + 1], out)
+            elapsed += time.perf_counter() - start
+
+            yield out[0]
+            start = time.perf_counter()
+
+        with self._lock:
+            self.stats['transitions'] += 1
+            self.stats['frames'] += self.num_frames
+            self.stats['seconds'] += elapsed
+
+    def _render_crossfade(self, frame_a, frame_b, weights, out):
+        # OpenCV's SIMD float blend; a uint16 fixed-point multiply-add in NumPy
+        # needs several full passes per frame and measured ~3x slower at 1080p
+        for i, w in enumerate(weights):
+            alpha = int(w) / _ONE
+            cv2.addWeighted(frame_a, 1 - alpha, frame_b, alpha, 0, dst=out[i])
+
+    def _render_dissolve(self, frame_a, frame_b, weights, out):
+        # Each pixel switches to the incoming frame once the weight passes its threshold
+        thresholds = self._thresholds(frame_a.shape[:2])
+
+        out[...] = frame_a
+        for i, w in enumerate(weights):
+            mask = (thresholds < w).view(np.uint8)
+            cv2.copyTo(frame_b, mask, out[i])
+
+    def _thresholds(self, shape) -> np.ndarray:
+        """Per-pixel dissolve thresholds for a frame size, shared by concurrent renders"""
+        with self._lock:
+            if self._dissolve_thresholds is None or self._dissolve_thresholds.shape != shape:
+                rng = np.random.default_rng(self.seed)
+                self._dissolve_thresholds = rng.integers(0, _ONE, size=shape, dtype=np.uint16)
+            return self._dissolve_thresholds
+
+    def _render_wipe(self, frame_a, frame_b, weights, out):
+        # Left-to-right wipe: columns before the edge show the incoming frame
+        width = frame_a.shape[1]
+        out[...] = frame_a
+        for i, w in enumerate(weights):
+            edge = int(w) * width // _ONE
+            out[i, :, :edge] = frame_b[:, :edge]
+
+    def _render_dip_to_black(self, frame_a, frame_b, weights, out):
+        # First half fades the outgoing frame to black, second half fades the incoming one in
+        for i, w in enumerate(weights):
+            w = int(w)
+            if w < _ONE // 2:
+                cv2.convertScaleAbs(frame_a, dst=out[i], alpha=(_ONE - 2 * w) / _ONE)
+            else:
+                cv2.convertScaleAbs(frame_b, dst=out[i], alpha=(2 * w - _ONE) / _ONE)
+
+    def get_stats(self) -> Dict[str, Any]:
+        seconds = self.stats['seconds']
+        return {
+            'type': self.transition_type,
+            'length': self.num_frames,
+            'transitions': self.stats['transitions'],
+            'frames': self.stats['frames'],
+            'seconds': seconds,
+            'frames_per_second': self.stats['frames'] / seconds if seconds > 0 else 0.0
+        }
@@ -1,86 +1,270 @@
-import redis
-import json
+import importlib
 import logging
+import os
+import threading
+import time
 import torch
-from typing import Dict, Any
-from processors.image_generator import ImageGenerator
-from processors.cloth_swap import ClothSwapProcessor
-from processors.influencer_creator import InfluencerCreator
-from processors.video_3d import Video3DGenerator
-from processors.study_animation import StudyAnimationGenerator
-from processors.story_video import StoryVideoGenerator
+from typing import Dict, Any, Callable, List, Optional
 from gpu_manager import GPUManager
+from scheduler import JobScheduler
+from queue_client import QueueClient, connect
+from pipeline_stages import StagedWorker
+import progress
+import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize Redis
-redis_client = redis.Redis(
-    host='localhost',
-    port=6379,
-    decode_responses=True
-)
+# Redis client, queue client, GPU manager and scheduler of this worker.
+# Created by configure_worker(), so importing this module (e.g. from the API
+# process supervising a worker pool) doesn't connect to Redis or touch the GPU
+redis_client = None
+queue = None
+gpu_manager = None
+scheduler = None
 
-# Initialize GPU Manager
-gpu_manager = GPUManager(max_vram_mb=7500)
+# Set to stop the worker loop after the current job; the queue client then
+# requeues whatever this worker still has claimed
+stop_event = threading.Event()
+
+# Longest wait between retries while Redis is unreachable
+REDIS_RETRY_MAX_S = float(os.getenv('REDIS_RETRY_MAX_S', 30))
+
+# Processor class per job type as "module:Class". Modules are imported on
+# first use, so diffusers, cv2 and mediapipe aren't loaded at startup
+PROCESSOR_REGISTRY = {
+    'image-generation': 'processors.image_generator:ImageGenerator',
+    'cloth-swap': 'processors.cloth_swap:ClothSwapProcessor',
+    'influencer-creation': 'processors.influencer_creator:InfluencerCreator',
+    '3d-video': 'processors.video_3d:Video3DGenerator',
+    'study-animation': 'processors.study_animation:StudyAnimationGenerator',
+    'story-video': 'processors.story_video:StoryVideoGenerator'
+}
 
 # Initialize processors (lazy loading)
 processors = {}
 
+# Set when PIPELINE_STAGES=1 so /health can report stage stats
+staged_worker = None
+
+# Readiness and warm-up state reported by /health
+service_state = {
+    'ready': False,
+    'warmed_job_types': [],
+    'warmup_seconds': {},
+    'first_job_latency': {},
+    'import_seconds': {}
+}
+
+def processor_class(job_type: str):
+    """Import (once) and return the processor class registered for a job type"""
+    if job_type not in PROCESSOR_REGISTRY:
+        raise ValueError(f"Unknown job type: {job_type}")
+    
+    module_name, class_name = PROCESSOR_REGISTRY[job_type].split(':')
+    start = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if job_type not in service_state['import_seconds']:
+        service_state['import_seconds'][job_type] = time.perf_counter() - start
+    return getattr(module, class_name)
+
+def prewarm_imports(job_types: List[str] = None):
+    """Import processor modules ahead of their first job without loading any model.
+    
+    Defaults to PREWARM_IMPORTS (comma separated job types, or "all").
+    """
+    if job_types is None:
+        names = os.getenv('PREWARM_IMPORTS', '').strip()
+        job_types = list(PROCESSOR_REGISTRY) if names == 'all' else [t.strip() for t in names.split(',') if t.strip()]
+    
+    for job_type in job_types:
+        try:
+            processor_class(job_type)
+        except Exception as e:
+            logger.error(f"Importing the {job_type} processor failed: {str(e)}")
+
+# One lock per job type: the staged worker's prefetch and inference threads
+# may ask for the same processor at once, and it must be built only once
+_processor_locks: Dict[str, threading.Lock] = {}
+_processor_locks_guard = threading.Lock()
+
 def get_processor(job_type: str):
     """Lazy load processors to save VRAM"""
-    if job_type not in processors:
-        logger.info(f"Loading processor for {job_type}")
-        
-        if job_type == 'image-generation':
-            processors[job_type] = ImageGenerator(gpu_manager)
-        elif job_type == 'cloth-swap':
-            processors[job_type] = ClothSwapProcessor(gpu_manager)
-        elif job_type == 'influencer-creation':
-            processors[job_type] = InfluencerCreator(gpu_manager)
-        elif job_type == '3d-video':
-            processors[job_type] = Video3DGenerator(gpu_manager)
-        elif job_type == 'study-animation':
-            processors[job_type] = StudyAnimationGenerator(gpu_manager)
-        elif job_type == 'story-video':
-            processors[job_type] = StoryVideoGenerator(gpu_manager)
-        else:
-            raise ValueError(f"Unknown job type: {job_type}")
+    processor = processors.get(job_type)
+    if processor is not None:
+        return processor
+    
+    with _processor_locks_guard:
+        lock = _processor_locks.setdefault(job_type, threading.Lock())
+    with lock:
+        if job_type not in processors:
+            logger.info(f"Loading processor for {job_type}")
+            processors[job_type] = processor_class(job_type)(gpu_manager)
     
     return processors[job_type]
 
-def process_job(job_data: Dict[str, Any]):
+def shutdown_processors():
+    """Release native resources held by loaded processors"""
+    for job_type, processor in processors.items():
+        if hasattr(processor, 'close'):
+            try:
+                processor.close()
+            except Exception as e:
+                logger.warning(f"Failed to close {job_type} processor: {str(e)}")
+
+def configure_worker(device: Optional[str] = None, num_threads: Optional[int] = None,
+                     max_vram_mb: int = 7500, client=None):
+    """Create this worker's Redis client, queue, GPU manager and scheduler.
+    
+    Binds the worker to a device and CPU thread budget. Called once per
+    worker before any job runs (start_worker does it if nobody has).
+    """
+    global redis_client, queue, gpu_manager, scheduler
+    
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    if device and device.startswith('cuda'):
+        torch.cuda.set_device(device)
+    
+    # Pooled connections shared by every worker thread
+    redis_client = client or connect()
+    # Claims jobs into this worker's processing list and batches status writes
+    queue = QueueClient(redis_client, 'bull:job-queue:wait', 'job-updates')
+    gpu_manager = GPUManager(max_vram_mb=max_vram_mb, device=device)
+    # Model-affinity, micro-batching scheduler over the Bull wait list
+    scheduler = JobScheduler(
+        queue,
+        resident_models=lambda: list(gpu_manager.loaded_models.keys())
+    )
+    processors.clear()
+    logger.info(f"Worker bound to {gpu_manager.device} ({torch.get_num_threads()} CPU threads)")
+
+def warm_up(job_types: List[str] = None, run_inference: bool = None):
+    """Preload processors and models before accepting jobs.
+    
+    Defaults come from WARMUP_JOB_TYPES (comma separated) and WARMUP_INFERENCE.
+    A failed warm-up is logged and the job type is left cold.
+    """
+    if job_types is None:
+        job_types = [t.strip() for t in os.getenv('WARMUP_JOB_TYPES', '').split(',') if t.strip()]
+    if run_inference is None:
+        run_inference = os.getenv('WARMUP_INFERENCE', '1') == '1'
+    
+    for job_type in job_types:
+        start = time.perf_counter()
+        try:
+            processor = get_processor(job_type)
+            if hasattr(processor, 'warmup'):
+                processor.warmup(run_inference)
+        except Exception as e:
+            logger.error(f"Warm-up for {job_type} failed: {str(e)}")
+            continue
+        
+        elapsed = time.perf_counter() - start
+        service_state['warmed_job_types'].append(job_type)
+        service_state['warmup_seconds'][job_type] = elapsed
+        logger.info(f"Warmed up {job_type} in {elapsed:.1f}s")
+
+def record_first_job(job_type: str, seconds: float):
+    """Keep the latency of the first job of each type, cold or warm"""
+    if job_type not in service_state['first_job_latency']:
+        service_state['first_job_latency'][job_type] = {
+            'seconds': seconds,
+            'warm': job_type in service_state['warmed_job_types']
+        }
+        logger.info(f"First {job_type} job took {seconds:.1f}s")
+
+def process_job(job_data: Dict[str, Any], record_wait: bool = True):
     """Process a single job"""
     job_id = job_data.get('jobId')
     job_type = job_data.get('data', {}).get('jobType')
     
+    start = time.perf_counter()
+    if record_wait:
+        metrics.job_started(job_data, gpu_manager.device)
+    else:
+        metrics.reset_peak_memory(gpu_manager.device)
+    
     try:
         logger.info(f"Processing job {job_id} of type {job_type}")
         
         # Update job status
         update_job_status(job_id, 'processing')
+        progress.start(job_id, publish_progress)
         
         # Get processor
         processor = get_processor(job_type)
         
         # Process job
         result = processor.process(job_data['data'])
+        result = {**result, 'timings': progress.finish(job_id)}
         
         # Update job with result
         update_job_status(job_id, 'completed', result)
+        record_first_job(job_type, time.perf_counter() - start)
+        metrics.job_finished(job_type, 'completed', time.perf_counter() - start, result, gpu_manager.device)
         
         logger.info(f"Job {job_id} completed successfully")
         
     except Exception as e:
         logger.error(f"Job {job_id} failed: {str(e)}")
+        progress.finish(job_id)
         update_job_status(job_id, 'failed', error=str(e))
+        metrics.job_finished(job_type, 'failed', time.perf_counter() - start, device=gpu_manager.device)
         
         # Clear GPU memory on error
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
+    
+    metrics.export()
+
+def process_batch(jobs: List[Dict[str, Any]]):
+    """Process a micro-batch of compatible jobs in one processor call"""
+    if len(jobs) == 1:
+        process_job(jobs[0])
+        return
+    
+    job_type = jobs[0]['data'].get('jobType')
+    job_ids = [job.get('jobId') for job in jobs]
+    start = time.perf_counter()
+    for job in jobs:
+        metrics.job_started(job, gpu_manager.device)
+    
+    try:
+        logger.info(f"Processing batch of {len(jobs)} {job_type} jobs: {job_ids}")
+        
+        for job_id in job_ids:
+            update_job_status(job_id, 'processing')
+            progress.start(job_id, publish_progress)
+        
+        processor = get_processor(job_type)
+        results = processor.process_batch([job['data'] for job in jobs])
+        
+    except Exception as e:
+        logger.error(f"Batch {job_ids} failed: {str(e)}, retrying jobs individually")
+        for job_id in job_ids:
+            progress.finish(job_id)
+        
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        
+        for job in jobs:
+            process_job(job, record_wait=False)
+        return
+    
+    # Fan results back out to each job
+    elapsed = time.perf_counter() - start
+    for job_id, result in zip(job_ids, results):
+        result = {**result, 'timings': progress.finish(job_id)}
+        update_job_status(job_id, 'completed', result)
+        metrics.job_finished(job_type, 'completed', elapsed, result, gpu_manager.device)
+    record_first_job(job_type, elapsed)
+    metrics.export()
+    
+    logger.info(f"Batch {job_ids} completed successfully")
 
 def update_job_status(job_id: str, status: str, result: Dict = None, error: str = None):
-    """Update job status in Redis"""
+    """Queue a job status update; completed/failed also releases the job from the processing list"""
     update_data = {
         'status': status,
         'jobId': job_id
@@ -91,28 +275,117 @@ def update_job_status(job_id: str, status: str, result: Dict = None, error: str
     if error:
         update_data['error'] = error
     
-    redis_client.publish('job-updates', json.dumps(update_data))
+    queue.publish(update_data)
+
+def publish_progress(job_id: str, event: Dict[str, Any]):
+    """Publish a progress event (percent, stage, message) for a running job"""
+    queue.publish({'status': 'progress', 'jobId': job_id, **event})
+
+def start_queue(stop) -> bool:
+    """Start the queue client, retrying with backoff while Redis is unreachable; False if stopped first"""
+    delay = 1.0
+    while not stop.is_set():
+        try:
+            queue.start()
+            return True
+        except Exception as e:
+            logger.error(f"Could not start the queue client, retrying in {delay:.0f}s: {str(e)}")
+            stop.wait(delay)
+            delay = min(delay * 2, REDIS_RETRY_MAX_S)
+    return False
 
-def start_worker():
-    """Start the job worker"""
+def stop_queue():
+    """Stop the queue client; if Redis is unreachable, our jobs are requeued once the heartbeat expires"""
+    try:
+        queue.stop()
+    except Exception as e:
+        logger.error(f"Could not stop the queue client cleanly: {str(e)}")
+
+def start_worker(on_ready: Callable[[], None] = None, on_jobs_done: Callable[[int], None] = None,
+                 stop: Optional[Any] = None):
+    """Start the job worker and run until `stop` (default: stop_event) is set.
+    
+    on_ready is called once warm-up is done and the queue client has
+    started, i.e. when the worker can actually take jobs.
+    """
+    global staged_worker
+    
+    stop = stop or stop_event
+    if queue is None:
+        configure_worker()
+    
+    warm_up()
+    if not start_queue(stop):
+        shutdown_processors()
+        return
+    if on_ready:
+        on_ready()
+    
+    # Remaining imports happen after readiness, off the job path
+    threading.Thread(target=prewarm_imports, name='prewarm-imports', daemon=True).start()
     logger.info("GPU Worker started, waiting for jobs...")
     
-    while True:
+    if os.getenv('PIPELINE_STAGES', '0') == '1':
+        # Overlap preprocessing, inference and output of consecutive jobs
+        def job_done(job_type: str, seconds: float):
+            record_first_job(job_type, seconds)
+            if on_jobs_done:
+                on_jobs_done(1)
+        
+        def batch_done(jobs: List[Dict[str, Any]]):
+            process_batch(jobs)
+            if on_jobs_done:
+                on_jobs_done(len(jobs))
+        
+        def requeue_jobs(jobs: List[Dict[str, Any]]):
+            # stop_queue() below moves them from our processing list back to the wait list
+            for job in jobs:
+                queue.publish({'status': 'queued', 'jobId': job.get('jobId'),
+                               'message': 'Requeued on worker shutdown'})
+        
+        staged_worker = StagedWorker(
+            scheduler.next_batch, get_processor, update_job_status, batch_done, job_done,
+            publish_progress=publish_progress, device=gpu_manager.device, requeue_jobs=requeue_jobs
+        )
+        
+        def stop_stages():
+            stop.wait()
+            staged_worker.stop()
+        
+        threading.Thread(target=stop_stages, name='stage-stopper', daemon=True).start()
         try:
-            # Block and wait for jobs from Bull queue
-            # Bull uses Redis lists for queue management
-            job_data = redis_client.blpop('bull:job-queue:wait', timeout=5)
-            
-            if job_data:
-                job_json = json.loads(job_data[1])
-                process_job(job_json)
+            staged_worker.run()
+        finally:
+            stop_queue()
+            shutdown_processors()
+        return
+    
+    delay = 1.0
+    try:
+        while not stop.is_set():
+            try:
+                # Block and wait for jobs from Bull queue
+                # Bull uses Redis lists for queue management
+                jobs = scheduler.next_batch(timeout=5)
+                delay = 1.0
                 
-        except KeyboardInterrupt:
-            logger.info("Worker shutting down...")
-            break
-        except Exception as e:
-            logger.error(f"Worker error: {str(e)}")
-            continue
+                if jobs:
+                    process_batch(jobs)
+                    if on_jobs_done:
+                        on_jobs_done(len(jobs))
+                    
+            except Exception as e:
+                # Back off while Redis is unreachable instead of spinning
+                logger.error(f"Worker error, retrying in {delay:.0f}s: {str(e)}")
+                stop.wait(delay)
+                delay = min(delay * 2, REDIS_RETRY_MAX_S)
+                continue
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info("Worker shutting down...")
+        stop_queue()
+        shutdown_processors()
 
 if __name__ == "__main__":
     start_worker()
@@ -0,0 +1,173 @@
+import json
+import logging
+import multiprocessing as mp
+import os
+import socket
+import tempfile
+import time
+from typing import Dict, Any, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def default_devices() -> List[str]:
+    """One entry per visible GPU, or CPU when CUDA is unavailable"""
+    import torch
+    if torch.cuda.is_available():
+        return [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+    return ["cpu"]
+
+
+def _worker_main(index: int, device: str, num_threads: int, max_vram_mb: int,
+                 ready_count, jobs_done, metrics_path: str, stop_event):
+    """Entry point of a pool worker process"""
+    logging.basicConfig(level=logging.INFO)
+
+    # Each process claims jobs under its own id (and so its own processing list)
+    if os.getenv('WORKER_ID'):
+        os.environ['WORKER_ID'] = f"{os.environ['WORKER_ID']}-{index}"
+
+    # Imported here; configure_worker builds this process's own Redis client,
+    # GPUManager (on the assigned device) and processor cache
+    import worker
+    import metrics
+
+    metrics.set_export_path(metrics_path)
+
+    worker.configure_worker(device=device, num_threads=num_threads, max_vram_mb=max_vram_mb)
+
+    def on_ready():
+        with ready_count.get_lock():
+            ready_count.value += 1
+
+    def on_jobs_done(count: int):
+        with jobs_done.get_lock():
+            jobs_done.value += count
+
+    logger.info(f"Pool worker {index} starting on {device}")
+    worker.start_worker(on_ready=on_ready, on_jobs_done=on_jobs_done, stop=stop_event)
+
+
+class WorkerPool:
+    """Runs N worker processes, each with its own GPUManager bound to a device.
+
+    Workers claim jobs atomically from the shared Redis queue (BLMOVE into
+    a per-worker processing list), so two workers never run the same job.
+    Devices are assigned round-robin and the host's CPU threads are split
+    evenly between workers.
+
+    stop() asks workers to finish their current job and requeue the jobs
+    they still hold before it falls back to terminating them; the jobs of
+    terminated workers are then requeued by the pool.
+    """
+
+    def __init__(self, num_workers: int = None, devices: Optional[List[str]] = None,
+                 cpu_threads: Optional[int] = None, max_vram_mb: int = None):
+        self.num_workers = num_workers or int(os.getenv('WORKER_PROCESSES', 1))
+
+        device_env = os.getenv('WORKER_DEVICES')
+        self.devices = devices or ([d.strip() for d in device_env.split(',')] if device_env else default_devices())
+
+        threads_env = os.getenv('WORKER_CPU_THREADS')
+        self.cpu_threads = cpu_threads or (
+            int(threads_env) if threads_env else max(1, (os.cpu_count() or 1) // self.num_workers)
+        )
+        self.max_vram_mb = max_vram_mb or int(os.getenv('GPU_VRAM_LIMIT', 7500))
+
+        # CUDA cannot be re-initialised in forked children
+        self.ctx = mp.get_context('spawn')
+        self.ready_count = self.ctx.Value('i', 0)
+        self.jobs_done = self.ctx.Value('i', 0)
+        self.stop_event = self.ctx.Event()
+        self.processes: List[mp.Process] = []
+        self.started_at = None
+
+        # Each worker writes its metrics here; /metrics merges them
+        self.metrics_dir = os.getenv('METRICS_DIR') or tempfile.mkdtemp(prefix='gpu-metrics-')
+
+    def assignments(self) -> List[str]:
+        return [self.devices[i % len(self.devices)] for i in range(self.num_workers)]
+
+    @staticmethod
+    def worker_id(index: int, process: mp.Process) -> str:
+        """Queue worker id a pool process claims jobs under (see _worker_main)"""
+        if os.getenv('WORKER_ID'):
+            return f"{os.environ['WORKER_ID']}-{index}"
+        return f"{socket.gethostname()}:{process.pid}"
+
+    def _requeue(self, worker_ids: List[str]):
+        """Put the jobs of terminated workers back instead of waiting for their heartbeats to expire"""
+        from queue_client import QueueClient, connect
+
+        try:
+            queue = QueueClient(connect(), 'bull:job-queue:wait', 'job-updates')
+            for worker_id in worker_ids:
+                moved = queue.requeue(worker_id)
+                queue.redis_client.srem(queue.workers_key, worker_id)
+                if moved:
+                    logger.warning(f"Requeued {moved} jobs of terminated worker {worker_id}")
+        except Exception as e:
+            logger.error(f"Could not requeue jobs of terminated workers (requeued once their heartbeats expire): {str(e)}")
+
+    def start(self):
+        self.started_at = time.monotonic()
+        for index, device in enumerate(self.assignments()):
+            process = self.ctx.Process(
+                target=_worker_main,
+                args=(index, device, self.cpu_threads, self.max_vram_mb, self.ready_count, self.jobs_done,
+                      os.path.join(self.metrics_dir, f"worker-{index}.json"), self.stop_event),
+                name=f"gpu-worker-{index}"
+            )
+            process.start()
+            self.processes.append(process)
+
+        logger.info(
+            f"Started {self.num_workers} workers on {self.assignments()} "
+            f"with {self.cpu_threads} CPU threads each"
+        )
+
+    def stop(self, timeout: float = 30):
+        """Stop workers gracefully, terminating any still running after `timeout` seconds"""
+        self.stop_event.set()
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+
+        terminated = []
+        for index, process in enumerate(self.processes):
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop within {timeout:.0f}s, terminating it")
+                process.terminate()
+                process.join(5)
+                terminated.append(self.worker_id(index, process))
+
+        if terminated:
+            self._requeue(terminated)
+        logger.info("Worker pool stopped")
+
+    def is_ready(self) -> bool:
+        return self.ready_count.value >= self.num_workers
+
+    def collect_metrics(self) -> List[List[Dict[str, Any]]]:
+        """Latest metrics exported by each worker (workers that haven't run a job yet are skipped)"""
+        collected = []
+        for index in range(self.num_workers):
+            path = os.path.join(self.metrics_dir, f"worker-{index}.json")
+            try:
+                with open(path) as f:
+                    collected.append(json.load(f))
+            except (FileNotFoundError, ValueError):
+                continue
+        return collected
+
+    def get_stats(self) -> Dict[str, Any]:
+        elapsed_hours = (time.monotonic() - self.started_at) / 3600 if self.started_at else 0
+        return {
+            'workers': self.num_workers,
+            'alive': sum(process.is_alive() for process in self.processes),
+            'ready': self.ready_count.value,
+            'devices': self.assignments(),
+            'cpu_threads_per_worker': self.cpu_threads,
+            'jobs_done': self.jobs_done.value,
+            'jobs_per_hour': self.jobs_done.value / elapsed_hours if elapsed_hours > 0 else 0.0
+        }